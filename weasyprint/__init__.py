@@ -16,6 +16,7 @@
 from __future__ import division, unicode_literals
 
 import contextlib
+import weakref
 import html5lib
 import cssselect2
 import tinycss2
@@ -27,15 +28,15 @@ __version__ = VERSION
 # Used for 'User-Agent' in HTTP and 'Creator' in PDF
 VERSION_STRING = 'WeasyPrint %s (http://weasyprint.org/)' % VERSION
 
-__all__ = ['HTML', 'CSS', 'Attachment', 'Document', 'Page',
-           'default_url_fetcher', 'VERSION']
+__all__ = ['HTML', 'CSS', 'Attachment', 'Document', 'Page', 'ImageCache',
+           'Renderer', 'default_url_fetcher', 'VERSION']
 
 
 # Import after setting the version, as the version is used in other modules
 from .urls import (fetch, default_url_fetcher, path2url, ensure_url,
                    url_is_absolute)  # noqa
 from .compat import unicode  # noqa
-from .logger import LOGGER  # noqa
+from .logger import LOGGER, count_logs  # noqa
 # Some imports are at the end of the file (after the CSS class)
 # to work around circular imports.
 
@@ -111,7 +112,8 @@ class HTML(object):
         return get_html_metadata(self.wrapper_element, self.base_url)
 
     def render(self, stylesheets=None, enable_hinting=False,
-               presentational_hints=False, font_config=None):
+               presentational_hints=False, font_config=None,
+               image_cache=None):
         """Lay out and paginate the document, but do not (yet) export it
         to PDF or another format.
 
@@ -135,16 +137,46 @@ class HTML(object):
             followed.
         :type font_config: :class:`~fonts.FontConfiguration`
         :param font_config: A font configuration handling @font-face rules.
+        :type image_cache: :class:`~images.ImageCache`
+        :param image_cache: A cache of decoded images shared between renders.
         :returns: A :class:`~document.Document` object.
 
         """
         return Document._render(
             self, stylesheets, enable_hinting, presentational_hints,
-            font_config)
+            font_config, image_cache)
+
+    def render_iter(self, stylesheets=None, enable_hinting=False,
+                    presentational_hints=False, font_config=None,
+                    image_cache=None):
+        """Lay out and paginate the document, yielding the pages as soon as
+        they are laid out.
+
+        Only the pages that are not consumed yet are kept in memory, allowing
+        very long documents to be drawn page by page. As the following pages
+        are unknown:
+
+        * fixed boxes are only repeated on the pages following the page
+          where they are defined,
+        * the margin boxes displaying ``counter(pages)`` are only laid out
+          when the whole document is laid out. The content of their pages,
+          and of all the following pages, is drawn in display lists as soon
+          as it is laid out and its box tree is released. These pages are
+          yielded, in order, once their margin boxes are drawn.
+
+        The parameters are the same as for :meth:`render`.
+
+        :returns:
+            A generator of :class:`~document.Page` objects.
+
+        """
+        return Document._render_pages(
+            self, stylesheets, enable_hinting, presentational_hints,
+            font_config, image_cache, streaming=True)
 
     def write_pdf(self, target=None, stylesheets=None, zoom=1,
                   attachments=None, presentational_hints=False,
-                  font_config=None):
+                  font_config=None, streaming=False, image_cache=None):
         """Render the document to a PDF file.
 
         This is a shortcut for calling :meth:`render`, then
@@ -170,29 +202,43 @@ class HTML(object):
             followed.
         :type font_config: :class:`~fonts.FontConfiguration`
         :param font_config: A font configuration handling @font-face rules.
+        :type image_cache: :class:`~images.ImageCache`
+        :param image_cache: A cache of decoded images shared between renders.
+        :type streaming: bool
+        :param streaming: Whether pages are drawn as soon as they are laid
+            out, with the limitations described in :meth:`render_iter`.
         :returns:
             The PDF as byte string if :obj:`target` is not provided or
             :obj:`None`, otherwise :obj:`None` (the PDF is written to
             :obj:`target`).
 
         """
+        if streaming:
+            return Document._write_streamed_pdf(
+                self, self.render_iter(
+                    stylesheets, enable_hinting=False,
+                    presentational_hints=presentational_hints,
+                    font_config=font_config, image_cache=image_cache),
+                target, zoom, attachments)
         return self.render(
             stylesheets, enable_hinting=False,
             presentational_hints=presentational_hints,
-            font_config=font_config).write_pdf(
+            font_config=font_config, image_cache=image_cache).write_pdf(
                 target, zoom, attachments)
 
     def write_image_surface(self, stylesheets=None, resolution=96,
-                            presentational_hints=False, font_config=None):
+                            presentational_hints=False, font_config=None,
+                            image_cache=None):
         surface, _width, _height = (
             self.render(stylesheets, enable_hinting=True,
                         presentational_hints=presentational_hints,
-                        font_config=font_config)
+                        font_config=font_config, image_cache=image_cache)
             .write_image_surface(resolution))
         return surface
 
     def write_png(self, target=None, stylesheets=None, resolution=96,
-                  presentational_hints=False, font_config=None):
+                  presentational_hints=False, font_config=None,
+                  image_cache=None, band_height=None):
         """Paint the pages vertically to a single PNG image.
 
         There is no decoration around pages other than those specified in CSS
@@ -217,6 +263,12 @@ class HTML(object):
             followed.
         :type font_config: :class:`~fonts.FontConfiguration`
         :param font_config: A font configuration handling @font-face rules.
+        :type image_cache: :class:`~images.ImageCache`
+        :param image_cache: A cache of decoded images shared between renders.
+        :type band_height: int
+        :param band_height: Paint the image in horizontal bands of this
+            height, see :meth:`Document.write_png()
+            <document.Document.write_png>`.
         :returns:
             The image as byte string if :obj:`target` is not provided or
             :obj:`None`, otherwise :obj:`None` (the image is written to
@@ -226,8 +278,8 @@ class HTML(object):
         png_bytes, _width, _height = (
             self.render(stylesheets, enable_hinting=True,
                         presentational_hints=presentational_hints,
-                        font_config=font_config)
-            .write_png(target, resolution))
+                        font_config=font_config, image_cache=image_cache)
+            .write_png(target, resolution, band_height=band_height))
         return png_bytes
 
 
@@ -259,23 +311,72 @@ class CSS(object):
             base_url=base_url, url_fetcher=url_fetcher,
             check_css_mime_type=_check_mime_type)
         with result as (source_type, source, base_url, protocol_encoding):
-            if source_type == 'string' and not isinstance(source, bytes):
-                # unicode, no encoding
-                stylesheet = tinycss2.parse_stylesheet(source)
-            else:
-                if source_type == 'file_obj':
-                    source = source.read()
-                stylesheet, encoding = tinycss2.parse_stylesheet_bytes(
-                    source, environment_encoding=encoding,
-                    protocol_encoding=protocol_encoding)
+            if source_type == 'file_obj':
+                source = source.read()
         self.base_url = base_url
-        self.matcher = matcher or cssselect2.Matcher()
-        self.page_rules = [] if page_rules is None else page_rules
         # TODO: fonts are stored here and should be cleaned after rendering
         self.fonts = []
-        preprocess_stylesheet(
-            media_type, base_url, stylesheet, url_fetcher, self.matcher,
-            self.page_rules, self.fonts, font_config)
+        # The (rule_descriptors, url_fetcher) tuples of the @font-face rules
+        self.font_faces = []
+
+        # Imported stylesheets share the matcher and the page rules of the
+        # stylesheet importing them, only cache the other ones
+        cache_key = None
+        if matcher is None and page_rules is None:
+            cache_key = STYLESHEET_CACHE.make_key(
+                source, base_url, encoding, protocol_encoding, media_type,
+                url_fetcher)
+            cached = STYLESHEET_CACHE.get(cache_key)
+            if cached is not None:
+                self.matcher, self.page_rules, self.font_faces, fonts = cached
+                if font_config is not None and self.font_faces:
+                    # Only add the font faces to configurations that don't
+                    # have them yet
+                    if font_config not in fonts:
+                        fonts[font_config] = [
+                            font_filename for font_filename in (
+                                font_config.add_font_face(*font_face)
+                                for font_face in self.font_faces)
+                            if font_filename]
+                    self.fonts.extend(fonts[font_config])
+                return
+
+        if isinstance(source, bytes):
+            stylesheet, encoding = tinycss2.parse_stylesheet_bytes(
+                source, environment_encoding=encoding,
+                protocol_encoding=protocol_encoding)
+        else:
+            # unicode, no encoding
+            stylesheet = tinycss2.parse_stylesheet(source)
+        self.matcher = matcher or Matcher()
+        self.page_rules = [] if page_rules is None else page_rules
+        recorder = FontFaceRecorder(font_config)
+        # The content of imported stylesheets is not part of the cache key,
+        # stylesheets importing other ones are not cached
+        if cache_key is not None and any(
+                rule.type == 'at-rule' and rule.lower_at_keyword == 'import'
+                for rule in stylesheet):
+            cache_key = None
+        if cache_key is None:
+            preprocess_stylesheet(
+                media_type, base_url, stylesheet, url_fetcher, self.matcher,
+                self.page_rules, self.fonts, recorder)
+        else:
+            # Stylesheets with errors are not cached, so that their errors
+            # are logged each time they are used
+            with count_logs() as logs:
+                preprocess_stylesheet(
+                    media_type, base_url, stylesheet, url_fetcher,
+                    self.matcher, self.page_rules, self.fonts, recorder)
+            if not logs.count:
+                # The fonts added to each font configuration
+                fonts = weakref.WeakKeyDictionary()
+                if font_config is not None:
+                    fonts[font_config] = list(self.fonts)
+                STYLESHEET_CACHE.set(cache_key, (
+                    self.matcher, self.page_rules, recorder.font_faces,
+                    fonts))
+        self.font_faces = recorder.font_faces
 
 
 class Attachment(object):
@@ -298,6 +399,111 @@ class Attachment(object):
         self.description = description
 
 
+class Renderer(object):
+    """Renders many documents sharing the same resources.
+
+    Rendering documents one by one with :meth:`HTML.render` or
+    :meth:`HTML.write_pdf` creates a new font configuration and new Pango
+    contexts for each document. A renderer keeps these objects, parses its
+    user stylesheets once and caches the decoded images, and uses them for
+    all the documents it renders.
+
+    The fonts of the ``@font-face`` rules of the user stylesheets are shared.
+    The ones of the documents are only available in the document declaring
+    them, a font configuration is created for each document declaring
+    ``@font-face`` rules. A renderer must not be used by multiple threads at
+    once.
+
+    :param stylesheets:
+        An optional list of user stylesheets, applied to all the documents.
+        List elements are :class:`CSS` objects, filenames, URLs, or file-like
+        objects. (See :ref:`stylesheet-origins`.)
+    :type presentational_hints: bool
+    :param presentational_hints: Whether HTML presentational hints are
+        followed.
+    :type font_config: :class:`~fonts.FontConfiguration`
+    :param font_config: The font configuration shared by the documents,
+        handling the @font-face rules of the user stylesheets. Defaults to a
+        new configuration.
+    :type image_cache: :class:`~images.ImageCache`
+    :param image_cache: A cache of decoded images. Defaults to a new cache.
+    :param url_fetcher: The ``url_fetcher`` used for the sources that are
+        not :class:`HTML` objects and for the user stylesheets.
+    :param media_type: The media type used for the sources that are not
+        :class:`HTML` objects and for the user stylesheets.
+
+    """
+    def __init__(self, stylesheets=None, presentational_hints=False,
+                 font_config=None, image_cache=None,
+                 url_fetcher=default_url_fetcher, media_type='print'):
+        if font_config is None:
+            font_config = FontConfiguration()
+        if image_cache is None:
+            image_cache = ImageCache()
+        self.font_config = font_config
+        self.image_cache = image_cache
+        self.pango_context_pool = PangoContextPool()
+        self.presentational_hints = presentational_hints
+        self.url_fetcher = url_fetcher
+        self.media_type = media_type
+        self.stylesheets = [
+            css if hasattr(css, 'matcher')
+            else CSS(guess=css, url_fetcher=url_fetcher,
+                     media_type=media_type, font_config=font_config)
+            for css in stylesheets or []]
+        self._font_faces = [
+            font_face for css in self.stylesheets
+            for font_face in css.font_faces]
+        # Stylesheets given as CSS objects may use another configuration
+        for rule_descriptors, fetcher in self._font_faces:
+            font_config.add_font_face(rule_descriptors, fetcher)
+
+    def render(self, source, enable_hinting=False):
+        """Lay out and paginate a document.
+
+        :param source:
+            An :class:`HTML` object, or a filename, an absolute URL or a
+            file-like object guessed as ``HTML(source)`` does.
+        :type enable_hinting: bool
+        :param enable_hinting: See :meth:`HTML.render`.
+        :returns: A :class:`~document.Document` object.
+
+        """
+        if not isinstance(source, HTML):
+            source = HTML(
+                source, url_fetcher=self.url_fetcher,
+                media_type=self.media_type)
+        font_config = DocumentFontConfiguration(
+            self.font_config, self._font_faces)
+        return Document._render(
+            source, self.stylesheets, enable_hinting,
+            self.presentational_hints, font_config, self.image_cache,
+            self.pango_context_pool)
+
+    def render_many(self, sources, enable_hinting=False):
+        """Lay out and paginate documents, one after the other.
+
+        :param sources: An iterable of sources accepted by :meth:`render`.
+        :type enable_hinting: bool
+        :param enable_hinting: See :meth:`HTML.render`.
+        :returns:
+            A generator of :class:`~document.Document` objects, in the order
+            of :obj:`sources`.
+
+        """
+        for source in sources:
+            yield self.render(source, enable_hinting)
+
+    def write_pdf(self, source, target=None, zoom=1, attachments=None):
+        """Render a document to a PDF file.
+
+        This is a shortcut for calling :meth:`render`, then
+        :meth:`Document.write_pdf() <document.Document.write_pdf>`.
+
+        """
+        return self.render(source).write_pdf(target, zoom, attachments)
+
+
 @contextlib.contextmanager
 def _select_source(guess=None, filename=None, url=None, file_obj=None,
                    string=None, base_url=None, url_fetcher=default_url_fetcher,
@@ -372,8 +578,12 @@ def _select_source(guess=None, filename=None, url=None, file_obj=None,
         raise TypeError('Expected exactly one source, got ' + sources_names)
 
 # Work around circular imports.
-from .css import preprocess_stylesheet  # noqa
+from .css import (  # noqa
+    STYLESHEET_CACHE, FontFaceRecorder, Matcher, preprocess_stylesheet)
 from .html import (
     find_base_url, HTML5_UA_STYLESHEET, HTML5_PH_STYLESHEET,
     get_html_metadata)  # noqa
 from .document import Document, Page  # noqa
+from .images import ImageCache  # noqa
+from .fonts import DocumentFontConfiguration, FontConfiguration  # noqa
+from .text import PangoContextPool  # noqa
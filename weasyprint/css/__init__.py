@@ -20,7 +20,9 @@
 
 from __future__ import division, unicode_literals
 
-from collections import namedtuple
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
 
 import cssselect2
 import tinycss2
@@ -54,6 +56,9 @@ class StyleDict(dict):
     # - removing paddings and margins from tables,
     # - modifying borders for table cells with collapsing borders, and
     # - setting viewports and pages overflow.
+    # As elements can share the same computed style, the style must be
+    # copied before being modified, unless the modification only depends on
+    # the style itself.
 
     # TODO: We should remove that. Some attributes (eg. "clear") exist as
     # dict methods and can only be accessed with getitem.
@@ -101,7 +106,7 @@ def get_child_text(element):
 
 
 def find_stylesheets(wrapper_element, device_media_type, url_fetcher, base_url,
-                     font_config, page_rules):
+                     font_config):
     """Yield the stylesheets in ``element_tree``.
 
     The output order is the same as the source order.
@@ -128,7 +133,7 @@ def find_stylesheets(wrapper_element, device_media_type, url_fetcher, base_url,
             css = CSS(
                 string=content, base_url=base_url,
                 url_fetcher=url_fetcher, media_type=device_media_type,
-                font_config=font_config, page_rules=page_rules)
+                font_config=font_config)
             yield css
         elif element.tag == 'link' and element.get('href'):
             if not element_has_link_type(element, 'stylesheet') or \
@@ -140,7 +145,7 @@ def find_stylesheets(wrapper_element, device_media_type, url_fetcher, base_url,
                     yield CSS(
                         url=href, url_fetcher=url_fetcher,
                         _check_mime_type=True, media_type=device_media_type,
-                        font_config=font_config, page_rules=page_rules)
+                        font_config=font_config)
                 except URLFetchingError as exc:
                     LOGGER.error(
                         'Failed to load stylesheet at %s : %s', href, exc)
@@ -498,14 +503,41 @@ def add_declaration(cascaded_styles, prop_name, prop_values, weight, element,
         style[prop_name] = prop_values, weight
 
 
+def style_sharing_key(cascaded, parent_style, pseudo_type):
+    """Return a key identifying the computed style of an element.
+
+    Elements with the same key have the same computed style: they have the
+    same cascaded values and the same parent style. Return ``None`` when the
+    computed style depends on the element's attributes.
+
+    """
+    for name in ('anchor', 'link', 'lang'):
+        if name in cascaded:
+            return None
+    if 'content' in cascaded:
+        values, _precedence = cascaded['content']
+        if values not in ('normal', 'none') and any(
+                type_ == 'attr' for type_, _value in values):
+            return None
+    # Cascaded values are shared by the elements matched by the same rules
+    return id(parent_style), pseudo_type, frozenset(
+        (name, id(value)) for name, (value, _precedence)
+        in iteritems(cascaded))
+
+
 def set_computed_styles(cascaded_styles, computed_styles, element, parent,
-                        root=None, pseudo_type=None, base_url=None):
+                        root=None, pseudo_type=None, base_url=None,
+                        style_cache=None):
     """Set the computed values of styles to ``element``.
 
     Take the properties left by ``apply_style_rule`` on an element or
     pseudo-element and assign computed values with respect to the cascade,
     declaration priority (ie. ``!important``) and selector specificity.
 
+    ``style_cache`` is an optional dict used to share the computed styles
+    between elements, with keys given by :func:`style_sharing_key`. It must
+    not outlive ``cascaded_styles`` and ``computed_styles``.
+
     """
     if element == root and pseudo_type is None:
         assert parent is None
@@ -521,8 +553,16 @@ def set_computed_styles(cascaded_styles, computed_styles, element, parent,
         root_style = computed_styles[root, None]
 
     cascaded = cascaded_styles.get((element, pseudo_type), {})
-    computed_styles[element, pseudo_type] = computed_from_cascaded(
+    key = None
+    if style_cache is not None and parent_style is not None:
+        key = style_sharing_key(cascaded, parent_style, pseudo_type)
+        if key in style_cache:
+            computed_styles[element, pseudo_type] = style_cache[key]
+            return
+    style = computed_styles[element, pseudo_type] = computed_from_cascaded(
         element, cascaded, parent_style, pseudo_type, root_style, base_url)
+    if key is not None:
+        style_cache[key] = style
 
 
 def computed_from_cascaded(element, cascaded, parent_style, pseudo_type=None,
@@ -586,6 +626,195 @@ def computed_from_cascaded(element, cascaded, parent_style, pseudo_type=None,
         base_url))
 
 
+class Matcher(object):
+    """Selectors storage matching HTML elements, with profiling counters.
+
+    Selectors are indexed by id, class, tag name and namespace when they are
+    added, only the selectors relevant for an element are tested against it.
+    This is the indexing of :class:`cssselect2.Matcher`, the selectors are
+    counted while they are tested.
+
+    """
+    def __init__(self):
+        self.id_selectors = {}
+        self.class_selectors = {}
+        self.lower_local_name_selectors = {}
+        self.namespace_selectors = {}
+        self.lang_attr_selectors = []
+        self.other_selectors = []
+        self.order = 0
+        #: Number of selectors tested against elements
+        self.tested_selectors = 0
+        #: Number of elements matched
+        self.matched_elements = 0
+
+    def add_selector(self, selector, payload):
+        """Add a selector and its payload to the matcher.
+
+        ``selector`` is a :class:`cssselect2.compiler.CompiledSelector`
+        object, ``payload`` is returned as-is by :meth:`match`.
+
+        """
+        self.order += 1
+        # Attributes not given by older versions of cssselect2
+        if getattr(selector, 'never_matches', False):
+            return
+        entry = (
+            selector.test, selector.specificity, self.order,
+            selector.pseudo_element, payload)
+        if selector.id is not None:
+            self.id_selectors.setdefault(selector.id, []).append(entry)
+        elif selector.class_name is not None:
+            self.class_selectors.setdefault(
+                selector.class_name, []).append(entry)
+        elif selector.local_name is not None:
+            self.lower_local_name_selectors.setdefault(
+                selector.lower_local_name, []).append(entry)
+        elif selector.namespace is not None:
+            self.namespace_selectors.setdefault(
+                selector.namespace, []).append(entry)
+        elif getattr(selector, 'requires_lang_attr', False):
+            self.lang_attr_selectors.append(entry)
+        else:
+            self.other_selectors.append(entry)
+
+    def match(self, element):
+        """Match the selectors against ``element``.
+
+        ``element`` is a :class:`cssselect2.ElementWrapper` object. Return a
+        list of ``(specificity, order, pseudo_type, payload)`` tuples for the
+        matching selectors, from the lowest to the highest specificity and in
+        the order of :meth:`add_selector`.
+
+        """
+        self.matched_elements += 1
+        relevant_selectors = []
+        if element.id is not None and element.id in self.id_selectors:
+            self._add_relevant_selectors(
+                element, self.id_selectors[element.id], relevant_selectors)
+        for class_name in element.classes:
+            if class_name in self.class_selectors:
+                self._add_relevant_selectors(
+                    element, self.class_selectors[class_name],
+                    relevant_selectors)
+        lower_name = ascii_lower(element.local_name)
+        if lower_name in self.lower_local_name_selectors:
+            self._add_relevant_selectors(
+                element, self.lower_local_name_selectors[lower_name],
+                relevant_selectors)
+        if element.namespace_url in self.namespace_selectors:
+            self._add_relevant_selectors(
+                element, self.namespace_selectors[element.namespace_url],
+                relevant_selectors)
+        if 'lang' in element.etree_element.attrib:
+            self._add_relevant_selectors(
+                element, self.lang_attr_selectors, relevant_selectors)
+        self._add_relevant_selectors(
+            element, self.other_selectors, relevant_selectors)
+        relevant_selectors.sort()
+        return relevant_selectors
+
+    def _add_relevant_selectors(self, element, selectors, relevant_selectors):
+        self.tested_selectors += len(selectors)
+        for test, specificity, order, pseudo_type, payload in selectors:
+            if test(element):
+                relevant_selectors.append(
+                    (specificity, order, pseudo_type, payload))
+
+
+class StylesheetCache(object):
+    """Process-wide cache of preprocessed stylesheets.
+
+    Stylesheets are identified by their content, their base URL, their
+    encoding, the media type and the URL fetcher used to load them. The
+    matcher, the ``@page`` rules and the ``@font-face`` rules of the
+    ``max_size`` stylesheets used most recently are kept, and shared by the
+    :class:`CSS` objects created with the same stylesheet.
+
+    Stylesheets importing other ones or imported by another one are not
+    cached, as the content of imported stylesheets is not part of the key.
+
+    """
+    def __init__(self, max_size=32):
+        #: Maximum number of stylesheets in the cache
+        self.max_size = max_size
+        #: Number of stylesheets found in the cache
+        self.hits = 0
+        #: Number of stylesheets not found in the cache
+        self.misses = 0
+        self._stylesheets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._stylesheets)
+
+    def keys(self):
+        """Return the keys of the cached stylesheets, oldest first."""
+        with self._lock:
+            return list(self._stylesheets)
+
+    @staticmethod
+    def make_key(source, base_url, encoding, protocol_encoding, media_type,
+                 url_fetcher):
+        """Return the key of a stylesheet."""
+        if not isinstance(source, bytes):
+            source = source.encode('utf-8')
+        return (
+            hashlib.sha1(source).hexdigest(), base_url, encoding,
+            protocol_encoding, media_type, url_fetcher)
+
+    def get(self, key):
+        """Return the ``(matcher, page_rules, font_faces, fonts)`` of a
+        stylesheet, or :obj:`None` if it is not cached.
+
+        ``fonts`` is a :class:`weakref.WeakKeyDictionary` mapping the font
+        configurations where the font faces are already added to the font
+        filenames they returned.
+
+        """
+        with self._lock:
+            stylesheet = self._stylesheets.pop(key, None)
+            if stylesheet is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._stylesheets[key] = stylesheet
+            return stylesheet
+
+    def set(self, key, stylesheet):
+        """Cache the ``(matcher, page_rules, font_faces, fonts)`` of a
+        stylesheet.
+
+        """
+        with self._lock:
+            self._stylesheets.pop(key, None)
+            self._stylesheets[key] = stylesheet
+            while len(self._stylesheets) > self.max_size:
+                self._stylesheets.popitem(last=False)
+
+    def clear(self):
+        """Remove all the stylesheets and reset the counters."""
+        with self._lock:
+            self._stylesheets.clear()
+            self.hits = self.misses = 0
+
+
+STYLESHEET_CACHE = StylesheetCache()
+
+
+class FontFaceRecorder(object):
+    """Font configuration proxy keeping the added ``@font-face`` rules."""
+    def __init__(self, font_config):
+        self.font_config = font_config
+        self.font_faces = []
+
+    def add_font_face(self, rule_descriptors, url_fetcher):
+        self.font_faces.append((rule_descriptors, url_fetcher))
+        if self.font_config is not None:
+            return self.font_config.add_font_face(
+                rule_descriptors, url_fetcher)
+
+
 def preprocess_stylesheet(device_media_type, base_url, stylesheet_rules,
                           url_fetcher, matcher, page_rules, fonts,
                           font_config, ignore_imports=False):
@@ -767,8 +996,7 @@ def parse_media_query(tokens):
 
 
 def get_all_computed_styles(html, user_stylesheets=None,
-                            presentational_hints=False, font_config=None,
-                            page_rules=None):
+                            presentational_hints=False, font_config=None):
     """Compute all the computed styles of all elements in ``html`` document.
 
     Do everything from finding author stylesheets to parsing and applying them.
@@ -786,7 +1014,7 @@ def get_all_computed_styles(html, user_stylesheets=None,
             sheets.append((sheet, 'author', (0, 0, 0)))
     for sheet in find_stylesheets(
             html.wrapper_element, html.media_type, html.url_fetcher,
-            html.base_url, font_config, page_rules):
+            html.base_url, font_config):
         sheets.append((sheet, 'author', None))
     for sheet in (user_stylesheets or []):
         sheets.append((sheet, 'user', None))
@@ -823,8 +1051,18 @@ def get_all_computed_styles(html, user_stylesheets=None,
     # tree order*. Tree order is important so that parents have computed
     # styles before their children, for inheritance.
 
+    # keys: keys given by style_sharing_key()
+    # values: StyleDict objects shared by elements with the same key
+    style_cache = {}
+
     # Iterate on all elements, even if there is no cascaded style for them.
+    matchers = {id(sheet.matcher): sheet.matcher for sheet, _, _ in sheets}
+    matchers = list(matchers.values())
+    tested_selectors = -sum(
+        getattr(matcher, 'tested_selectors', 0) for matcher in matchers)
+    elements = 0
     for element in html.wrapper_element.iter_subtree():
+        elements += 1
         for sheet, origin, sheet_specificity in sheets:
             # Add declarations for matched elements
             for selector in sheet.matcher.match(element):
@@ -840,7 +1078,13 @@ def get_all_computed_styles(html, user_stylesheets=None,
             cascaded_styles, computed_styles, element.etree_element,
             root=html.etree_element,
             parent=(element.parent.etree_element if element.parent else None),
-            base_url=html.base_url)
+            base_url=html.base_url, style_cache=style_cache)
+
+    tested_selectors += sum(
+        getattr(matcher, 'tested_selectors', 0) for matcher in matchers)
+    LOGGER.debug(
+        'Step 3 - %i selectors tested for %i elements (%.1f per element)',
+        tested_selectors, elements, tested_selectors / elements)
 
     page_names = set(style['page'] for style in computed_styles.values())
 
@@ -873,7 +1117,7 @@ def get_all_computed_styles(html, user_stylesheets=None,
                 pseudo_type=pseudo_type,
                 # The pseudo-element inherits from the element.
                 root=html.etree_element, parent=element,
-                base_url=html.base_url)
+                base_url=html.base_url, style_cache=style_cache)
 
     # This is mostly useful to make pseudo_type optional.
     def style_for(element, pseudo_type=None, __get=computed_styles.get):
@@ -898,3 +1142,7 @@ def get_all_computed_styles(html, user_stylesheets=None,
         return style
 
     return style_for, cascaded_styles, computed_styles
+
+
+# Work around circular imports.
+from ..html import ascii_lower  # noqa
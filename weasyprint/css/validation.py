@@ -1487,6 +1487,17 @@ def anchor(token):
             return (name, args[0])
 
 
+@validator(proprietary=True)
+@single_token
+def table_sample_rows(token):
+    """Validation for ``table-sample-rows``."""
+    if get_keyword(token) == 'none':
+        return 'none'
+    elif token.type == 'number' and token.int_value is not None:
+        if token.int_value >= 1:
+            return token.int_value
+
+
 @validator(proprietary=True, wants_base_url=True)
 @single_token
 def link(token, base_url):
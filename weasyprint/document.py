@@ -10,17 +10,19 @@
 
 from __future__ import division, unicode_literals
 
+import collections
 import functools
 import io
 import math
 import shutil
+import tempfile
 
 import cairocffi as cairo
 
-from . import CSS
-from .compat import FILESYSTEM_ENCODING, iteritems, izip
+from . import CSS, png
+from .compat import FILESYSTEM_ENCODING, iteritems, izip, xrange
 from .css import get_all_computed_styles
-from .draw import draw_page, stacked
+from .draw import draw_margin_boxes, draw_page, stacked
 from .fonts import FontConfiguration
 from .formatting_structure import boxes
 from .formatting_structure.build import build_formatting_structure
@@ -29,6 +31,12 @@ from .layout import layout_document
 from .layout.backgrounds import percentage
 from .logger import LOGGER
 from .pdf import write_pdf_metadata
+from .text import PangoContextPool
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:  # Python 2 without the futures backport
+    ProcessPoolExecutor = None
 
 
 def _get_matrix(box):
@@ -191,6 +199,53 @@ class Page(object):
             page_box, bookmarks, links, anchors, matrix=None)
         self._page_box = page_box
         self._enable_hinting = enable_hinting
+        self._display_list = None
+
+    def record(self, release_boxes=True):
+        """Paint the page in a display list.
+
+        Once recorded, the page is painted by replaying the display list on
+        any surface at any scale, without walking its box tree again. Painting
+        the same page in multiple formats then only draws its boxes once.
+
+        The box tree of the page, including the Pango layouts of its text, is
+        not needed anymore. If ``release_boxes`` is true, it is released and
+        the memory it uses can be freed. The links, anchors and bookmarks of
+        the page are kept.
+
+        The display list is recorded in CSS pixels: for pages rendered with
+        hinting, text and borders are hinted for 96 dpi outputs.
+
+        """
+        if self._display_list is None:
+            surface = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, None)
+            draw_page(
+                self._page_box, cairo.Context(surface), self._enable_hinting)
+            self._display_list = surface
+        if release_boxes:
+            self._page_box = None
+
+    def _record_content(self):
+        """Record a page whose margin boxes are not laid out yet.
+
+        The box tree of the page content is released, only the page box is
+        kept for its margin boxes, see :meth:`_draw_margin_boxes`.
+
+        """
+        self.record(release_boxes=False)
+        root, = self._page_box.children
+        self._page_box.children = [root.copy_with_children([])]
+
+    def _draw_margin_boxes(self):
+        """Draw the margin boxes added to a page over its recorded content."""
+        draw_margin_boxes(
+            self._page_box, cairo.Context(self._display_list),
+            self._enable_hinting)
+        for box in self._page_box.children:
+            if isinstance(box, boxes.MarginBox):
+                _gather_links_and_bookmarks(
+                    box, self.bookmarks, self.links, self.anchors,
+                    matrix=None)
 
     def paint(self, cairo_context, left_x=0, top_y=0, scale=1, clip=False):
         """Paint the page in cairo, on any type of surface.
@@ -236,7 +291,12 @@ class Page(object):
                         cairo_context.device_to_user_distance(width, height))
                 cairo_context.rectangle(0, 0, width, height)
                 cairo_context.clip()
-            draw_page(self._page_box, cairo_context, self._enable_hinting)
+            if self._display_list is None:
+                draw_page(
+                    self._page_box, cairo_context, self._enable_hinting)
+            else:
+                cairo_context.set_source_surface(self._display_list)
+                cairo_context.paint()
 
 
 class DocumentMetadata(object):
@@ -292,6 +352,74 @@ class DocumentMetadata(object):
         self.attachments = attachments or []
 
 
+# Size of the PDF files kept in memory before being written in a temporary
+# file, when the target can't be used to add metadata
+PDF_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+
+def _png_page_result(page, recorded, future):
+    """Return the result of ``future``, painting ``page`` in a PNG image.
+
+    The display list of ``page`` is released if it has been recorded only to
+    submit the page to the executor.
+
+    """
+    result = future.result()
+    if recorded:
+        page._display_list = None
+    return result
+
+
+def _write_page_png(page, resolution):
+    """Paint ``page`` in a PNG image, return ``(png_bytes, width, height)``."""
+    dppx = resolution / 96
+    width = int(math.ceil(page.width * dppx))
+    height = int(math.ceil(page.height * dppx))
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    page.paint(cairo.Context(surface), scale=dppx, clip=True)
+    file_obj = io.BytesIO()
+    surface.write_to_png(file_obj)
+    return file_obj.getvalue(), width, height
+
+
+def _can_update_in_place(file_obj):
+    """Tell whether ``file_obj`` can be used to write and update a PDF file."""
+    try:
+        return (
+            file_obj.readable() and file_obj.seekable() and
+            file_obj.tell() == 0)
+    except (AttributeError, IOError, ValueError):
+        return False
+
+
+def _write_to_target(target, write):
+    """Call ``write`` with a file object, whose content is put in ``target``.
+
+    The file object given to ``write`` is readable, seekable and positioned
+    at its start. It is ``target`` itself when possible, a temporary file
+    otherwise.
+
+    :returns:
+        The file content as byte string if :obj:`target` is :obj:`None`,
+        otherwise :obj:`None`.
+
+    """
+    if target is None:
+        file_obj = io.BytesIO()
+        write(file_obj)
+        return file_obj.getvalue()
+    elif not hasattr(target, 'write'):
+        with open(target, 'w+b') as file_obj:
+            write(file_obj)
+    elif _can_update_in_place(target):
+        write(target)
+    else:
+        with tempfile.SpooledTemporaryFile(PDF_SPOOL_MAX_SIZE) as file_obj:
+            write(file_obj)
+            file_obj.seek(0)
+            shutil.copyfileobj(file_obj, target)
+
+
 class Document(object):
     """A rendered document, with access to individual pages
     ready to be painted on any cairo surfaces.
@@ -303,31 +431,92 @@ class Document(object):
 
     """
     @classmethod
-    def _render(cls, html, stylesheets, enable_hinting,
-                presentational_hints=False, font_config=None):
+    def _render_pages(cls, html, stylesheets, enable_hinting,
+                      presentational_hints=False, font_config=None,
+                      image_cache=None, streaming=False,
+                      pango_context_pool=None):
+        """Yield the :class:`Page` objects of ``html``.
+
+        See :func:`layout.layout_document` for ``streaming`` and
+        ``pango_context_pool``.
+
+        """
         if font_config is None:
             font_config = FontConfiguration()
-        page_rules = []
         style_for, cascaded_styles, computed_styles = get_all_computed_styles(
             html, presentational_hints=presentational_hints, user_stylesheets=[
                 css if hasattr(css, 'matcher')
                 else CSS(guess=css, media_type=html.media_type)
                 for css in stylesheets or []],
-            font_config=font_config, page_rules=page_rules)
+            font_config=font_config)
         get_image_from_uri = functools.partial(
-            original_get_image_from_uri, {}, html.url_fetcher)
+            original_get_image_from_uri, {}, html.url_fetcher,
+            image_cache=image_cache)
         LOGGER.info('Step 4 - Creating formatting structure')
         page_boxes = layout_document(
             enable_hinting, style_for, get_image_from_uri,
             build_formatting_structure(
                 html.etree_element, style_for, get_image_from_uri,
                 html.base_url),
-            font_config, html, cascaded_styles, computed_styles)
+            font_config, html, cascaded_styles, computed_styles, streaming,
+            pango_context_pool)
+        if not streaming:
+            for page_box in page_boxes:
+                yield Page(page_box, enable_hinting)
+            return
+
+        # Pages are yielded in order: once a page waits for its margin boxes,
+        # the following pages are recorded and their box trees are released
+        # until the margin boxes are laid out, at the end of the layout.
+        deferred_pages = []
+        for page_number, page_box in enumerate(page_boxes, 1):
+            page = Page(page_box, enable_hinting)
+            if page_box.margin_boxes_pending:
+                if not deferred_pages:
+                    LOGGER.debug(
+                        'Streaming: page %i needs the number of pages, '
+                        'the next pages are held until the end', page_number)
+                page._record_content()
+            elif deferred_pages:
+                page.record()
+            else:
+                yield page
+                continue
+            deferred_pages.append((page, page_box.margin_boxes_pending))
+        for page, margin_boxes_pending in deferred_pages:
+            if margin_boxes_pending:
+                page._draw_margin_boxes()
+            yield page
+
+    @classmethod
+    def _render(cls, html, stylesheets, enable_hinting,
+                presentational_hints=False, font_config=None,
+                image_cache=None, pango_context_pool=None):
+        if pango_context_pool is None:
+            pango_context_pool = PangoContextPool()
+        layouts_created = pango_context_pool.layouts_created
+        pages = list(cls._render_pages(
+            html, stylesheets, enable_hinting, presentational_hints,
+            font_config, image_cache, pango_context_pool=pango_context_pool))
         rendering = cls(
-            [Page(p, enable_hinting) for p in page_boxes],
-            DocumentMetadata(**html._get_metadata()), html.url_fetcher)
+            pages, DocumentMetadata(**html._get_metadata()), html.url_fetcher)
+        rendering.layouts_created = (
+            pango_context_pool.layouts_created - layouts_created)
         return rendering
 
+    @classmethod
+    def _write_streamed_pdf(cls, html, pages, target, zoom, attachments):
+        """Draw ``pages`` as soon as they are rendered in a PDF file.
+
+        The box trees of the pages are released once they are drawn.
+
+        """
+        document = cls(
+            [], DocumentMetadata(**html._get_metadata()), html.url_fetcher)
+        return _write_to_target(target, functools.partial(
+            document._write_pdf, scale=zoom * 0.75, attachments=attachments,
+            streamed_pages=pages))
+
     def __init__(self, pages, metadata, url_fetcher):
         #: A list of :class:`Page` objects.
         self.pages = pages
@@ -338,6 +527,9 @@ class Document(object):
         #: A ``url_fetcher`` for resources that have to be read when writing
         #: the output.
         self.url_fetcher = url_fetcher
+        #: The number of Pango layouts created to lay out the document, or
+        #: :obj:`None` if unknown.
+        self.layouts_created = None
 
     def copy(self, pages='all'):
         """Take a subset of the pages.
@@ -374,6 +566,15 @@ class Document(object):
             pages = list(pages)
         return type(self)(pages, self.metadata, self.url_fetcher)
 
+    def record(self, release_boxes=True):
+        """Paint all the pages in display lists.
+
+        See :meth:`Page.record`.
+
+        """
+        for page in self.pages:
+            page.record(release_boxes)
+
     def resolve_links(self):
         """Resolve internal hyperlinks.
 
@@ -454,14 +655,17 @@ class Document(object):
                 last_by_depth.append(children)
         return root
 
-    def write_pdf(self, target=None, zoom=1, attachments=None):
+    def write_pdf(self, target=None, zoom=1, attachments=None,
+                  release_boxes=False):
         """Paint the pages in a PDF file, with meta-data.
 
         PDF files written directly by cairo do not have meta-data such as
         bookmarks/outlines and hyperlinks.
 
         :param target:
-            A filename, file-like object, or :obj:`None`.
+            A filename, file-like object, or :obj:`None`. Readable and
+            seekable file-like objects are directly updated when they are
+            positioned at their start, other ones only receive the final file.
         :type zoom: float
         :param zoom:
             The zoom factor in PDF units per CSS units.  **Warning**:
@@ -471,6 +675,12 @@ class Document(object):
         :param attachments: A list of additional file attachments for the
             generated PDF document or :obj:`None`. The list's elements are
             :class:`Attachment` objects, filenames, URLs, or file-like objects.
+        :type release_boxes: bool
+        :param release_boxes:
+            Whether the box tree of each page is released once the page is
+            painted. The boxes are drawn directly, without recording a display
+            list: released pages can't be painted again, unless they have
+            been recorded before (see :meth:`Page.record`).
         :returns:
             The PDF as byte string if :obj:`target` is :obj:`None`, otherwise
             :obj:`None` (the PDF is written to :obj:`target`).
@@ -478,14 +688,30 @@ class Document(object):
         """
         # 0.75 = 72 PDF point (cairo units) per inch / 96 CSS pixel per inch
         scale = zoom * 0.75
-        # Use an in-memory buffer. We will need to seek for metadata
-        # TODO: avoid this if target can seek? Benchmark first.
-        file_obj = io.BytesIO()
+        return _write_to_target(target, functools.partial(
+            self._write_pdf, scale=scale, attachments=attachments,
+            release_boxes=release_boxes))
+
+    def _write_pdf(self, file_obj, scale, attachments, streamed_pages=None,
+                   release_boxes=False):
+        """Write the PDF file in ``file_obj``.
+
+        ``file_obj`` must be readable, seekable and positioned at its start.
+
+        ``streamed_pages`` is an iterable of pages drawn instead of
+        :attr:`pages`. Once drawn, they are added to :attr:`pages` without
+        their box tree, only keeping what's needed for the metadata.
+
+        """
         # (1, 1) is overridden by .set_size() below.
         surface = cairo.PDFSurface(file_obj, 1, 1)
         context = cairo.Context(surface)
         LOGGER.info('Step 6 - Drawing')
-        for page in self.pages:
+        if streamed_pages is None:
+            pages = self.pages
+        else:
+            pages = streamed_pages
+        for page in pages:
             surface.set_size(
                 math.floor(scale * (
                     page.width + page.bleed['left'] + page.bleed['right'])),
@@ -496,25 +722,20 @@ class Document(object):
                     page.bleed['left'] * scale, page.bleed['top'] * scale)
                 page.paint(context, scale=scale)
                 surface.show_page()
+            if release_boxes or streamed_pages is not None:
+                page._page_box = None
+            if streamed_pages is not None:
+                self.pages.append(page)
         surface.finish()
+        # Remove what may be left from a previous, longer content
+        file_obj.truncate()
 
         LOGGER.info('Step 7 - Adding PDF metadata')
         write_pdf_metadata(self, file_obj, scale, self.metadata, attachments,
                            self.url_fetcher)
 
-        if target is None:
-            return file_obj.getvalue()
-        else:
-            file_obj.seek(0)
-            if hasattr(target, 'write'):
-                shutil.copyfileobj(file_obj, target)
-            else:
-                with open(target, 'wb') as fd:
-                    shutil.copyfileobj(file_obj, fd)
-
-    def write_image_surface(self, resolution=96):
-        dppx = resolution / 96
-
+    def _image_sizes(self, dppx):
+        """Return the widths and heights of the pages in image pixels."""
         # This duplicates the hinting logic in Page.paint. There is a
         # dependency cycle otherwise:
         #   this → hinting logic → context → surface → this
@@ -522,7 +743,11 @@ class Document(object):
         # friends are identity functions.
         widths = [int(math.ceil(p.width * dppx)) for p in self.pages]
         heights = [int(math.ceil(p.height * dppx)) for p in self.pages]
+        return widths, heights
 
+    def write_image_surface(self, resolution=96, release_boxes=False):
+        dppx = resolution / 96
+        widths, heights = self._image_sizes(dppx)
         max_width = max(widths)
         sum_heights = sum(heights)
         surface = cairo.ImageSurface(
@@ -533,10 +758,59 @@ class Document(object):
         for page, width, height in izip(self.pages, widths, heights):
             pos_x = (max_width - width) / 2
             page.paint(context, pos_x, pos_y, scale=dppx, clip=True)
+            if release_boxes:
+                page._page_box = None
             pos_y += height
         return surface, max_width, sum_heights
 
-    def write_png(self, target=None, resolution=96):
+    def _image_bands(self, resolution, release_boxes, band_height):
+        """Paint the pages vertically in image surfaces of ``band_height``.
+
+        Yield the surfaces from the top to the bottom of the image. The
+        pixels are the same as the ones painted by
+        :meth:`write_image_surface`. Each page is painted once in a display
+        list at the resolution of the image, replayed in each band it covers.
+
+        """
+        dppx = resolution / 96
+        widths, heights = self._image_sizes(dppx)
+        max_width = max(widths)
+        sum_heights = sum(heights)
+        LOGGER.info('Step 6 - Drawing')
+        pages = izip(self.pages, widths, heights)
+        # Recorded pages covering the current band, as
+        # ``(display_list, page_top, page_height)`` tuples
+        recorded_pages = []
+        next_page_top = 0
+        for band_top in xrange(0, sum_heights, band_height):
+            band_bottom = min(band_top + band_height, sum_heights)
+            while next_page_top < band_bottom:
+                page, width, height = next(pages)
+                display_list = cairo.RecordingSurface(
+                    cairo.CONTENT_COLOR_ALPHA, None)
+                pos_x = (max_width - width) / 2
+                page.paint(
+                    cairo.Context(display_list), pos_x, 0, scale=dppx,
+                    clip=True)
+                if release_boxes:
+                    page._page_box = None
+                recorded_pages.append((display_list, next_page_top, height))
+                next_page_top += height
+            surface = cairo.ImageSurface(
+                cairo.FORMAT_ARGB32, max_width, band_bottom - band_top)
+            context = cairo.Context(surface)
+            for display_list, page_top, height in recorded_pages:
+                context.set_source_surface(
+                    display_list, 0, page_top - band_top)
+                context.paint()
+            yield surface
+            # Forget the pages that are above the next band
+            recorded_pages = [
+                recorded_page for recorded_page in recorded_pages
+                if recorded_page[1] + recorded_page[2] > band_bottom]
+
+    def write_png(self, target=None, resolution=96, release_boxes=False,
+                  band_height=None):
         """Paint the pages vertically to a single PNG image.
 
         There is no decoration around pages other than those specified in CSS
@@ -549,6 +823,19 @@ class Document(object):
         :param resolution:
             The output resolution in PNG pixels per CSS inch. At 96 dpi
             (the default), PNG pixels match the CSS ``px`` unit.
+        :type release_boxes: bool
+        :param release_boxes:
+            Whether the box tree of each page is released once the page is
+            painted. The boxes are drawn directly, without recording a display
+            list: released pages can't be painted again, unless they have
+            been recorded before (see :meth:`Page.record`).
+        :type band_height: int
+        :param band_height:
+            If not :obj:`None`, the image is painted in horizontal bands of
+            this height in PNG pixels, compressed one after the other. Only
+            one band is kept in memory instead of the whole image, with the
+            display lists of the pages covering it. The pixels are the same,
+            but the PNG file is not the one written by cairo.
         :returns:
             A ``(png_bytes, png_width, png_height)`` tuple. :obj:`png_bytes`
             is a byte string if :obj:`target` is :obj:`None`, otherwise
@@ -557,7 +844,24 @@ class Document(object):
             final image, in PNG pixels.
 
         """
-        surface, max_width, sum_heights = self.write_image_surface(resolution)
+        if band_height is not None:
+            dppx = resolution / 96
+            widths, heights = self._image_sizes(dppx)
+            max_width, sum_heights = max(widths), sum(heights)
+            bands = self._image_bands(resolution, release_boxes, band_height)
+            if target is None:
+                target = io.BytesIO()
+                png.write_png(target, max_width, sum_heights, bands)
+                return target.getvalue(), max_width, sum_heights
+            elif not hasattr(target, 'write'):
+                with open(target, 'wb') as file_obj:
+                    png.write_png(file_obj, max_width, sum_heights, bands)
+            else:
+                png.write_png(target, max_width, sum_heights, bands)
+            return None, max_width, sum_heights
+
+        surface, max_width, sum_heights = self.write_image_surface(
+            resolution, release_boxes)
         if target is None:
             target = io.BytesIO()
             surface.write_to_png(target)
@@ -566,3 +870,56 @@ class Document(object):
             surface.write_to_png(target)
             png_bytes = None
         return png_bytes, max_width, sum_heights
+
+    def write_png_pages(self, resolution=96, executor=None, max_pending=2):
+        """Paint each page in a separate PNG image.
+
+        Unlike :meth:`write_png`, only the image of one page is kept in
+        memory at once when the images are consumed as they are generated.
+
+        :type resolution: float
+        :param resolution:
+            The output resolution in PNG pixels per CSS inch. At 96 dpi
+            (the default), PNG pixels match the CSS ``px`` unit.
+        :param executor:
+            An optional :class:`concurrent.futures.ThreadPoolExecutor` used
+            to paint the pages in parallel. The pages are recorded in
+            display lists (see :meth:`Page.record`) before being submitted,
+            as box trees can't be shared between threads. Cairo releases the
+            GIL while painting and encoding the images. Cairo surfaces can't
+            be pickled, a :class:`~concurrent.futures.ProcessPoolExecutor`
+            raises :exc:`TypeError`.
+        :type max_pending: int
+        :param max_pending:
+            The maximum number of pages submitted to ``executor`` and not
+            yielded yet, usually the number of workers of ``executor``. The
+            display lists recorded here are released once their pages are
+            written.
+        :returns:
+            A generator of ``(png_bytes, png_width, png_height)`` tuples, one
+            for each page, in the order of the pages.
+
+        """
+        if ProcessPoolExecutor is not None and isinstance(
+                executor, ProcessPoolExecutor):
+            raise TypeError(
+                'Pages can only be painted by threads, '
+                'not by a ProcessPoolExecutor')
+        return self._write_png_pages(resolution, executor, max_pending)
+
+    def _write_png_pages(self, resolution, executor, max_pending):
+        LOGGER.info('Step 6 - Drawing')
+        if executor is None:
+            for page in self.pages:
+                yield _write_page_png(page, resolution)
+        else:
+            pending = collections.deque()
+            for page in self.pages:
+                recorded = page._display_list is None
+                page.record(release_boxes=False)
+                pending.append((page, recorded, executor.submit(
+                    _write_page_png, page, resolution)))
+                if len(pending) >= max_pending:
+                    yield _png_page_result(*pending.popleft())
+            while pending:
+                yield _png_page_result(*pending.popleft())
@@ -162,6 +162,14 @@ def draw_page(page, context, enable_hinting):
     draw_stacking_context(context, stacking_context, enable_hinting)
 
 
+def draw_margin_boxes(page, context, enable_hinting):
+    """Draw the margin boxes of the given PageBox over its drawn content."""
+    for box in page.children:
+        if isinstance(box, boxes.MarginBox):
+            draw_stacking_context(
+                context, StackingContext.from_box(box, page), enable_hinting)
+
+
 def draw_box_background_and_border(context, page, box, enable_hinting):
     draw_background(context, box.background, enable_hinting)
     if isinstance(box, boxes.TableBox):
@@ -37,6 +37,38 @@ class FontConfiguration:
         """Add a font into the application."""
 
 
+class DocumentFontConfiguration(object):
+    """Font configuration of a document rendered with shared fonts.
+
+    The shared configuration is used until the document adds a font face. A
+    new configuration is then created for the document, with the
+    ``font_faces`` of the shared configuration, so that the fonts of a
+    document are not available in other documents.
+
+    :param shared_config: A :class:`FontConfiguration`.
+    :param font_faces: The ``(rule_descriptors, url_fetcher)`` tuples of the
+        font faces added to :obj:`shared_config`.
+
+    """
+    def __init__(self, shared_config, font_faces):
+        self._shared_config = shared_config
+        self._font_faces = font_faces
+        self._config = None
+
+    @property
+    def font_map(self):
+        if self._config is None:
+            return self._shared_config.font_map
+        return self._config.font_map
+
+    def add_font_face(self, rule_descriptors, url_fetcher):
+        if self._config is None:
+            self._config = FontConfiguration()
+            for font_face in self._font_faces:
+                self._config.add_font_face(*font_face)
+        return self._config.add_font_face(rule_descriptors, url_fetcher)
+
+
 if sys.platform.startswith('win'):
     warnings.warn('@font-face is currently not supported on Windows')
 elif pango.pango_version() < 13800:
@@ -159,8 +191,18 @@ else:
             # pango_fc_font_map_set_config keeps a reference to config
             fontconfig.FcConfigDestroy(self._fontconfig_config)
             self._filenames = []
+            self._font_faces = {}
 
         def add_font_face(self, rule_descriptors, url_fetcher):
+            # Faces are only added once, a stylesheet used by many documents
+            # doesn't create new files each time
+            key = url_fetcher, repr(sorted(rule_descriptors.items()))
+            if key not in self._font_faces:
+                self._font_faces[key] = self._add_font_face(
+                    rule_descriptors, url_fetcher)
+            return self._font_faces[key]
+
+        def _add_font_face(self, rule_descriptors, url_fetcher):
             for font_type, url in rule_descriptors['src']:
                 if url is None:
                     continue
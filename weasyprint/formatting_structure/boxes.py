@@ -87,6 +87,8 @@ class Box(object):
     transformation_matrix = None
     bookmark_label = None
     string_set = None
+    # The layout.float.ExcludedShapes object indexing this box, if any
+    excluded_shapes = None
 
     # Default, overriden on some subclasses
     def all_children(self):
@@ -127,6 +129,8 @@ class Box(object):
             return
         self.position_x += dx
         self.position_y += dy
+        if dy and self.excluded_shapes is not None:
+            self.excluded_shapes.moved()
         for child in self.all_children():
             if not (ignore_floats and child.is_floated()):
                 child.translate(dx, dy, ignore_floats)
@@ -335,12 +339,17 @@ class ParentBox(Box):
     def descendants(self):
         """A flat generator for a box, its children and descendants."""
         yield self
-        for child in self.children:
-            if hasattr(child, 'descendants'):
-                for grand_child in child.descendants():
-                    yield grand_child
-            else:
+        # Stack of the iterators on the children of the boxes being walked,
+        # not nested generators, for trees deeper than the recursion limit
+        stack = [iter(self.children)]
+        while stack:
+            for child in stack[-1]:
                 yield child
+                if hasattr(child, 'descendants'):
+                    stack.append(iter(child.children))
+                    break
+            else:
+                stack.pop()
 
     def get_wrapped_table(self):
         """Get the table wrapped by the box."""
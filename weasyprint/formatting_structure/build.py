@@ -106,11 +106,57 @@ def element_to_box(element, style_for, get_image_from_uri, base_url,
     ``TextBox``es are anonymous inline boxes:
     See http://www.w3.org/TR/CSS21/visuren.html#anonymous
 
+    The element tree is walked with an explicit stack instead of recursive
+    calls, its depth is not limited by the recursion limit.
+
+    """
+    if state is None:
+        # use a list to have a shared mutable object
+        state = (
+            # Shared mutable objects:
+            [0],  # quote_depth: single integer
+            {},  # counter_values: name -> stacked/scoped values
+            [set()]  # counter_scopes: element tree depths -> counter names
+        )
+
+    frame = _open_element(element, style_for, get_image_from_uri, state)
+    if frame is None:
+        return []
+    # Stack of (element, box, children, child_elements) for the elements
+    # whose children are being converted
+    stack = [frame]
+    while True:
+        element, box, children, child_elements = stack[-1]
+        for child_element in child_elements:
+            frame = _open_element(
+                child_element, style_for, get_image_from_uri, state)
+            if frame is not None:
+                stack.append(frame)
+                break
+            _add_tail(box, children, child_element.tail)
+        else:
+            stack.pop()
+            element_boxes = _close_element(
+                element, box, children, style_for, get_image_from_uri,
+                base_url, state)
+            if not stack:
+                return element_boxes
+            _, parent_box, parent_children, _ = stack[-1]
+            parent_children.extend(element_boxes)
+            _add_tail(parent_box, parent_children, element.tail)
+
+
+def _open_element(element, style_for, get_image_from_uri, state):
+    """Create the box of ``element`` and the boxes before its children.
+
+    Return ``(element, box, children, child_elements)``, or :obj:`None` if
+    the element generates no box.
+
     """
     if not isinstance(element.tag, basestring):
         # lxml.html already converts HTML entities to text.
         # Here we ignore comments and XML processing instructions.
-        return []
+        return None
 
     style = style_for(element)
 
@@ -118,18 +164,10 @@ def element_to_box(element, style_for, get_image_from_uri, base_url,
     # differ from the computer value?
     display = style.display
     if display == 'none':
-        return []
+        return None
 
     box = make_box(element.tag, style, [], get_image_from_uri)
 
-    if state is None:
-        # use a list to have a shared mutable object
-        state = (
-            # Shared mutable objects:
-            [0],  # quote_depth: single integer
-            {},  # counter_values: name -> stacked/scoped values
-            [set()]  # counter_scopes: element tree depths -> counter names
-        )
     _quote_depth, counter_values, counter_scopes = state
 
     update_counters(state, style)
@@ -152,16 +190,24 @@ def element_to_box(element, style_for, get_image_from_uri, base_url,
     if text:
         children.append(boxes.TextBox.anonymous_from(box, text))
 
-    for child_element in element:
-        children.extend(element_to_box(
-            child_element, style_for, get_image_from_uri, base_url, state))
-        text = child_element.tail
-        if text:
-            text_box = boxes.TextBox.anonymous_from(box, text)
-            if children and isinstance(children[-1], boxes.TextBox):
-                children[-1].text += text_box.text
-            else:
-                children.append(text_box)
+    return element, box, children, iter(element)
+
+
+def _add_tail(box, children, text):
+    """Add the ``text`` following a child element to ``children``."""
+    if text:
+        text_box = boxes.TextBox.anonymous_from(box, text)
+        if children and isinstance(children[-1], boxes.TextBox):
+            children[-1].text += text_box.text
+        else:
+            children.append(text_box)
+
+
+def _close_element(element, box, children, style_for, get_image_from_uri,
+                   base_url, state):
+    """Finish the box of ``element`` and return the boxes it generates."""
+    _quote_depth, counter_values, counter_scopes = state
+
     children.extend(before_after_to_box(
         element, 'after', state, style_for, get_image_from_uri))
 
@@ -172,7 +218,7 @@ def element_to_box(element, style_for, get_image_from_uri, base_url,
             counter_values.pop(name)
 
     box.children = children
-    set_content_lists(element, box, style, counter_values)
+    set_content_lists(element, box, box.style, counter_values)
 
     # Specific handling for the element. (eg. replaced element)
     return html.handle_element(element, box, get_image_from_uri, base_url)
@@ -374,6 +420,38 @@ def add_box_marker(box, counter_values, get_image_from_uri):
         box.outside_list_marker = marker_box
 
 
+def transform_tree(box, get_children, transform):
+    """Transform the tree of ``box`` from its leaves to its root.
+
+    ``get_children(parent_box)`` returns the list of the children of
+    ``parent_box`` to transform. Once they are transformed,
+    ``transform(parent_box, new_children)`` returns the box replacing
+    ``parent_box``. Boxes that are not parent boxes are kept as-is.
+
+    The tree is walked with an explicit stack instead of recursive calls, its
+    depth is not limited by the recursion limit.
+
+    """
+    if not isinstance(box, boxes.ParentBox):
+        return box
+    # Stack of (parent_box, children, new_children) for the parent boxes
+    # whose children are being transformed
+    stack = [(box, iter(get_children(box)), [])]
+    while True:
+        parent_box, children, new_children = stack[-1]
+        for child in children:
+            if isinstance(child, boxes.ParentBox):
+                stack.append((child, iter(get_children(child)), []))
+                break
+            new_children.append(child)
+        else:
+            stack.pop()
+            new_box = transform(parent_box, new_children)
+            if not stack:
+                return new_box
+            stack[-1][2].append(new_box)
+
+
 def is_whitespace(box, _has_non_whitespace=re.compile('\S').search):
     """Return True if ``box`` is a TextBox with only whitespace."""
     return isinstance(box, boxes.TextBox) and not _has_non_whitespace(box.text)
@@ -418,12 +496,8 @@ def anonymous_table_boxes(box):
     See http://www.w3.org/TR/CSS21/tables.html#anonymous-boxes
 
     """
-    if not isinstance(box, boxes.ParentBox):
-        return box
-
-    # Do recursion.
-    children = [anonymous_table_boxes(child) for child in box.children]
-    return table_boxes_children(box, children)
+    return transform_tree(
+        box, lambda box: box.children, table_boxes_children)
 
 
 def table_boxes_children(box, children):
@@ -641,6 +715,7 @@ def wrap_table(box, children):
         # Non-inherited properties of the table element apply to one
         # of the wrapper and the table. The other get the initial value.
         # TODO: put this in a method of the table object
+        table.style = table.style.copy()
         for name in properties.TABLE_WRAPPER_BOX_PROPERTIES:
             wrapper.style[name] = table.style[name]
             table.style[name] = properties.INITIAL_VALUES[name]
@@ -752,6 +827,7 @@ def collapse_table_borders(table, grid_width, grid_height):
         box.style['border_%s_color' % side] = transparent
 
     def remove_borders(box):
+        box.style = box.style.copy()
         set_transparent_border(box, 'top', 0)
         set_transparent_border(box, 'right', 0)
         set_transparent_border(box, 'bottom', 0)
@@ -772,6 +848,7 @@ def collapse_table_borders(table, grid_width, grid_height):
         for row in row_group.children:
             remove_borders(row)
             for cell in row.children:
+                cell.style = cell.style.copy()
                 set_transparent_border(cell, 'top', max_horizontal_width(
                     x=cell.grid_x, y=grid_y, w=cell.colspan))
                 set_transparent_border(cell, 'bottom', max_horizontal_width(
@@ -787,6 +864,7 @@ def collapse_table_borders(table, grid_width, grid_height):
         for column in column_group.children:
             remove_borders(column)
 
+    table.style = table.style.copy()
     set_transparent_border(table, 'top', max_horizontal_width(
         x=0, y=0, w=grid_width))
     set_transparent_border(table, 'bottom', max_horizontal_width(
@@ -811,13 +889,11 @@ def flex_boxes(box):
     See http://www.w3.org/TR/css-flexbox-1/#flex-items
 
     """
-    if not isinstance(box, boxes.ParentBox):
+    def transform(box, children):
+        box.children = flex_children(box, children)
         return box
 
-    # Do recursion.
-    children = [flex_boxes(child) for child in box.children]
-    box.children = flex_children(box, children)
-    return box
+    return transform_tree(box, lambda box: box.children, transform)
 
 
 def flex_children(box, children):
@@ -854,52 +930,78 @@ def process_whitespace(box, following_collapsible_space=False):
 
     """
     if isinstance(box, boxes.TextBox):
-        text = box.text
-        if not text:
-            return following_collapsible_space
-
-        # Normalize line feeds
-        text = re.sub('\r\n?', '\n', text)
-
-        new_line_collapse = box.style.white_space in ('normal', 'nowrap')
-        space_collapse = box.style.white_space in (
-            'normal', 'nowrap', 'pre-line')
-
-        if space_collapse:
-            # \r characters were removed/converted earlier
-            text = re.sub('[\t ]*\n[\t ]*', '\n', text)
-
-        if new_line_collapse:
-            # TODO: this should be language-specific
-            # Could also replace with a zero width space character (U+200B),
-            # or no character
-            # CSS3: http://www.w3.org/TR/css3-text/#line-break-transform
-            text = text.replace('\n', ' ')
-
-        if space_collapse:
-            text = text.replace('\t', ' ')
-            text = re.sub(' +', ' ', text)
-            previous_text = text
-            if following_collapsible_space and text.startswith(' '):
-                text = text[1:]
-                box.leading_collapsible_space = True
-            following_collapsible_space = previous_text.endswith(' ')
+        return process_text_whitespace(box, following_collapsible_space)
+    if not isinstance(box, boxes.ParentBox):
+        return following_collapsible_space
+
+    # Stack of [parent_box, children, following_collapsible_space] for the
+    # parent boxes whose children are being processed
+    stack = [[box, iter(box.children), following_collapsible_space]]
+    while True:
+        frame = stack[-1]
+        for child in frame[1]:
+            if isinstance(child, boxes.ParentBox):
+                following_collapsible_space = (
+                    frame[2] if isinstance(child, boxes.InlineBox)
+                    else False)
+                stack.append(
+                    [child, iter(child.children), following_collapsible_space])
+                break
+            elif isinstance(child, boxes.TextBox):
+                frame[2] = process_text_whitespace(child, frame[2])
+            elif child.is_in_normal_flow():
+                frame[2] = False
         else:
-            following_collapsible_space = False
+            stack.pop()
+            child, _, following_collapsible_space = frame
+            if not stack:
+                return following_collapsible_space
+            if isinstance(child, boxes.InlineBox):
+                stack[-1][2] = following_collapsible_space
+            elif child.is_in_normal_flow():
+                stack[-1][2] = False
+
+
+def process_text_whitespace(box, following_collapsible_space):
+    """Process the whitespace of the ``TextBox`` ``box``.
 
-        box.text = text
+    Return whether the text ends with a collapsible space.
+
+    """
+    text = box.text
+    if not text:
         return following_collapsible_space
 
-    if isinstance(box, boxes.ParentBox):
-        for child in box.children:
-            if isinstance(child, (boxes.TextBox, boxes.InlineBox)):
-                following_collapsible_space = process_whitespace(
-                    child, following_collapsible_space)
-            else:
-                process_whitespace(child)
-                if child.is_in_normal_flow():
-                    following_collapsible_space = False
+    # Normalize line feeds
+    text = re.sub('\r\n?', '\n', text)
+
+    new_line_collapse = box.style.white_space in ('normal', 'nowrap')
+    space_collapse = box.style.white_space in (
+        'normal', 'nowrap', 'pre-line')
+
+    if space_collapse:
+        # \r characters were removed/converted earlier
+        text = re.sub('[\t ]*\n[\t ]*', '\n', text)
+
+    if new_line_collapse:
+        # TODO: this should be language-specific
+        # Could also replace with a zero width space character (U+200B),
+        # or no character
+        # CSS3: http://www.w3.org/TR/css3-text/#line-break-transform
+        text = text.replace('\n', ' ')
+
+    if space_collapse:
+        text = text.replace('\t', ' ')
+        text = re.sub(' +', ' ', text)
+        previous_text = text
+        if following_collapsible_space and text.startswith(' '):
+            text = text[1:]
+            box.leading_collapsible_space = True
+        following_collapsible_space = previous_text.endswith(' ')
+    else:
+        following_collapsible_space = False
 
+    box.text = text
     return following_collapsible_space
 
 
@@ -941,9 +1043,11 @@ def inline_in_block(box):
         ]
 
     """
-    if not isinstance(box, boxes.ParentBox):
-        return box
+    return transform_tree(box, inline_in_block_children, inline_in_block_box)
+
 
+def inline_in_block_children(box):
+    """Return the children of ``box`` kept by :func:`inline_in_block`."""
     box_children = list(box.children)
 
     if box_children and box.leading_collapsible_space is False:
@@ -964,11 +1068,16 @@ def inline_in_block(box):
             trailing_collapsible_space = child.leading_collapsible_space
         else:
             trailing_collapsible_space = False
-            children.append(inline_in_block(child))
+            children.append(child)
 
     if box.trailing_collapsible_space is False:
         box.trailing_collapsible_space = trailing_collapsible_space
 
+    return children
+
+
+def inline_in_block_box(box, children):
+    """Wrap the inline-level ``children`` of ``box`` in lines."""
     if not isinstance(box, boxes.BlockContainerBox):
         box.children = children
         return box
@@ -1075,13 +1184,21 @@ def block_in_inline(box):
         ]
 
     """
-    if not isinstance(box, boxes.ParentBox):
-        return box
+    return transform_tree(
+        box, lambda box: box.children, block_in_inline_box)
 
+
+def block_in_inline_box(box, children):
+    """Split the lines of ``box`` around their block-level boxes.
+
+    The boxes in the lines, including the block-level boxes, have already
+    been transformed.
+
+    """
     new_children = []
     changed = False
 
-    for child in box.children:
+    for child, new_child in zip(box.children, children):
         if isinstance(child, boxes.LineBox):
             assert len(box.children) == 1, (
                 'Line boxes should have no '
@@ -1094,7 +1211,7 @@ def block_in_inline(box):
                     break
                 anon = boxes.BlockBox.anonymous_from(box, [new_line])
                 new_children.append(anon)
-                new_children.append(block_in_inline(block))
+                new_children.append(block)
                 # Loop with the same child and the new stack.
             if new_children:
                 # Some children were already added, this became a block
@@ -1103,9 +1220,6 @@ def block_in_inline(box):
             else:
                 # Keep the single line box as-is, without anonymous blocks.
                 new_child = new_line
-        else:
-            # Not in an inline formatting context.
-            new_child = block_in_inline(child)
 
         if new_child is not child:
             changed = True
@@ -1127,46 +1241,73 @@ def _inner_block_in_inline(box, skip_stack=None):
     If no block-level box is found after the position marked by
     ``skip_stack``, return ``(new_box, None, None)``
 
+    The nested inline boxes are walked with an explicit stack instead of
+    recursive calls.
+
     """
-    new_children = []
-    block_level_box = None
-    resume_at = None
-    changed = False
+    # Stack of [box, children, new_children, is_start, skip, skip_stack] for
+    # the inline boxes whose children are being searched
+    stack = [_inline_frame(box, skip_stack)]
+    while True:
+        frame = stack[-1]
+        _, children, new_children, _, _, skip_stack = frame
+        block_level_box = resume_at = None
+        descend = False
+        for index, child in children:
+            if isinstance(child, boxes.BlockLevelBox) and \
+                    child.is_in_normal_flow():
+                assert skip_stack is None  # Should not skip here
+                block_level_box = child
+                resume_at = (index + 1, None)  # Resume *after* the block
+                break
+            elif isinstance(child, boxes.InlineBox):
+                frame[5] = None
+                stack.append(_inline_frame(child, skip_stack))
+                descend = True
+                break
+            else:
+                assert skip_stack is None  # Should not skip here
+                new_children.append(child)
+        if descend:
+            # Search in the children of the inline box
+            continue
+
+        result = _split_inline_frame(stack.pop(), block_level_box, resume_at)
+        while stack:
+            new_child, block_level_box, resume_at = result
+            frame = stack[-1]
+            frame[2].append(new_child)
+            if block_level_box is None:
+                # Search in the next siblings
+                break
+            index = frame[4] + len(frame[2]) - 1
+            result = _split_inline_frame(
+                stack.pop(), block_level_box, (index, resume_at))
+        else:
+            return result
 
+
+def _inline_frame(box, skip_stack):
+    """Return the frame of :func:`_inner_block_in_inline` for ``box``."""
     is_start = skip_stack is None
     if is_start:
         skip = 0
     else:
         skip, skip_stack = skip_stack
-
-    for index, child in box.enumerate_skip(skip):
-        if isinstance(child, boxes.BlockLevelBox) and \
-                child.is_in_normal_flow():
-            assert skip_stack is None  # Should not skip here
-            block_level_box = child
-            index += 1  # Resume *after* the block
-        else:
-            if isinstance(child, boxes.InlineBox):
-                recursion = _inner_block_in_inline(child, skip_stack)
-                skip_stack = None
-                new_child, block_level_box, resume_at = recursion
-            else:
-                assert skip_stack is None  # Should not skip here
-                new_child = block_in_inline(child)
-                # block_level_box is still None.
-            if new_child is not child:
-                changed = True
-            new_children.append(new_child)
-        if block_level_box is not None:
-            resume_at = (index, resume_at)
-            box = box.copy_with_children(
-                new_children, is_start=is_start, is_end=False)
-            break
-    else:
-        if changed or skip:
-            box = box.copy_with_children(
-                new_children, is_start=is_start, is_end=True)
-
+    return [box, box.enumerate_skip(skip), [], is_start, skip, skip_stack]
+
+
+def _split_inline_frame(frame, block_level_box, resume_at):
+    """Return the ``(new_box, block_level_box, resume_at)`` of a frame."""
+    box, _, new_children, is_start, skip, _ = frame
+    if block_level_box is not None:
+        box = box.copy_with_children(
+            new_children, is_start=is_start, is_end=False)
+    elif skip or any(
+            new_child is not child for new_child, child in
+            zip(new_children, box.children[skip:])):
+        box = box.copy_with_children(
+            new_children, is_start=is_start, is_end=True)
     return box, block_level_box, resume_at
 
 
@@ -1188,6 +1329,7 @@ def set_viewport_overflow(root_box):
                 break
 
     root_box.viewport_overflow = chosen_box.style.overflow
+    chosen_box.style = chosen_box.style.copy()
     chosen_box.style['overflow'] = 'visible'
     return root_box
 
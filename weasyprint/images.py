@@ -12,7 +12,10 @@
 
 from __future__ import division, unicode_literals
 
+import hashlib
 import math
+import threading
+from collections import OrderedDict
 from io import BytesIO
 from xml.etree import ElementTree
 
@@ -71,7 +74,8 @@ class RasterImage(object):
     def get_intrinsic_size(self, image_resolution, _font_size):
         # Raster images are affected by the 'image-resolution' property.
         return (self._intrinsic_width / image_resolution,
-                self._intrinsic_height / image_resolution)
+                self._intrinsic_height / image_resolution,
+                self.intrinsic_ratio)
 
     def draw(self, context, concrete_width, concrete_height, image_rendering):
         if concrete_width > 0 and concrete_height > 0 and \
@@ -132,29 +136,25 @@ class SVGImage(object):
         # Percentages don't provide an intrinsic size, we transform percentages
         # into 0 using a (0, 0) context size:
         # http://www.w3.org/TR/SVG/coords.html#IntrinsicSizing
-        self._width = cairosvg.surface.size(
-            fake_surface, self._tree.get('width'))
-        self._height = cairosvg.surface.size(
-            fake_surface, self._tree.get('height'))
+        width = cairosvg.surface.size(fake_surface, self._tree.get('width'))
+        height = cairosvg.surface.size(fake_surface, self._tree.get('height'))
         _, _, viewbox = cairosvg.surface.node_format(fake_surface, self._tree)
-        self._intrinsic_width = self._width or None
-        self._intrinsic_height = self._height or None
-        self.intrinsic_ratio = None
+        intrinsic_width = width or None
+        intrinsic_height = height or None
+        intrinsic_ratio = None
         if viewbox:
-            if self._width and self._height:
-                self.intrinsic_ratio = self._width / self._height
+            if width and height:
+                intrinsic_ratio = width / height
             else:
                 if viewbox[2] and viewbox[3]:
-                    self.intrinsic_ratio = viewbox[2] / viewbox[3]
-                    if self._width:
-                        self._intrinsic_height = (
-                            self._width / self.intrinsic_ratio)
-                    elif self._height:
-                        self._intrinsic_width = (
-                            self._height * self.intrinsic_ratio)
-        elif self._width and self._height:
-            self.intrinsic_ratio = self._width / self._height
-        return self._intrinsic_width, self._intrinsic_height
+                    intrinsic_ratio = viewbox[2] / viewbox[3]
+                    if width:
+                        intrinsic_height = width / intrinsic_ratio
+                    elif height:
+                        intrinsic_width = height * intrinsic_ratio
+        elif width and height:
+            intrinsic_ratio = width / height
+        return intrinsic_width, intrinsic_height, intrinsic_ratio
 
     def draw(self, context, concrete_width, concrete_height, _image_rendering):
         try:
@@ -174,19 +174,122 @@ class SVGImage(object):
                 'Failed to draw an SVG image at %s : %s', self._base_url, e)
 
 
-def get_image_from_uri(cache, url_fetcher, url, forced_mime_type=None):
-    """Get a cairo Pattern from an image URI."""
+class ImageCache(object):
+    """Cache of decoded images, shared between renders.
+
+    Images are identified by their URL and the URL fetcher used to load
+    them, and by the hash of their content if ``check_content`` is true. In
+    this case, images are fetched each time they are used but only decoded
+    when their content changes.
+
+    When the size of the decoded images exceeds ``max_size`` bytes, the
+    least recently used images are removed. The cache can be used by
+    multiple threads.
+
+    """
+    def __init__(self, max_size=64 * 1024 * 1024, check_content=False):
+        #: Maximum size of the cached images, in bytes
+        self.max_size = max_size
+        #: Whether the content of the images is checked
+        self.check_content = check_content
+        #: Size of the cached images, in bytes
+        self.size = 0
+        #: Number of images found in the cache
+        self.hits = 0
+        #: Number of images not found in the cache
+        self.misses = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    @property
+    def hit_rate(self):
+        """Ratio of the images found in the cache, or :obj:`None`."""
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else None
+
+    def _key(self, url, url_fetcher, string):
+        if self.check_content:
+            if not isinstance(string, bytes):
+                string = string.encode('utf-8')
+            return url, url_fetcher, hashlib.sha1(string).hexdigest()
+        return url, url_fetcher
+
+    def get(self, url, url_fetcher, string=None):
+        """Return the image at ``url`` loaded with ``url_fetcher``, or
+        :obj:`None` if it's not cached.
+
+        ``string`` is the image content, required if ``check_content`` is
+        true.
+
+        """
+        key = self._key(url, url_fetcher, string)
+        with self._lock:
+            item = self._images.pop(key, None)
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._images[key] = item
+            return item[0]
+
+    def set(self, url, url_fetcher, image, string=None):
+        """Cache ``image``, loaded from ``url`` with ``url_fetcher``."""
+        key = self._key(url, url_fetcher, string)
+        if isinstance(image, RasterImage):
+            surface = image.image_surface
+            size = surface.get_stride() * surface.get_height()
+        else:
+            size = len(image._svg_data)
+        with self._lock:
+            if key in self._images:
+                self.size -= self._images.pop(key)[1]
+            self._images[key] = image, size
+            self.size += size
+            while self.size > self.max_size and self._images:
+                _, (_, old_size) = self._images.popitem(last=False)
+                self.size -= old_size
+
+    def clear(self):
+        """Remove all the images and reset the counters."""
+        with self._lock:
+            self._images.clear()
+            self.size = self.hits = self.misses = 0
+
+
+def get_image_from_uri(cache, url_fetcher, url, forced_mime_type=None,
+                       image_cache=None):
+    """Get a cairo Pattern from an image URI.
+
+    ``cache`` is a dict keeping the images of the current render, including
+    the images that can't be loaded. ``image_cache`` is an optional
+    :class:`ImageCache` shared between renders.
+
+    """
     missing = object()
     image = cache.get(url, missing)
     if image is not missing:
         return image
 
+    if image_cache is not None and not image_cache.check_content:
+        image = image_cache.get(url, url_fetcher)
+        if image is not None:
+            cache[url] = image
+            return image
+
     try:
         with fetch(url_fetcher, url) as result:
             if 'string' in result:
                 string = result['string']
             else:
                 string = result['file_obj'].read()
+            if image_cache is not None and image_cache.check_content:
+                image = image_cache.get(url, url_fetcher, string)
+                if image is not None:
+                    cache[url] = image
+                    return image
             mime_type = forced_mime_type or result['mime_type']
             if mime_type == 'image/svg+xml':
                 # No fallback for XML-based mimetypes as defined by MIME
@@ -228,6 +331,9 @@ def get_image_from_uri(cache, url_fetcher, url, forced_mime_type=None):
     except (URLFetchingError, ImageLoadingError) as exc:
         LOGGER.error('Failed to load image at "%s" (%s)', url, exc)
         image = None
+    else:
+        if image_cache is not None:
+            image_cache.set(url, url_fetcher, image, string)
     cache[url] = image
     return image
 
@@ -341,9 +447,7 @@ class Gradient(object):
 
     def get_intrinsic_size(self, _image_resolution, _font_size):
         # Gradients are not affected by image resolution, parent or font size.
-        return None, None
-
-    intrinsic_ratio = None
+        return None, None, None
 
     def draw(self, context, concrete_width, concrete_height, _image_rendering):
         scale_y, type_, init, stop_positions, stop_colors = self.layout(
@@ -22,56 +22,123 @@ from __future__ import division, unicode_literals
 from collections import defaultdict
 
 from .absolute import absolute_box_layout
-from .pages import make_all_pages, make_margin_boxes
-from .backgrounds import layout_backgrounds
+from .pages import (
+    make_all_pages, make_margin_boxes, margin_boxes_use_page_count)
+from .backgrounds import layout_backgrounds, layout_box_backgrounds
+from .float import ExcludedShapes
+from .preferred import IntrinsicWidthCache
 from ..compat import xrange
+from ..text import FirstLineCache, PangoContextPool, ShapedLines
 
 
-def layout_fixed_boxes(context, pages):
-    """Lay out and yield the fixed boxes of ``pages``."""
-    for page in pages:
-        for box in page.fixed_boxes:
-            # Use an empty list as last argument because the fixed boxes in the
-            # fixed box has already been added to page.fixed_boxes, we don't
-            # want to get them again
-            yield absolute_box_layout(context, box, page, [])
+def layout_fixed_boxes(context, fixed_boxes, page, laid_out_boxes):
+    """Lay out and yield the ``fixed_boxes`` repeated on ``page``.
+
+    The layout of fixed boxes only depends on the geometry of the page they
+    are laid out on. Each fixed box is laid out once per distinct geometry,
+    ``laid_out_boxes`` keeps these results and the same laid out boxes are
+    shared by all the pages having this geometry.
+
+    """
+    geometry = (
+        page.content_box_x(), page.content_box_y(), page.width, page.height)
+    for box in fixed_boxes:
+        key = box, geometry
+        if key not in laid_out_boxes:
+            # Use an empty list as last argument because the fixed boxes in
+            # the fixed box have already been added to page.fixed_boxes, we
+            # don't want to get them again
+            laid_out_boxes[key] = absolute_box_layout(context, box, page, [])
+        yield laid_out_boxes[key]
+
+
+def finish_page(context, page, page_number, counter_values):
+    """Add the margin boxes to ``page`` and lay out their backgrounds."""
+    context.current_page = page_number
+    margin_boxes = tuple(make_margin_boxes(context, page, counter_values))
+    page.children = tuple(page.children) + margin_boxes
+    for margin_box in margin_boxes:
+        layout_box_backgrounds(page, margin_box, context.get_image_from_uri)
 
 
 def layout_document(enable_hinting, style_for, get_image_from_uri, root_box,
-                    font_config, html, cascaded_styles, computed_styles):
+                    font_config, html, cascaded_styles, computed_styles,
+                    streaming=False, pango_context_pool=None):
     """Lay out the whole document.
 
     This includes line breaks, page breaks, absolute size and position for all
     boxes.
 
+    When ``streaming`` is true, pages are yielded as soon as they are laid
+    out. As the following pages are unknown, fixed boxes are only repeated on
+    the following pages. The pages whose margin boxes need the number of
+    pages are yielded with their content only and their
+    ``margin_boxes_pending`` attribute set: their margin boxes are added once
+    the whole document is laid out, when the generator is exhausted.
+
+    ``pango_context_pool`` is an optional :class:`text.PangoContextPool`
+    object shared with other documents.
+
     :param context: a LayoutContext object.
     :returns: a list of laid out Page objects.
 
     """
     context = LayoutContext(
-        enable_hinting, style_for, get_image_from_uri, font_config)
-    pages = list(make_all_pages(
-        context, root_box, html, cascaded_styles, computed_styles))
-    page_counter = [1]
-    counter_values = {'page': page_counter, 'pages': [len(pages)]}
+        enable_hinting, style_for, get_image_from_uri, font_config,
+        pango_context_pool)
+    pages = make_all_pages(
+        context, root_box, html, cascaded_styles, computed_styles)
+    laid_out_fixed_boxes = {}
+
+    if streaming:
+        fixed_boxes = []
+        deferred_pages = []
+        for page_number, page in enumerate(pages, 1):
+            root, = page.children
+            root.children = list(layout_fixed_boxes(
+                context, fixed_boxes, page, laid_out_fixed_boxes)) + list(
+                    root.children)
+            fixed_boxes.extend(page.fixed_boxes)
+            layout_backgrounds(page, context.get_image_from_uri)
+            page.margin_boxes_pending = margin_boxes_use_page_count(
+                context, page)
+            if page.margin_boxes_pending:
+                deferred_pages.append((page_number, page))
+            else:
+                finish_page(
+                    context, page, page_number, {'page': [page_number]})
+            yield page
+        page_count = page_number
+        for page_number, page in deferred_pages:
+            finish_page(context, page, page_number, {
+                'page': [page_number], 'pages': [page_count]})
+        return
+
+    pages = list(pages)
+    # Fixed boxes of each page are repeated on all the other pages
+    fixed_boxes = [
+        (i, box) for i, page in enumerate(pages) for box in page.fixed_boxes]
     for i, page in enumerate(pages):
         root_children = []
         root, = page.children
-        root_children.extend(layout_fixed_boxes(context, pages[:i]))
+        root_children.extend(layout_fixed_boxes(
+            context, [box for j, box in fixed_boxes if j < i], page,
+            laid_out_fixed_boxes))
         root_children.extend(root.children)
-        root_children.extend(layout_fixed_boxes(context, pages[i + 1:]))
+        root_children.extend(layout_fixed_boxes(
+            context, [box for j, box in fixed_boxes if j > i], page,
+            laid_out_fixed_boxes))
         root.children = root_children
-        context.current_page = page_counter[0]
-        page.children = (root,) + tuple(
-            make_margin_boxes(context, page, counter_values))
-        layout_backgrounds(page, get_image_from_uri)
+        layout_backgrounds(page, context.get_image_from_uri)
+        page_number = i + 1
+        finish_page(context, page, page_number, {
+            'page': [page_number], 'pages': [len(pages)]})
         yield page
-        page_counter[0] += 1
 
 
 class LayoutContext(object):
     def __init__(self, enable_hinting, style_for, get_image_from_uri,
-                 font_config):
+                 font_config, pango_context_pool=None):
         self.enable_hinting = enable_hinting
         self.style_for = style_for
         self.get_image_from_uri = get_image_from_uri
@@ -81,9 +148,15 @@ class LayoutContext(object):
         self.string_set = defaultdict(lambda: defaultdict(lambda: list()))
         self.current_page = None
         self.strut_layouts = {}
+        if pango_context_pool is None:
+            pango_context_pool = PangoContextPool()
+        self.pango_context_pool = pango_context_pool
+        self.first_line_cache = FirstLineCache()
+        self.shaped_lines = ShapedLines()
+        self.intrinsic_widths = IntrinsicWidthCache()
 
     def create_block_formatting_context(self):
-        self.excluded_shapes = []
+        self.excluded_shapes = ExcludedShapes()
         self._excluded_shapes_lists.append(self.excluded_shapes)
 
     def finish_block_formatting_context(self, root_box):
@@ -92,7 +165,8 @@ class LayoutContext(object):
             box_bottom = root_box.content_box_y() + root_box.height
             max_shape_bottom = max([
                 shape.position_y + shape.margin_height()
-                for shape in self.excluded_shapes] + [box_bottom])
+                for shape in self.excluded_shapes.below(box_bottom)] +
+                [box_bottom])
             root_box.height += max_shape_bottom - box_bottom
         self._excluded_shapes_lists.pop()
         if self._excluded_shapes_lists:
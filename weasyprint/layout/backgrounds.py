@@ -148,7 +148,7 @@ def layout_background_layer(box, page, resolution, image, size, clip, repeat,
             assert clip == 'content-box', clip
             clipped_boxes = [box.rounded_content_box()]
 
-    if image is None or 0 in image.get_intrinsic_size(1, 1):
+    if image is None or 0 in image.get_intrinsic_size(1, 1)[:2]:
         return BackgroundLayer(
             image=None, unbounded=(box is page), painting_area=painting_area,
             size='unused', position='unused', repeat='unused',
@@ -165,18 +165,18 @@ def layout_background_layer(box, page, resolution, image, size, clip, repeat,
     painting_x, painting_y, painting_width, painting_height = (
         painting_area)
 
+    iwidth, iheight, iratio = image.get_intrinsic_size(
+        resolution, box.style.font_size)
     if size == 'cover':
         image_width, image_height = replaced.cover_constraint_image_sizing(
-            positioning_width, positioning_height, image.intrinsic_ratio)
+            positioning_width, positioning_height, iratio)
     elif size == 'contain':
         image_width, image_height = replaced.contain_constraint_image_sizing(
-            positioning_width, positioning_height, image.intrinsic_ratio)
+            positioning_width, positioning_height, iratio)
     else:
         size_width, size_height = size
-        iwidth, iheight = image.get_intrinsic_size(
-            resolution, box.style.font_size)
         image_width, image_height = replaced.default_image_sizing(
-            iwidth, iheight, image.intrinsic_ratio,
+            iwidth, iheight, iratio,
             percentage(size_width, positioning_width),
             percentage(size_height, positioning_height),
             positioning_width, positioning_height)
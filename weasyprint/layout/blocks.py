@@ -125,6 +125,284 @@ def block_box_layout(context, box, max_position_y, skip_stack,
     return new_box, resume_at, next_page, adjoining_margins, collapsing_through
 
 
+# Precision of the column heights found by balance_columns, in CSS pixels
+COLUMN_BALANCING_PRECISION = 1e-2
+
+
+def column_units(box):
+    """Return the parts of the content of ``box`` that go in columns.
+
+    Return a list of ``(top, bottom, forced_break)`` tuples for the lines,
+    tables, replaced boxes and blocks with ``break-inside: avoid`` in the
+    normal flow of ``box``, laid out in one column of infinite height.
+    ``top`` and ``bottom`` are the vertical positions of their margin box,
+    ``forced_break`` is whether a column break is forced before them.
+
+    """
+    units = []
+    for child in box.children:
+        _add_column_units(child, units, False)
+    return units
+
+
+def _add_column_units(box, units, forced_break):
+    """Add the units of ``box`` to ``units``.
+
+    Return whether a column break is forced after ``box``.
+
+    """
+    forced_break = forced_break or box.style.break_before == 'column'
+    if isinstance(box, (boxes.TableBox, boxes.LineBox, boxes.ReplacedBox)) or (
+            isinstance(box, boxes.ParentBox) and box.is_in_normal_flow() and
+            box.style.break_inside in ('avoid', 'avoid-column')):
+        units.append((
+            box.position_y, box.position_y + box.margin_height(),
+            forced_break and bool(units)))
+        forced_break = False
+    elif isinstance(box, boxes.ParentBox) and box.is_in_normal_flow():
+        for child in box.children:
+            forced_break = _add_column_units(child, units, forced_break)
+    return forced_break or box.style.break_after == 'column'
+
+
+def _fill_columns(units, count, column_top, height):
+    """Put ``units`` in ``count`` columns of ``height``, starting at
+    ``column_top``.
+
+    Return the indexes of the units starting each column and the height of
+    the highest column, or ``(None, None)`` if the units don't fit.
+
+    """
+    column_starts = [0]
+    used_height = 0
+    for i, (top, bottom, forced_break) in enumerate(units):
+        if i != column_starts[-1] and (
+                forced_break or bottom - column_top > height):
+            if len(column_starts) == count:
+                return None, None
+            column_starts.append(i)
+            column_top = top
+        used_height = max(used_height, bottom - column_top)
+    return column_starts, used_height
+
+
+def balance_columns(units, count, column_top, height):
+    """Find the height of ``count`` columns holding ``units``.
+
+    ``units`` is a list given by :func:`column_units`, laid out from
+    ``column_top``. ``height`` is the minimal height of the columns.
+
+    Return ``(height, column_starts, iterations)``. ``column_starts`` is the
+    list of the indexes of the units starting each column, or :obj:`None`
+    if forced breaks need more than ``count`` columns. ``iterations`` is the
+    number of times the units have been put in columns.
+
+    The units fit in the columns when the height is big enough, the
+    smallest height is found by bisection. Each step only puts the
+    precomputed units in columns, without laying out the content again.
+
+    """
+    column_starts, _ = _fill_columns(units, count, column_top, height)
+    iterations = 1
+    if column_starts is not None:
+        return height, column_starts, iterations
+
+    low = height
+    high = max(bottom for _, bottom, _ in units) - column_top
+    column_starts, used_height = _fill_columns(
+        units, count, column_top, high)
+    iterations += 1
+    if column_starts is None:
+        # Forced breaks need more columns, keep the whole content height
+        return high, None, iterations
+
+    while high - low > COLUMN_BALANCING_PRECISION:
+        middle = (low + high) / 2
+        middle_starts, middle_height = _fill_columns(
+            units, count, column_top, middle)
+        iterations += 1
+        if middle_starts is None:
+            low = middle
+        else:
+            high = middle
+            column_starts, used_height = middle_starts, middle_height
+
+    # The columns have the same content for all the heights between the
+    # height of the highest column and the height found
+    return used_height, column_starts, iterations
+
+
+def _column_unit_boxes(measured_box):
+    """Return the ``(block, line_index)`` tuples of the column units of
+    ``measured_box``, or :obj:`None` if its content can't be sliced.
+
+    The content can be sliced when it only holds lines, or blocks only
+    holding lines. ``block`` is :obj:`None` for lines that are direct children
+    of ``measured_box``, ``line_index`` is :obj:`None` for blocks that are
+    not broken inside.
+
+    """
+    children = measured_box.children
+    if children and all(
+            isinstance(child, boxes.LineBox) for child in children):
+        return [(None, index) for index in xrange(len(children))]
+    unit_boxes = []
+    for block in children:
+        if not (isinstance(block, boxes.BlockBox) and
+                block.is_in_normal_flow() and
+                block.style.position != 'relative' and block.children and
+                all(isinstance(line, boxes.LineBox)
+                    for line in block.children) and
+                block.style.height == 'auto' and block.min_height == 0 and
+                block.max_height == float('inf')):
+            return None
+        if block.style.break_inside in ('avoid', 'avoid-column'):
+            unit_boxes.append((block, None))
+        else:
+            unit_boxes.extend(
+                (block, index) for index in xrange(len(block.children)))
+    return unit_boxes
+
+
+def _unit_box_lines(unit_boxes, start, end):
+    """Yield the ``(block, first_line, last_line)`` tuples of the blocks
+    whose lines are in ``unit_boxes[start:end]``.
+
+    ``last_line`` is excluded. ``first_line`` and ``last_line`` are
+    :obj:`None` for blocks that are not broken inside.
+
+    """
+    first_line = None
+    for i in xrange(start, end):
+        block, line = unit_boxes[i]
+        if i == start or block is not unit_boxes[i - 1][0]:
+            first_line = line
+        if i == end - 1 or block is not unit_boxes[i + 1][0]:
+            yield block, first_line, None if line is None else line + 1
+
+
+def _sliced_columns(context, box, measured_box, resume_at, units,
+                    column_starts, count, width, max_position_y,
+                    original_max_position_y, containing_block):
+    """Return the columns made of the content of ``measured_box``, or
+    :obj:`None` if the columns have to be laid out.
+
+    ``measured_box`` is the content laid out in one column of infinite
+    height. Its lines and blocks are moved into the columns given by
+    ``column_starts`` when they are laid out as they would be in the
+    columns: the content only holds lines or blocks of lines, no float is
+    beside them, the columns break between lines or blocks where the
+    layout of each column would break, and they respect orphans, widows and
+    page break values. Blocks broken between columns are split with
+    :meth:`copy_with_children`.
+
+    """
+    if column_starts is None or resume_at is not None:
+        return None
+    unit_boxes = _column_unit_boxes(measured_box)
+    if unit_boxes is None or len(unit_boxes) != len(units):
+        return None
+    if any(forced_break for _, _, forced_break in units):
+        return None
+    top = measured_box.content_box_y()
+    if context.excluded_shapes is not None and any(
+            context.excluded_shapes.between(top, units[-1][1])):
+        return None
+
+    # Check that the columns break where the layout of each column would
+    # break, and find the vertical offset of each column. Lines break when
+    # their bottom overflows, the bottom of blocks may overflow.
+    bottoms = [
+        unit[1] if line is not None or block is None else
+        block.children[-1].position_y + block.children[-1].height
+        for unit, (block, line) in izip(units, unit_boxes)]
+    ends = column_starts[1:] + [len(units)]
+    offsets = []
+    for i, (start, end) in enumerate(izip(column_starts, ends)):
+        block, line = unit_boxes[start]
+        if block is None:
+            lead = 0
+            dy = box.content_box_y() - measured_box.children[line].position_y
+        elif line in (None, 0):
+            # The block starts at the top of the column, its top margin
+            # collapses with the column
+            lead = collapse_margin([0, block.margin_top])
+            dy = box.content_box_y() - block.position_y
+        else:
+            # The block continues at the top of the column, without its top
+            # margin, border and padding
+            lead = 0
+            dy = box.content_box_y() - block.children[line].position_y
+        if i == count - 1:
+            column_max_position_y = original_max_position_y
+        else:
+            column_max_position_y = max_position_y
+        if any(bottoms[j] + dy > column_max_position_y
+               for j in xrange(start, end)):
+            return None
+        if end < len(units):
+            if bottoms[end] + dy <= column_max_position_y:
+                return None
+            block, line = unit_boxes[end - 1]
+            next_block, next_line = unit_boxes[end]
+            if block is not None and block is next_block:
+                # Break between lines of a block
+                block_start = next(
+                    j for j in xrange(start, end)
+                    if unit_boxes[j][0] is block)
+                if end - block_start < block.style.orphans or (
+                        len(block.children) - next_line <
+                        block.style.widows):
+                    return None
+            elif block is None:
+                if end - start < measured_box.style.orphans or (
+                        len(units) - end < measured_box.style.widows):
+                    return None
+            elif block_level_page_break(block, next_block) in (
+                    'avoid', 'avoid-page'):
+                return None
+        offsets.append((lead, dy))
+
+    columns = []
+    for i, ((start, end), (lead, dy)) in enumerate(izip(
+            izip(column_starts, ends), offsets)):
+        dx = i * (width + box.style.column_gap)
+        children = []
+        for block, first_line, last_line in _unit_box_lines(
+                unit_boxes, start, end):
+            if block is None:
+                children.extend(measured_box.children[start:end])
+                break
+            if first_line is None:
+                first_line = 0
+            if last_line is None:
+                last_line = len(block.children)
+            if first_line != 0 or last_line != len(block.children):
+                lines = block.children[first_line:last_line]
+                block = block.copy_with_children(
+                    lines, is_start=first_line == 0,
+                    is_end=last_line == len(block.children))
+                if first_line != 0:
+                    block.position_y = lines[0].position_y
+                block.height = (
+                    lines[-1].position_y + lines[-1].height -
+                    block.content_box_y())
+            children.append(block)
+        for child in children:
+            child.translate(dx, dy)
+        column_box = box.anonymous_from(box, children=children)
+        resolve_percentages(column_box, containing_block)
+        column_box.width = width
+        column_box.position_x = box.content_box_x() + dx
+        column_box.position_y = box.content_box_y() + lead
+        last_child = children[-1]
+        column_box.height = (
+            last_child.border_box_y() + last_child.border_height() -
+            column_box.position_y)
+        columns.append(column_box)
+    return columns
+
+
 def columns_layout(context, box, max_position_y, skip_stack, containing_block,
                    device_size, page_is_empty, absolute_boxes, fixed_boxes,
                    adjoining_margins):
@@ -183,72 +461,75 @@ def columns_layout(context, box, max_position_y, skip_stack, containing_block,
         column_box.position_y = box.content_box_y()
         return column_box
 
-    def column_descendants(box):
-        # TODO: this filtering condition is probably wrong
-        if isinstance(box, (boxes.TableBox, boxes.LineBox, boxes.ReplacedBox)):
-            yield box
-        if hasattr(box, 'descendants') and box.is_in_normal_flow():
-            for child in box.children:
-                for grand_child in column_descendants(child):
-                    yield grand_child
-
     # Balance.
     #
-    # The current algorithm starts from the ideal height (the total height
-    # divided by the number of columns). We then iterate until the last column
-    # is not the highest one. At the end of each loop, we add the minimal
-    # height needed to make one direct child at the top of one column go to the
-    # end of the previous column.
-    #
-    # We must probably rely on a real rendering for each loop, but with a
-    # stupid algorithm like this it can last minutes.
+    # The content is laid out once in a single column of infinite height, the
+    # column height is then found by bisection between the ideal height (the
+    # total height divided by the number of columns) and the total height.
+    # See balance_columns. When the content is only made of lines and blocks
+    # of lines, they are moved into the columns, otherwise each column is laid
+    # out. See _sliced_columns.
     #
-    # TODO: Rewrite this!
-    # - We assume that the children are normal lines or blocks.
-    # - We ignore the forced and avoided column breaks.
+    # TODO: We assume that the children are normal lines or blocks.
 
     # Find the total height of the content
     original_max_position_y = max_position_y
     column_box = create_column_box()
-    new_child, _, _, _, _ = block_box_layout(
+    measure_absolute_boxes = []
+    measure_fixed_boxes = []
+    new_child, measure_resume_at, measure_next_page, _, _ = block_box_layout(
         context, column_box, float('inf'), skip_stack, containing_block,
-        device_size, page_is_empty, [], [], [])
+        device_size, page_is_empty, measure_absolute_boxes,
+        measure_fixed_boxes, [])
     height = new_child.margin_height()
     if style.column_fill == 'balance':
         height /= count
-    box_column_descendants = list(column_descendants(new_child))
-    # Increase the column height step by step.
-    while True:
-        i = 0
-        lost_spaces = []
-        column_top = new_child.content_box_y()
-        for child in box_column_descendants:
-            child_height = child.margin_height()
-            child_bottom = child.position_y + child_height - column_top
-            if child_bottom > height:
-                if i < count - 1:
-                    lost_spaces.append(child_bottom - height)
-                    i += 1
-                    column_top = child.position_y
-                else:
-                    break
-        else:
-            break
-        height += min(lost_spaces)
+    units = column_units(new_child)
+    column_top = new_child.content_box_y()
+    height, column_starts, iterations = balance_columns(
+        units, count, column_top, height)
+    # Number of column heights tried, kept for profiling
+    box.column_balancing_iterations = iterations
     # TODO: check box.style.max-height
     max_position_y = min(max_position_y, box.content_box_y() + height)
 
     # Replace the current box children with columns
     children = []
+    columns = None
     if box.children:
+        columns = _sliced_columns(
+            context, box, new_child, measure_resume_at, units, column_starts,
+            count, width, max_position_y, original_max_position_y,
+            containing_block)
+    if columns is not None:
+        children = columns
+        absolute_boxes.extend(measure_absolute_boxes)
+        fixed_boxes.extend(measure_fixed_boxes)
+        skip_stack = None
+        next_page = measure_next_page
+    elif box.children:
         i = 0
         while True:
             if i == count - 1:
-                max_position_y = original_max_position_y
+                column_max_position_y = original_max_position_y
+            elif (column_starts is not None and
+                    i + 1 < len(column_starts) and
+                    units[column_starts[i + 1]][2]):
+                # Forced column break: the first unit of the next column
+                # must not fit in this column
+                if i == 0:
+                    start_y = column_top
+                else:
+                    start_y = units[column_starts[i]][0]
+                column_max_position_y = min(
+                    max_position_y, box.content_box_y() +
+                    units[column_starts[i + 1]][0] - start_y)
+            else:
+                column_max_position_y = max_position_y
             column_box = create_column_box()
             column_box.position_x += i * (width + style.column_gap)
             new_child, skip_stack, next_page, _, _ = block_box_layout(
-                context, column_box, max_position_y, skip_stack,
+                context, column_box, column_max_position_y, skip_stack,
                 containing_block, device_size, page_is_empty, absolute_boxes,
                 fixed_boxes, None)
             if new_child is None:
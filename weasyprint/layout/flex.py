@@ -600,6 +600,10 @@ def flex_layout(context, box, max_position_y, skip_stack, containing_block,
                         # width re-calculation after Step 16
                         child.style[cross] = Dimension(
                             line.cross_size - margins, 'px')
+                        if cross == 'width':
+                            # The cached widths of the child and of its
+                            # ancestors may depend on the old width
+                            context.intrinsic_widths.clear()
         position_cross += line.cross_size
 
     # Step 15
@@ -10,6 +10,8 @@
 
 from __future__ import division, unicode_literals
 
+from bisect import bisect_left, bisect_right
+
 from ..formatting_structure import boxes
 from .markers import list_marker_layout
 from .min_max import handle_min_max_width
@@ -18,6 +20,108 @@ from .preferred import shrink_to_fit
 from .tables import table_wrapper_width
 
 
+class ExcludedShapes(object):
+    """Floats of a block formatting context, indexed on the vertical axis.
+
+    Floats are kept in the order they are added. They are also sorted by
+    the top of their margin box, with the maximum bottom of the floats up
+    to each index, so that the floats that may be found between two
+    vertical positions are found by bisection. The top and the bottom of
+    margin boxes with a negative height are swapped.
+
+    Floats are usually added from top to bottom and are then appended to
+    the index. The index is sorted again when floats are removed, added
+    above other floats or moved vertically.
+
+    """
+    def __init__(self):
+        self._shapes = []
+        self._sorted_shapes = []
+        self._tops = []
+        self._max_bottoms = []
+        self._sorted = True
+
+    def __len__(self):
+        return len(self._shapes)
+
+    def __iter__(self):
+        return iter(self._shapes)
+
+    def __getitem__(self, index):
+        return self._shapes[index]
+
+    def append(self, shape):
+        self._shapes.append(shape)
+        shape.excluded_shapes = self
+        if self._sorted:
+            top, bottom = _vertical_bounds(shape)
+            if self._tops and top < self._tops[-1]:
+                self._sorted = False
+            else:
+                if self._max_bottoms:
+                    bottom = max(bottom, self._max_bottoms[-1])
+                self._sorted_shapes.append(shape)
+                self._tops.append(top)
+                self._max_bottoms.append(bottom)
+
+    def truncate(self, length):
+        """Remove and return the floats added after the first ``length``."""
+        removed = self._shapes[length:]
+        if removed:
+            del self._shapes[length:]
+            for shape in removed:
+                shape.excluded_shapes = None
+            self._sorted = False
+        return removed
+
+    def moved(self):
+        """Invalidate the index when a float has been moved vertically."""
+        self._sorted = False
+
+    def _sort(self):
+        bounds = sorted(
+            (_vertical_bounds(shape), i, shape)
+            for i, shape in enumerate(self._shapes))
+        self._sorted_shapes = [shape for _, _, shape in bounds]
+        self._tops = [top for (top, _), _, _ in bounds]
+        self._max_bottoms = []
+        max_bottom = float('-inf')
+        for (_, bottom), _, _ in bounds:
+            max_bottom = max(max_bottom, bottom)
+            self._max_bottoms.append(max_bottom)
+        self._sorted = True
+
+    def between(self, top, bottom):
+        """Return the floats that may overlap from ``top`` to ``bottom``.
+
+        The floats whose margin box ends before ``top`` or starts after
+        ``bottom`` are not returned, but floats touching ``top`` or
+        ``bottom`` and some other floats may be returned.
+
+        """
+        if not self._sorted:
+            self._sort()
+        if bottom < top:
+            top, bottom = bottom, top
+        start = bisect_left(self._max_bottoms, top)
+        end = bisect_right(self._tops, bottom)
+        return self._sorted_shapes[start:end]
+
+    def below(self, position_y):
+        """Return the floats that may end below ``position_y``."""
+        if not self._sorted:
+            self._sort()
+        start = bisect_right(self._max_bottoms, position_y)
+        return self._sorted_shapes[start:]
+
+
+def _vertical_bounds(shape):
+    """Return the top and the bottom of the margin box of ``shape``."""
+    top = shape.position_y
+    bottom = top + shape.margin_height()
+    return (top, bottom) if top <= bottom else (bottom, top)
+
+
 @handle_min_max_width
 def float_width(box, context, containing_block):
     # Check that box.width is auto even if the caller does it too, because
@@ -124,7 +228,8 @@ def get_clearance(context, box, collapsed_margin=0):
     clearance = None
     hypothetical_position = box.position_y + collapsed_margin
     # Hypothetical position is the position of the top border edge
-    for excluded_shape in context.excluded_shapes:
+    for excluded_shape in context.excluded_shapes.below(
+            hypothetical_position):
         if box.style['clear'] in (excluded_shape.style.float, 'both'):
             y, h = excluded_shape.position_y, excluded_shape.margin_height()
             if hypothetical_position < y + h:
@@ -145,7 +250,8 @@ def avoid_collisions(context, box, containing_block, outer=True):
 
     while True:
         colliding_shapes = [
-            shape for shape in excluded_shapes
+            shape for shape in excluded_shapes.between(
+                position_y, position_y + box_height)
             if (shape.position_y < position_y <
                 shape.position_y + shape.margin_height()) or
             (shape.position_y < position_y + box_height <
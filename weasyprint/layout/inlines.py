@@ -88,7 +88,7 @@ def get_next_linebox(context, linebox, position_y, skip_stack,
         context, linebox, containing_block, outer=False)
     candidate_height = linebox.height
 
-    excluded_shapes = context.excluded_shapes[:]
+    excluded_shapes_length = len(context.excluded_shapes)
 
     while 1:
         linebox.position_x = position_x
@@ -137,13 +137,14 @@ def get_next_linebox(context, linebox, position_y, skip_stack,
             break
         candidate_height = line.height
 
-        new_excluded_shapes = context.excluded_shapes
-        context.excluded_shapes = excluded_shapes
+        new_excluded_shapes = context.excluded_shapes.truncate(
+            excluded_shapes_length)
         position_x, position_y, available_width = avoid_collisions(
             context, line, containing_block, outer=False)
         if (position_x, position_y) == (
                 linebox.position_x, linebox.position_y):
-            context.excluded_shapes = new_excluded_shapes
+            for shape in new_excluded_shapes:
+                context.excluded_shapes.append(shape)
             break
 
     absolute_boxes.extend(line_absolutes)
@@ -331,8 +332,9 @@ def replaced_box_width(box, device_size):
     """
     Compute and set the used width for replaced boxes (inline- or block-level)
     """
-    intrinsic_width, intrinsic_height = box.replacement.get_intrinsic_size(
-        box.style.image_resolution, box.style.font_size)
+    intrinsic_width, intrinsic_height, intrinsic_ratio = (
+        box.replacement.get_intrinsic_size(
+            box.style.image_resolution, box.style.font_size))
 
     # This algorithm simply follows the different points of the specification:
     # http://www.w3.org/TR/CSS21/visudet.html#inline-replaced-width
@@ -340,10 +342,10 @@ def replaced_box_width(box, device_size):
         if intrinsic_width is not None:
             # Point #1
             box.width = intrinsic_width
-        elif box.replacement.intrinsic_ratio is not None:
+        elif intrinsic_ratio is not None:
             if intrinsic_height is not None:
                 # Point #2 first part
-                box.width = intrinsic_height * box.replacement.intrinsic_ratio
+                box.width = intrinsic_height * intrinsic_ratio
             else:
                 # Point #3
                 # " It is suggested that, if the containing block's width does
@@ -353,13 +355,12 @@ def replaced_box_width(box, device_size):
                 #   normal flow. "
                 # Whaaaaat? Let's not do this and use a value that may work
                 # well at least with inline blocks.
-                box.width = (
-                    box.style.font_size * box.replacement.intrinsic_ratio)
+                box.width = box.style.font_size * intrinsic_ratio
 
     if box.width == 'auto':
-        if box.replacement.intrinsic_ratio is not None:
+        if intrinsic_ratio is not None:
             # Point #2 second part
-            box.width = box.height * box.replacement.intrinsic_ratio
+            box.width = box.height * intrinsic_ratio
         elif intrinsic_width is not None:
             # Point #4
             box.width = intrinsic_width
@@ -375,9 +376,9 @@ def replaced_box_height(box, device_size):
     Compute and set the used height for replaced boxes (inline- or block-level)
     """
     # http://www.w3.org/TR/CSS21/visudet.html#inline-replaced-height
-    intrinsic_width, intrinsic_height = box.replacement.get_intrinsic_size(
-        box.style.image_resolution, box.style.font_size)
-    intrinsic_ratio = box.replacement.intrinsic_ratio
+    intrinsic_width, intrinsic_height, intrinsic_ratio = (
+        box.replacement.get_intrinsic_size(
+            box.style.image_resolution, box.style.font_size))
 
     # Test 'auto' on the computed width, not the used width
     if box.height == 'auto' and box.width == 'auto':
@@ -283,6 +283,26 @@ def compute_variable_dimension(context, side_boxes, vertical, outer_sum):
         box.restore_box_attributes()
 
 
+MARGIN_BOX_KEYWORDS = (
+    '@top-left-corner', '@top-left', '@top-center', '@top-right',
+    '@top-right-corner', '@right-top', '@right-middle', '@right-bottom',
+    '@bottom-right-corner', '@bottom-right', '@bottom-center',
+    '@bottom-left', '@bottom-left-corner', '@left-bottom', '@left-middle',
+    '@left-top')
+
+
+def margin_boxes_use_page_count(context, page):
+    """Tell whether the margin boxes of ``page`` need the number of pages."""
+    for at_keyword in MARGIN_BOX_KEYWORDS:
+        style = context.style_for(page.page_type, at_keyword)
+        if style is None or style.content in ('normal', 'none'):
+            continue
+        for type_, value in style.content:
+            if type_ in ('counter', 'counters') and value[0] == 'pages':
+                return True
+    return False
+
+
 def make_margin_boxes(context, page, counter_values):
     """Yield laid-out margin boxes for this page."""
     # This is a closure only to make calls shorter
@@ -33,11 +33,42 @@ def shrink_to_fit(context, box, available_width):
     http://www.w3.org/TR/CSS21/visudet.html#float-width
 
     """
-    return min(
-        max(
-            min_content_width(context, box, outer=False),
-            available_width),
-        max_content_width(context, box, outer=False))
+    min_width, max_width = min_max_content_widths(context, box, outer=False)
+    return min(max(min_width, available_width), max_width)
+
+
+class IntrinsicWidthCache(object):
+    """Cache of the min- and max-content widths of the boxes of a layout.
+
+    The widths of a box are stored with the list of its children and its
+    style, and are computed again if the children or the style of the box are
+    replaced. Code changing the width properties of a style in place must call
+    :meth:`clear`, as the widths of the box and of its ancestors depend on it.
+
+    """
+    def __init__(self):
+        self._widths = weakref.WeakKeyDictionary()
+        #: Number of widths found in the cache.
+        self.hits = 0
+        #: Number of widths missing from the cache.
+        self.misses = 0
+
+    def get(self, box, outer):
+        entry = self._widths.get(box, {}).get(outer)
+        if entry is None or entry[0] is not getattr(box, 'children', None) or (
+                entry[1] is not box.style):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[2]
+
+    def set(self, box, outer, widths):
+        self._widths.setdefault(box, {})[outer] = (
+            getattr(box, 'children', None), box.style, widths)
+
+    def clear(self):
+        """Remove all the widths."""
+        self._widths.clear()
 
 
 def min_content_width(context, box, outer=True):
@@ -46,23 +77,7 @@ def min_content_width(context, box, outer=True):
     This is the width by breaking at every line-break opportunity.
 
     """
-    if isinstance(box, (
-            boxes.BlockContainerBox, boxes.TableColumnBox, boxes.FlexBox)):
-        if box.is_table_wrapper:
-            return table_and_columns_preferred_widths(context, box, outer)[0]
-        else:
-            return block_min_content_width(context, box, outer)
-    elif isinstance(box, boxes.TableColumnGroupBox):
-        return column_group_content_width(context, box)
-    elif isinstance(box, (boxes.InlineBox, boxes.LineBox)):
-        return inline_min_content_width(
-            context, box, outer, is_line_start=True)
-    elif isinstance(box, boxes.ReplacedBox):
-        return replaced_min_content_width(box, outer)
-    else:
-        raise TypeError(
-            'min-content width for %s not handled yet' %
-            type(box).__name__)
+    return min_max_content_widths(context, box, outer)[0]
 
 
 def max_content_width(context, box, outer=True):
@@ -71,40 +86,65 @@ def max_content_width(context, box, outer=True):
     This is the width by only breaking at forced line breaks.
 
     """
+    return min_max_content_widths(context, box, outer)[1]
+
+
+def min_max_content_widths(context, box, outer=True):
+    """Return the ``(min_content_width, max_content_width)`` for ``box``.
+
+    Both widths are computed at once and kept in the
+    :class:`IntrinsicWidthCache` of ``context``.
+
+    """
+    cache = context.intrinsic_widths
+    widths = cache.get(box, outer)
+    if widths is None:
+        widths = _min_max_content_widths(context, box, outer)
+        cache.set(box, outer, widths)
+    return widths
+
+
+def _min_max_content_widths(context, box, outer):
+    """Compute the ``(min_content_width, max_content_width)`` for ``box``."""
     if isinstance(box, (
             boxes.BlockContainerBox, boxes.TableColumnBox, boxes.FlexBox)):
         if box.is_table_wrapper:
-            return table_and_columns_preferred_widths(context, box, outer)[1]
+            return table_and_columns_preferred_widths(
+                context, box, outer)[:2]
         else:
-            return block_max_content_width(context, box, outer)
+            return block_content_widths(context, box, outer)
     elif isinstance(box, boxes.TableColumnGroupBox):
-        return column_group_content_width(context, box)
+        width = column_group_content_width(context, box)
+        return width, width
     elif isinstance(box, (boxes.InlineBox, boxes.LineBox)):
-        return inline_max_content_width(
-            context, box, outer, is_line_start=True)
+        return inline_content_widths(context, box, outer, is_line_start=True)
     elif isinstance(box, boxes.ReplacedBox):
-        return replaced_min_content_width(box, outer)
+        width = replaced_min_content_width(box, outer)
+        return width, width
     else:
         raise TypeError(
-            'max-content width for %s not handled yet' % type(box).__name__)
+            'content widths for %s not handled yet' % type(box).__name__)
 
 
-def _block_content_width(context, box, function, outer):
-    """Helper to create ``block_*_content_width.``"""
+def block_content_widths(context, box, outer=True):
+    """Return the min- and max-content widths for a ``BlockBox``."""
     width = box.style.width
     if width == 'auto' or width.unit == '%':
         # "percentages on the following properties are treated instead as
         # though they were the following: width: auto"
         # http://dbaron.org/css/intrinsic/#outer-intrinsic
-        children_widths = [
-            function(context, child, outer=True) for child in box.children
-            if not child.is_absolutely_positioned()]
-        width = max(children_widths) if children_widths else 0
+        min_width = max_width = 0
+        for child in box.children:
+            if not child.is_absolutely_positioned():
+                child_min_width, child_max_width = min_max_content_widths(
+                    context, child, outer=True)
+                min_width = max(min_width, child_min_width)
+                max_width = max(max_width, child_max_width)
     else:
         assert width.unit == 'px'
-        width = width.value
+        min_width = max_width = width.value
 
-    return adjust(box, outer, width)
+    return adjust(box, outer, min_width), adjust(box, outer, max_width)
 
 
 def min_max(box, width):
@@ -161,13 +201,12 @@ def adjust(box, outer, width, left=True, right=True):
 
 def block_min_content_width(context, box, outer=True):
     """Return the min-content width for a ``BlockBox``."""
-    return _block_content_width(
-        context, box, min_content_width, outer)
+    return block_content_widths(context, box, outer)[0]
 
 
 def block_max_content_width(context, box, outer=True):
     """Return the max-content width for a ``BlockBox``."""
-    return _block_content_width(context, box, max_content_width, outer)
+    return block_content_widths(context, box, outer)[1]
 
 
 def inline_min_content_width(context, box, outer=True, skip_stack=None,
@@ -179,26 +218,37 @@ def inline_min_content_width(context, box, outer=True, skip_stack=None,
     calculated.
 
     """
-    widths = inline_line_widths(
-        context, box, outer, is_line_start, minimum=True,
+    widths, = inline_line_widths(
+        context, box, outer, [is_line_start], (True,),
         skip_stack=skip_stack, first_line=first_line)
 
     if first_line:
-        widths = [next(widths)]
+        widths = widths[:1]
     else:
-        widths = list(widths)
         widths[-1] -= trailing_whitespace_size(context, box)
     return adjust(box, outer, max(widths))
 
 
 def inline_max_content_width(context, box, outer=True, is_line_start=False):
     """Return the max-content width for an ``InlineBox``."""
-    widths = list(
-        inline_line_widths(context, box, outer, is_line_start, minimum=False))
+    widths, = inline_line_widths(
+        context, box, outer, [is_line_start], (False,))
     widths[-1] -= trailing_whitespace_size(context, box)
     return adjust(box, outer, max(widths))
 
 
+def inline_content_widths(context, box, outer=True, is_line_start=False):
+    """Return the min- and max-content widths for an ``InlineBox``."""
+    min_widths, max_widths = inline_line_widths(
+        context, box, outer, [is_line_start] * 2, (True, False))
+    trailing_whitespace = trailing_whitespace_size(context, box)
+    min_widths[-1] -= trailing_whitespace
+    max_widths[-1] -= trailing_whitespace
+    return (
+        adjust(box, outer, max(min_widths)),
+        adjust(box, outer, max(max_widths)))
+
+
 def column_group_content_width(context, box):
     """Return the *-content width for an ``TableColumnGroupBox``."""
     width = box.style.width
@@ -211,9 +261,25 @@ def column_group_content_width(context, box):
     return adjust(box, False, width)
 
 
-def inline_line_widths(context, box, outer, is_line_start, minimum,
+def inline_line_widths(context, box, outer, is_line_start, minimums,
                        skip_stack=None, first_line=False):
-    current_line = 0
+    """Return the lists of the widths of the lines of ``box``.
+
+    One list is returned for each boolean of ``minimums``, in a single walk
+    of the box tree: if the boolean is true, the lines are broken at every
+    line-break opportunity, otherwise only at forced line breaks.
+    ``is_line_start`` is the list of the booleans telling whether these
+    lines start at the beginning of ``box``.
+
+    The widths are calculated from the lines from ``skip_stack``. If
+    ``first_line`` is ``True``, only the width of the first line is
+    calculated, ``minimums`` must then have only one boolean.
+
+    """
+    assert not first_line or len(minimums) == 1
+    widths = [[] for _ in minimums]
+    current_lines = [0 for _ in minimums]
+    is_line_start = list(is_line_start)
     if skip_stack is None:
         skip = 0
     else:
@@ -223,17 +289,16 @@ def inline_line_widths(context, box, outer, is_line_start, minimum,
             continue  # Skip
 
         if isinstance(child, boxes.InlineBox):
-            lines = inline_line_widths(
-                context, child, outer, is_line_start, minimum, skip_stack)
-            if first_line:
-                lines = [next(lines)]
-            else:
-                lines = list(lines)
-            if len(lines) == 1:
-                lines[0] = adjust(child, outer, lines[0])
-            else:
-                lines[0] = adjust(child, outer, lines[0], right=False)
-                lines[-1] = adjust(child, outer, lines[-1], left=False)
+            children_lines = inline_line_widths(
+                context, child, outer, is_line_start, minimums, skip_stack)
+            for lines in children_lines:
+                if first_line:
+                    del lines[1:]
+                if len(lines) == 1:
+                    lines[0] = adjust(child, outer, lines[0])
+                else:
+                    lines[0] = adjust(child, outer, lines[0], right=False)
+                    lines[-1] = adjust(child, outer, lines[-1], left=False)
         elif isinstance(child, boxes.TextBox):
             space_collapse = child.style.white_space in (
                 'normal', 'nowrap', 'pre-line')
@@ -242,27 +307,25 @@ def inline_line_widths(context, box, outer, is_line_start, minimum,
             else:
                 skip, skip_stack = skip_stack
                 assert skip_stack is None
-            child_text = child.text[(skip or 0):]
-            if is_line_start and space_collapse:
-                child_text = child_text.lstrip(' ')
-            if minimum and child_text == ' ':
-                lines = [0, 0]
-            else:
-                max_width = 0 if minimum else None
-                lines = []
-                resume_at = new_resume_at = 0
-                while new_resume_at is not None:
-                    resume_at += new_resume_at
-                    _, _, new_resume_at, width, _, _ = (
-                        text.split_first_line(
-                            child_text[resume_at:], child.style, context,
-                            max_width, child.justification_spacing))
-                    lines.append(width)
-                    if first_line:
-                        break
-                if first_line and new_resume_at:
-                    current_line += lines[0]
-                    break
+            children_lines = []
+            for minimum, line_start in zip(minimums, is_line_start):
+                child_text = child.text[(skip or 0):]
+                if line_start and space_collapse:
+                    child_text = child_text.lstrip(' ')
+                if minimum and child_text == ' ':
+                    lines = [0, 0]
+                elif not first_line:
+                    lines = text_line_widths(
+                        context, child, child_text, minimum)
+                else:
+                    max_width = 0 if minimum else None
+                    _, _, resume_at, width, _, _ = text.split_first_line(
+                        child_text, child.style, context, max_width,
+                        child.justification_spacing)
+                    if resume_at:
+                        return [[current_lines[0] + width]]
+                    lines = [width]
+                children_lines.append(lines)
         else:
             # http://www.w3.org/TR/css3-text/#line-break-details
             # "The line breaking behavior of a replaced element
@@ -271,22 +334,52 @@ def inline_line_widths(context, box, outer, is_line_start, minimum,
             # http://www.unicode.org/reports/tr14/#DescriptionOfProperties
             # "By default, there is a break opportunity
             #  both before and after any inline object."
-            if minimum:
-                lines = [0, max_content_width(context, child), 0]
-            else:
-                lines = [max_content_width(context, child)]
-        # The first text line goes on the current line
-        current_line += lines[0]
-        if len(lines) > 1:
-            # Forced line break
-            yield current_line
-            if len(lines) > 2:
-                for line in lines[1:-1]:
-                    yield line
-            current_line = lines[-1]
-        is_line_start = lines[-1] == 0
+            width = max_content_width(context, child)
+            children_lines = [
+                [0, width, 0] if minimum else [width]
+                for minimum in minimums]
+
+        for i, lines in enumerate(children_lines):
+            # The first text line goes on the current line
+            current_lines[i] += lines[0]
+            if len(lines) > 1:
+                # Forced line break
+                widths[i].append(current_lines[i])
+                if first_line:
+                    return widths
+                widths[i].extend(lines[1:-1])
+                current_lines[i] = lines[-1]
+            is_line_start[i] = lines[-1] == 0
         skip_stack = None
-    yield current_line
+    for i, current_line in enumerate(current_lines):
+        widths[i].append(current_line)
+    return widths
+
+
+def text_line_widths(context, box, child_text, minimum):
+    """Return the widths of the lines of ``child_text``, the text of ``box``.
+
+    The text is broken at every line-break opportunity if ``minimum`` is true,
+    and only at forced line breaks otherwise.
+
+    """
+    if minimum:
+        if child_text == ' ':
+            return [0, 0]
+        lines = text.min_content_line_widths(
+            child_text, box.style, context, box.justification_spacing)
+        if lines is not None:
+            return lines
+    max_width = 0 if minimum else None
+    lines = []
+    resume_at = new_resume_at = 0
+    while new_resume_at is not None:
+        resume_at += new_resume_at
+        _, _, new_resume_at, width, _, _ = text.split_first_line(
+            child_text[resume_at:], box.style, context, max_width,
+            box.justification_spacing)
+        lines.append(width)
+    return lines
 
 
 TABLE_CACHE = weakref.WeakKeyDictionary()
@@ -310,6 +403,37 @@ def _percentage_contribution(box):
     return max(min_width, min(width, max_width))
 
 
+def sampled_table(table):
+    """Return the part of ``table`` used to compute its content widths.
+
+    If the ``table-sample-rows`` property of the table is set to an integer,
+    only the header and footer row groups and this number of body rows are
+    kept. Otherwise, ``table`` is returned.
+
+    """
+    sample_rows = table.style.table_sample_rows
+    if sample_rows == 'none':
+        return table
+    body_groups = [
+        row_group for row_group in table.children
+        if not (row_group.is_header or row_group.is_footer)]
+    if sum(len(row_group.children) for row_group in body_groups) <= (
+            sample_rows):
+        return table
+
+    children = []
+    for row_group in table.children:
+        if row_group in body_groups:
+            if sample_rows <= 0:
+                continue
+            if len(row_group.children) > sample_rows:
+                row_group = row_group.copy_with_children(
+                    row_group.children[:sample_rows])
+            sample_rows -= len(row_group.children)
+        children.append(row_group)
+    return table.copy_with_children(children)
+
+
 def table_and_columns_preferred_widths(context, box, outer=True):
     """Return content widths for the auto layout table and its columns.
 
@@ -317,15 +441,23 @@ def table_and_columns_preferred_widths(context, box, outer=True):
     ``(table_min_content_width, table_max_content_width,
        column_min_content_widths, column_max_content_widths,
        column_intrinsic_percentages, constrainedness,
-       total_horizontal_border_spacing, grid)``
+       total_horizontal_border_spacing, grid, cell_max_content_widths)``
+
+    ``cell_max_content_widths`` gives, for each column, the max-content widths
+    of the cells starting in this column.
+
+    When ``table-sample-rows`` is set, the widths only depend on the rows of
+    :func:`sampled_table`, the other rows are laid out in the columns as with
+    the fixed table layout.
 
     http://dbaron.org/css/intrinsic/
 
     """
-    table = box.get_wrapped_table()
-    result = TABLE_CACHE.get(table)
+    cache_key = box.get_wrapped_table()
+    result = TABLE_CACHE.get(cache_key)
     if result:
         return result[outer]
+    table = sampled_table(cache_key)
 
     # Create the grid
     grid_width, grid_height = 0, 0
@@ -364,8 +496,8 @@ def table_and_columns_preferred_widths(context, box, outer=True):
         outer_max_width = adjust(
             box, outer=True, width=block_max_content_width(
                 context, table, outer=True))
-        result = ([], [], [], [], total_horizontal_border_spacing, [])
-        TABLE_CACHE[table] = result = {
+        result = ([], [], [], [], total_horizontal_border_spacing, [], [])
+        TABLE_CACHE[cache_key] = result = {
             False: (min_width, max_width) + result,
             True: (outer_min_width, outer_max_width) + result,
         }
@@ -389,26 +521,32 @@ def table_and_columns_preferred_widths(context, box, outer=True):
     min_content_widths = [0 for i in range(grid_width)]
     max_content_widths = [0 for i in range(grid_width)]
     intrinsic_percentages = [0 for i in range(grid_width)]
+    cell_max_content_widths = [[] for i in range(grid_width)]
 
     # Intermediate content widths for span 1
     for i in range(grid_width):
         for groups in (column_groups, columns):
             if groups[i]:
+                group_min_width, group_max_width = min_max_content_widths(
+                    context, groups[i])
                 min_content_widths[i] = max(
-                    min_content_widths[i],
-                    min_content_width(context, groups[i]))
+                    min_content_widths[i], group_min_width)
                 max_content_widths[i] = max(
-                    max_content_widths[i],
-                    max_content_width(context, groups[i]))
+                    max_content_widths[i], group_max_width)
                 intrinsic_percentages[i] = max(
                     intrinsic_percentages[i],
                     _percentage_contribution(groups[i]))
         for cell in zipped_grid[i]:
-            if cell and cell.colspan == 1:
+            if not cell:
+                continue
+            cell_min_width, cell_max_width = min_max_content_widths(
+                context, cell)
+            cell_max_content_widths[i].append(cell_max_width)
+            if cell.colspan == 1:
                 min_content_widths[i] = max(
-                    min_content_widths[i], min_content_width(context, cell))
+                    min_content_widths[i], cell_min_width)
                 max_content_widths[i] = max(
-                    max_content_widths[i], max_content_width(context, cell))
+                    max_content_widths[i], cell_max_width)
                 intrinsic_percentages[i] = max(
                     intrinsic_percentages[i],
                     _percentage_contribution(cell))
@@ -586,8 +724,9 @@ def table_and_columns_preferred_widths(context, box, outer=True):
 
     result = (
         min_content_widths, max_content_widths, intrinsic_percentages,
-        constrainedness, total_horizontal_border_spacing, zipped_grid)
-    TABLE_CACHE[table] = result = {
+        constrainedness, total_horizontal_border_spacing, zipped_grid,
+        cell_max_content_widths)
+    TABLE_CACHE[cache_key] = result = {
         False: (table_min_content_width, table_max_content_width) + result,
         True: (
             (table_outer_min_content_width, table_outer_max_content_width) +
@@ -611,10 +750,10 @@ def replaced_min_content_width(box, outer=True):
             width = 0
         else:
             image = box.replacement
-            iwidth, iheight = image.get_intrinsic_size(
+            iwidth, iheight, iratio = image.get_intrinsic_size(
                 box.style.image_resolution, box.style.font_size)
             width, _ = default_image_sizing(
-                iwidth, iheight, image.intrinsic_ratio, 'auto', height,
+                iwidth, iheight, iratio, 'auto', height,
                 default_width=300, default_height=150)
     elif box.style.width.unit == '%':
         # See https://drafts.csswg.org/css-sizing/#intrinsic-contribution
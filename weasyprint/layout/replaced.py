@@ -23,10 +23,10 @@ def image_marker_layout(box):
     """
     image = box.replacement
     one_em = box.style.font_size
-    iwidth, iheight = image.get_intrinsic_size(
+    iwidth, iheight, iratio = image.get_intrinsic_size(
         box.style.image_resolution, one_em)
     box.width, box.height = default_image_sizing(
-        iwidth, iheight, image.intrinsic_ratio, box.width, box.height,
+        iwidth, iheight, iratio, box.width, box.height,
         default_width=one_em, default_height=one_em)
 
 
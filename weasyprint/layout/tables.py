@@ -16,7 +16,7 @@ from ..compat import xrange
 from ..formatting_structure import boxes
 from ..logger import LOGGER
 from .percentages import resolve_one_percentage, resolve_percentages
-from .preferred import max_content_width, table_and_columns_preferred_widths
+from .preferred import table_and_columns_preferred_widths
 
 
 def table_layout(context, table, max_position_y, skip_stack,
@@ -523,7 +523,7 @@ def auto_table_layout(context, box, containing_block):
     (table_min_content_width, table_max_content_width,
      column_min_content_widths, column_max_content_widths,
      column_intrinsic_percentages, constrainedness,
-     total_horizontal_border_spacing, grid) = \
+     total_horizontal_border_spacing, grid, cell_max_content_widths) = \
         table_and_columns_preferred_widths(context, box, outer=False)
 
     margins = 0
@@ -606,12 +606,10 @@ def auto_table_layout(context, box, containing_block):
             (i, column) for i, column in enumerate(grid)
             if not constrainedness[i] and
             column_intrinsic_percentages[i] == 0 and
-            any(max_content_width(context, cell) for cell in column if cell)]
+            any(cell_max_content_widths[i])]
         if columns:
             widths = [
-                max(max_content_width(context, cell)
-                    for cell in column if cell)
-                for i, column in columns]
+                max(cell_max_content_widths[i]) for i, column in columns]
             current_widths = [
                 table.column_widths[i] for i, column in columns]
             differences = [
@@ -642,12 +640,10 @@ def auto_table_layout(context, box, containing_block):
             (i, column) for i, column in enumerate(grid)
             if constrainedness[i] and
             column_intrinsic_percentages[i] == 0 and
-            any(max_content_width(context, cell) for cell in column if cell)]
+            any(cell_max_content_widths[i])]
         if columns:
             widths = [
-                max(max_content_width(context, cell)
-                    for cell in column if cell)
-                for i, column in columns]
+                max(cell_max_content_widths[i]) for i, column in columns]
             current_widths = [
                 table.column_widths[i] for i, column in columns]
             differences = [
@@ -713,9 +709,7 @@ def auto_table_layout(context, box, containing_block):
             i for i, column in enumerate(grid)
             if any(column) and
             column_intrinsic_percentages[i] == 0 and
-            not any(
-                max_content_width(context, cell)
-                for cell in column if cell)]
+            not any(cell_max_content_widths[i])]
         if columns:
             for i in columns:
                 table.column_widths[i] += excess_width / len(columns)
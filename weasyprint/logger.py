@@ -14,7 +14,8 @@
       unreachable stylesheets, unreachables images and unreadable images;
     - warnings are used for unknown or bad HTML/CSS syntaxes, unreachable local
       fonts and various non-fatal problems;
-    - infos are used to advertise rendering steps.
+    - infos are used to advertise rendering steps;
+    - debugs are used for profiling counters and internal decisions.
 
     :copyright: Copyright 2011-2014 Simon Sapin and contributors, see AUTHORS.
     :license: BSD, see LICENSE for details.
@@ -23,8 +24,59 @@
 
 from __future__ import division, unicode_literals
 
+import contextlib
 import logging
+import threading
 
 LOGGER = logging.getLogger('weasyprint')
 LOGGER.setLevel(logging.WARNING)
 LOGGER.addHandler(logging.NullHandler())
+
+
+class LogCounter(object):
+    """Number of the messages whose level is at least ``level``."""
+    def __init__(self, level):
+        self.level = level
+        self.count = 0
+
+
+class CountingFilter(logging.Filter):
+    """A logging filter counting the messages logged by each thread.
+
+    The messages are counted by the :class:`LogCounter` objects of the thread
+    logging them, other threads using WeasyPrint at the same time don't
+    change them.
+
+    """
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self.local = threading.local()
+
+    def filter(self, record):
+        for counter in getattr(self.local, 'counters', ()):
+            if record.levelno >= counter.level:
+                counter.count += 1
+        return True
+
+
+COUNTING_FILTER = CountingFilter()
+LOGGER.addFilter(COUNTING_FILTER)
+
+
+@contextlib.contextmanager
+def count_logs(level=logging.WARNING):
+    """Return a context manager counting the messages logged by WeasyPrint
+    in the current thread.
+
+    Only messages whose level is at least ``level`` are counted.
+
+    """
+    counter = LogCounter(level)
+    local = COUNTING_FILTER.local
+    if not hasattr(local, 'counters'):
+        local.counters = []
+    local.counters.append(counter)
+    try:
+        yield counter
+    finally:
+        local.counters.remove(counter)
@@ -16,14 +16,20 @@ from __future__ import division, unicode_literals
 import hashlib
 import io
 import mimetypes
+import os
+import re
 import sys
 import zlib
+from collections import OrderedDict
 
 import cairocffi as cairo
-from pdfrw import PdfArray, PdfDict, PdfName, PdfReader, PdfString, PdfWriter
+from pdfrw import (
+    PdfArray, PdfDict, PdfName, PdfObject, PdfReader, PdfString, PdfWriter)
+from pdfrw.objects.pdfname import BasePdfName
+from pdfrw.py23_diffs import convert_load, convert_store
 
 from . import VERSION_STRING, Attachment
-from .compat import izip, unquote
+from .compat import basestring, izip, unquote
 from .html import W3C_DATE_RE
 from .logger import LOGGER
 from .urls import URLFetchingError, iri_to_uri, urlsplit
@@ -39,7 +45,7 @@ def convert_bookmarks_units(bookmarks, matrices):
     return converted_bookmarks
 
 
-def prepare_metadata(document, scale, pages):
+def prepare_metadata(document, scale, page_references):
     """Change metadata into data structures closer to the PDF objects.
 
     In particular, convert from WeasyPrint units (CSS pixels from
@@ -49,6 +55,8 @@ def prepare_metadata(document, scale, pages):
         PDF points per CSS pixels.
         Defaults to 0.75, but is affected by `zoom` in
         :meth:`weasyprint.document.Document.write_pdf`.
+    :param page_references:
+        The objects used to reference the PDF pages.
 
     """
     # X and width unchanged;  Y’ = page_height - Y;  height’ = -height
@@ -61,7 +69,7 @@ def prepare_metadata(document, scale, pages):
             if link_type == 'internal':
                 target_page, target_x, target_y = target
                 target = (
-                    (pages[target_page].indirect,) +
+                    (page_references[target_page],) +
                     matrices[target_page].transform_point(target_x, target_y))
             rect_x, rect_y, width, height = rectangle
             rect_x, rect_y = matrix.transform_point(rect_x, rect_y)
@@ -198,12 +206,12 @@ def _create_pdf_attachment(attachment, url_fetcher):
         Desc=PdfString.encode(attachment.description or ''))
 
 
-def create_bookmarks(bookmarks, pages, parent=None):
+def create_bookmarks(bookmarks, page_references, parent=None):
     count = len(bookmarks)
     bookmark_objects = []
     for label, target, children in bookmarks:
         destination = (
-            pages[target[0]].indirect,
+            page_references[target[0]],
             PdfName('XYZ'), target[1], target[2], 0)
         bookmark_object = PdfDict(
             Title=PdfString.encode(label), A=PdfDict(
@@ -211,7 +219,7 @@ def create_bookmarks(bookmarks, pages, parent=None):
                 D=PdfArray(destination)))
         bookmark_object.indirect = True
         children_objects, children_count = create_bookmarks(
-            children, pages, parent=bookmark_object)
+            children, page_references, parent=bookmark_object)
         bookmark_object.Count = 1 + children_count
         if bookmark_objects:
             bookmark_object.Prev = bookmark_objects[-1]
@@ -226,17 +234,310 @@ def create_bookmarks(bookmarks, pages, parent=None):
     return bookmark_objects, count
 
 
+# Tokens starting PDF values, used to find where dictionary values end
+PDF_TOKEN_RE = re.compile(br"""\s*(?:
+    (?P<dict_open><<) | (?P<dict_close>>>) |
+    (?P<array_open>\[) | (?P<array_close>\]) |
+    (?P<string>\() | (?P<hex_string><[0-9A-Fa-f\s]*>) |
+    (?P<name>/[^\s/<>\[\]()%{}]*) |
+    (?P<reference>\d+\s+\d+\s+R\b) |
+    (?P<other>[^\s/<>\[\]()%{}]+))""", re.VERBOSE)
+OBJECT_HEADER_RE = re.compile(br'\s*(\d+)\s+(\d+)\s+obj')
+REFERENCE_RE = re.compile(br'(\d+)\s+\d+\s+R')
+NUMBER_RE = re.compile(br'[-+]?[0-9.]+')
+STARTXREF_RE = re.compile(br'startxref\s+(\d+)\s+%%EOF\s*$')
+
+
+def _skip_value(data, position):
+    """Return the index of the end of the PDF value found at ``position``."""
+    match = PDF_TOKEN_RE.match(data, position)
+    if match is None:
+        raise ValueError('Invalid PDF value at %i' % position)
+    kind = match.lastgroup
+    position = match.end()
+    if kind in ('dict_open', 'array_open'):
+        closing = 'dict_close' if kind == 'dict_open' else 'array_close'
+        while True:
+            match = PDF_TOKEN_RE.match(data, position)
+            if match is None:
+                raise ValueError('Unclosed PDF container')
+            if match.lastgroup == closing:
+                return match.end()
+            position = _skip_value(data, position)
+    elif kind == 'string':
+        depth = 1
+        while depth:
+            character = data[position:position + 1]
+            if not character:
+                raise ValueError('Unclosed PDF string')
+            elif character == b'\\':
+                position += 1
+            elif character == b'(':
+                depth += 1
+            elif character == b')':
+                depth -= 1
+            position += 1
+    elif kind in ('dict_close', 'array_close'):
+        raise ValueError('Unexpected end of PDF container')
+    return position
+
+
+def _parse_dictionary(data, position=0):
+    """Parse the PDF dictionary found at ``position`` in ``data``.
+
+    Values are not parsed: they are kept as :class:`PdfObject` instances
+    holding their original source.
+
+    """
+    match = PDF_TOKEN_RE.match(data, position)
+    if match is None or match.lastgroup != 'dict_open':
+        raise ValueError('PDF object is not a dictionary')
+    dictionary = PdfDict()
+    position = match.end()
+    while True:
+        match = PDF_TOKEN_RE.match(data, position)
+        if match is not None and match.lastgroup == 'dict_close':
+            return dictionary
+        if match is None or match.lastgroup != 'name':
+            raise ValueError('Invalid PDF dictionary key')
+        end = _skip_value(data, match.end())
+        dictionary[BasePdfName(convert_load(match.group('name')))] = (
+            PdfObject(convert_load(data[match.end():end].strip())))
+        position = end
+
+
+def _format_pdf_object(obj, reference):
+    """Serialize ``obj`` as a native string.
+
+    ``reference`` is called for indirect objects, and returns the string
+    used to reference them.
+
+    """
+    if isinstance(obj, PdfDict):
+        return '<< %s >>' % ' '.join(
+            '%s %s' % (
+                getattr(key, 'encoded', None) or key,
+                reference(value) if _is_indirect(value)
+                else _format_pdf_object(value, reference))
+            for key, value in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        return '[%s]' % ' '.join(
+            reference(value) if _is_indirect(value)
+            else _format_pdf_object(value, reference)
+            for value in obj)
+    elif isinstance(obj, bool):
+        return 'true' if obj else 'false'
+    elif isinstance(obj, float):
+        # PDF doesn't handle exponent notation
+        return ('%.9f' % obj).rstrip('0').rstrip('.')
+    elif isinstance(obj, (PdfObject, PdfString, BasePdfName)):
+        return getattr(obj, 'encoded', None) or obj
+    elif isinstance(obj, basestring):
+        return PdfString.encode(obj)
+    else:
+        return str(obj)
+
+
+def _is_indirect(obj):
+    return isinstance(obj, PdfDict) and (obj.indirect or obj.stream)
+
+
+class PDFFile(object):
+    """PDF file generated by cairo, updated with an incremental update.
+
+    Only the trailer, the catalog, the page tree, the pages and the
+    document information dictionary are read, the other objects are kept
+    untouched. The dictionaries of :attr:`catalog`, :attr:`info` and
+    :attr:`pages` can be modified, :meth:`finish` appends the changed
+    objects and the new ones at the end of the file.
+
+    Raise :exc:`ValueError` when the file can't be updated this way, for
+    example when cairo uses cross-reference streams.
+
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+        # cairo’s trailer, startxref and %%EOF are usually under 200 bytes
+        fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(max(0, fileobj.tell() - 1024))
+        match = STARTXREF_RE.search(fileobj.read())
+        if match is None:
+            raise ValueError('No startxref found')
+        self.startxref = int(match.group(1))
+
+        fileobj.seek(self.startxref)
+        data = fileobj.read()
+        trailer_position = data.find(b'trailer')
+        if not data.startswith(b'xref') or trailer_position == -1:
+            raise ValueError('No cross-reference table found')
+        self.trailer = _parse_dictionary(data, trailer_position + 7)
+        if self.trailer.Prev is not None or self.trailer.Encrypt is not None:
+            raise ValueError('Updated or encrypted PDF file')
+
+        #: Maps object numbers to their offsets from the start of the file
+        self.offsets = {}
+        tokens = data[4:trailer_position].split()
+        while tokens:
+            first, count, tokens = int(tokens[0]), int(tokens[1]), tokens[2:]
+            for i in range(count):
+                offset, generation, kind = tokens[3 * i:3 * i + 3]
+                if kind == b'n':
+                    if int(generation) != 0:
+                        raise ValueError('Object with a generation number')
+                    self.offsets[first + i] = int(offset)
+            tokens = tokens[3 * count:]
+
+        self._object_numbers = {}
+        self._originals = {}
+        self._new_objects = []
+        self.size = int(self.trailer.Size)
+
+        self.catalog = self._read_dictionary(self.trailer.Root)
+        if self.trailer.Info is None:
+            self.info = PdfDict()
+        elif REFERENCE_RE.match(convert_store(self.trailer.Info)):
+            self.info = self._read_dictionary(self.trailer.Info)
+        else:
+            self.info = _parse_dictionary(convert_store(self.trailer.Info))
+        self.info.indirect = True
+        self.pages = []
+        self.page_references = []
+        self._read_page_tree(self.catalog.Pages, media_box=None)
+
+    def _read_dictionary(self, reference):
+        """Read the dictionary object referenced by ``reference``."""
+        match = REFERENCE_RE.match(convert_store(reference))
+        if match is None:
+            raise ValueError('Invalid reference %s' % reference)
+        object_number = int(match.group(1))
+        if object_number not in self.offsets:
+            raise ValueError('Object %i not found' % object_number)
+        self.fileobj.seek(self.offsets[object_number])
+        data = b''
+        while b'endobj' not in data:
+            chunk = self.fileobj.read(4096)
+            if not chunk:
+                break
+            data += chunk
+        match = OBJECT_HEADER_RE.match(data)
+        if match is None or int(match.group(1)) != object_number:
+            raise ValueError('Object %i not found' % object_number)
+        dictionary = _parse_dictionary(data, match.end())
+        self._object_numbers[id(dictionary)] = object_number
+        self._originals[object_number] = (dictionary, PdfDict(dictionary))
+        return dictionary
+
+    def _read_page_tree(self, reference, media_box):
+        node = self._read_dictionary(reference)
+        media_box = node.MediaBox or media_box
+        if node.Type == '/Pages':
+            for kid in REFERENCE_RE.finditer(convert_store(node.Kids)):
+                self._read_page_tree(
+                    PdfObject(convert_load(kid.group(0))), media_box)
+        else:
+            if media_box is None:
+                raise ValueError('Page without a media box')
+            if not isinstance(media_box, PdfArray):
+                media_box = PdfArray(
+                    PdfObject(convert_load(value)) for value in
+                    NUMBER_RE.findall(convert_store(media_box)))
+            node.MediaBox = media_box
+            self.pages.append(node)
+            self.page_references.append(reference)
+
+    def _reference(self, obj):
+        """Return a reference to ``obj``, numbering it if it's new."""
+        object_number = self._object_numbers.get(id(obj))
+        if object_number is None:
+            object_number = self._object_numbers[id(obj)] = self.size
+            self.size += 1
+            self._new_objects.append((object_number, obj))
+        return '%i 0 R' % object_number
+
+    def _write_object(self, object_number, obj, write):
+        offset = self.fileobj.tell()
+        write(convert_store('%i 0 obj\n' % object_number))
+        write(convert_store(_format_pdf_object(obj, self._reference)))
+        if obj.stream is not None:
+            stream = obj.stream
+            if not isinstance(stream, bytes):
+                stream = convert_store(stream)
+            write(b'\nstream\n')
+            write(stream)
+            write(b'\nendstream')
+        write(b'\nendobj\n')
+        return offset
+
+    def finish(self):
+        """Write the changed and new objects, with their cross-reference
+        table and the new trailer.
+
+        """
+        self.fileobj.seek(0, os.SEEK_END)
+        write = self.fileobj.write
+        offsets = {}
+        for object_number, (dictionary, original) in sorted(
+                self._originals.items()):
+            if dictionary != original:
+                offsets[object_number] = self._write_object(
+                    object_number, dictionary, write)
+        info_reference = self._reference(self.info)
+        # Writing objects may add new objects
+        while self._new_objects:
+            object_number, obj = self._new_objects.pop(0)
+            offsets[object_number] = self._write_object(
+                object_number, obj, write)
+
+        startxref = self.fileobj.tell()
+        write(b'xref\n')
+        object_numbers = sorted(offsets)
+        while object_numbers:
+            count = 1
+            while (count < len(object_numbers) and
+                   object_numbers[count] == object_numbers[0] + count):
+                count += 1
+            write(convert_store('%i %i\n' % (object_numbers[0], count)))
+            for object_number in object_numbers[:count]:
+                write(convert_store(
+                    '%010i 00000 n \n' % offsets[object_number]))
+            object_numbers = object_numbers[count:]
+
+        trailer = OrderedDict((
+            ('Size', self.size), ('Root', self.trailer.Root),
+            ('Info', info_reference), ('Prev', self.startxref)))
+        if self.trailer.ID is not None:
+            trailer['ID'] = self.trailer.ID
+        write(convert_store('trailer\n<< %s >>\nstartxref\n%i\n%%%%EOF\n' % (
+            ' '.join('/%s %s' % item for item in trailer.items()),
+            startxref)))
+
+
 def write_pdf_metadata(document, fileobj, scale, metadata, attachments,
                        url_fetcher):
-    """Append to a seekable file-like object to add PDF metadata."""
-    fileobj.seek(0)
-    trailer = PdfReader(fileobj)
-    pages = trailer.Root.Pages.Kids
+    """Append to a seekable file-like object to add PDF metadata.
 
-    bookmarks, links = prepare_metadata(document, scale, pages)
+    The metadata is added in an incremental update at the end of the file.
+    Files that can't be read by :class:`PDFFile` are entirely rewritten.
+
+    """
+    try:
+        pdf = PDFFile(fileobj)
+    except ValueError as exception:
+        LOGGER.debug('Rewriting the whole PDF file: %s', exception)
+        pdf = None
+        fileobj.seek(0)
+        trailer = PdfReader(fileobj)
+        catalog, info = trailer.Root, trailer.Info
+        pages = page_references = trailer.Root.Pages.Kids
+    else:
+        catalog, info = pdf.catalog, pdf.info
+        pages, page_references = pdf.pages, pdf.page_references
+
+    bookmarks, links = prepare_metadata(document, scale, page_references)
     if bookmarks:
-        bookmark_objects, count = create_bookmarks(bookmarks, pages)
-        trailer.Root.Outlines = PdfDict(
+        bookmark_objects, count = create_bookmarks(bookmarks, page_references)
+        catalog.Outlines = PdfDict(
             Type=PdfName('Outlines'), Count=count,
             First=bookmark_objects[0], Last=bookmark_objects[-1])
 
@@ -249,7 +550,7 @@ def write_pdf_metadata(document, fileobj, scale, metadata, attachments,
                 embedded_files.append(PdfString.encode('attachment'))
                 embedded_files.append(attachment_object)
         if embedded_files:
-            trailer.Root.Names = PdfDict(
+            catalog.Names = PdfDict(
                 EmbeddedFiles=PdfDict(Names=PdfArray(embedded_files)))
 
     # A single link can be split in multiple regions. We don't want to embedded
@@ -305,20 +606,20 @@ def write_pdf_metadata(document, fileobj, scale, metadata, attachments,
         if annotations:
             page.Annots = annotations
 
-    trailer.Info.Producer = VERSION_STRING
+    info.Producer = VERSION_STRING
     for attr, key in (('title', 'Title'), ('description', 'Subject'),
                       ('generator', 'Creator')):
         value = getattr(metadata, attr)
         if value is not None:
-            setattr(trailer.Info, key, value)
+            setattr(info, key, value)
     for attr, key in (('authors', 'Author'), ('keywords', 'Keywords')):
         value = getattr(metadata, attr)
         if value is not None:
-            setattr(trailer.Info, key, ', '.join(getattr(metadata, attr)))
+            setattr(info, key, ', '.join(getattr(metadata, attr)))
     for attr, key in (('created', 'CreationDate'), ('modified', 'ModDate')):
         value = w3c_date_to_pdf(getattr(metadata, attr), attr)
         if value is not None:
-            setattr(trailer.Info, key, value)
+            setattr(info, key, value)
 
     for page, document_page in zip(pages, document.pages):
         left, top, right, bottom = (float(value) for value in page.MediaBox)
@@ -341,9 +642,12 @@ def write_pdf_metadata(document, fileobj, scale, metadata, attachments,
         page.BleedBox = PdfArray(
             (bleed_left, bleed_top, bleed_right, bleed_bottom))
 
-    fileobj.seek(0)
-    PdfWriter().write(fileobj, trailer=trailer)
-    fileobj.truncate()
+    if pdf is None:
+        fileobj.seek(0)
+        PdfWriter().write(fileobj, trailer=trailer)
+        fileobj.truncate()
+    else:
+        pdf.finish()
 
 
 def w3c_date_to_pdf(string, attr_name):
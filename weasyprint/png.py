@@ -0,0 +1,133 @@
+# coding: utf-8
+"""
+    weasyprint.png
+    --------------
+
+    Streaming PNG encoder for images painted in horizontal bands.
+
+    Cairo can only write whole image surfaces to PNG files, this encoder
+    writes an image whose rows are given band by band, so that only one band
+    has to be kept in memory.
+
+    :copyright: Copyright 2011-2014 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals
+
+import io
+import struct
+import zlib
+
+import cairocffi as cairo
+
+from .compat import xrange
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Size of the IDAT chunks. The compressed data is split in chunks of this
+# fixed size, the output thus doesn't depend on the height of the bands.
+IDAT_CHUNK_SIZE = 8192
+
+# Number of rows added above each band, see _filtered_rows
+EXTRA_ROWS = 2
+
+
+def _write_chunk(file_obj, chunk_type, data):
+    file_obj.write(struct.pack('>I', len(data)))
+    file_obj.write(chunk_type)
+    file_obj.write(data)
+    file_obj.write(struct.pack(
+        '>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def _read_chunks(png_bytes):
+    """Yield the ``(chunk_type, data)`` tuples of a PNG file."""
+    assert png_bytes[:len(PNG_SIGNATURE)] == PNG_SIGNATURE
+    position = len(PNG_SIGNATURE)
+    while position < len(png_bytes):
+        length, = struct.unpack('>I', png_bytes[position:position + 4])
+        chunk_type = png_bytes[position + 4:position + 8]
+        yield chunk_type, png_bytes[position + 8:position + 8 + length]
+        position += 12 + length
+
+
+def _filtered_rows(band, previous_row):
+    """Return the filtered rows of ``band``, as stored in PNG files.
+
+    Cairo writes the band in a PNG file, it unpremultiplies the colors and
+    libpng filters each row according to the row above. The filtered rows
+    are the uncompressed content of the PNG file.
+
+    Two rows are added above the band before writing it. The second one is
+    ``previous_row``, the last row of the previous band, or transparent for
+    the first band: the first row of the band is then filtered according to
+    the row really above it in the final image. The first one is always
+    transparent, so that cairo keeps the alpha channel of opaque bands.
+
+    """
+    width = band.get_width()
+    surface = cairo.ImageSurface(
+        cairo.FORMAT_ARGB32, width, band.get_height() + EXTRA_ROWS)
+    context = cairo.Context(surface)
+    if previous_row is not None:
+        context.set_source_surface(previous_row, 0, EXTRA_ROWS - 1)
+        context.paint()
+    context.set_source_surface(band, 0, EXTRA_ROWS)
+    context.paint()
+    file_obj = io.BytesIO()
+    surface.write_to_png(file_obj)
+    data = []
+    for chunk_type, chunk_data in _read_chunks(file_obj.getvalue()):
+        if chunk_type == b'IHDR':
+            # 8-bit RGBA, non-interlaced
+            assert chunk_data[8:] == b'\x08\x06\x00\x00\x00'
+        elif chunk_type == b'IDAT':
+            data.append(chunk_data)
+    rows = zlib.decompress(b''.join(data))
+    # Each row is a filter type byte followed by the pixels
+    return rows[EXTRA_ROWS * (1 + width * 4):]
+
+
+def _last_row(band):
+    """Return a copy of the last row of ``band``."""
+    row = cairo.ImageSurface(cairo.FORMAT_ARGB32, band.get_width(), 1)
+    context = cairo.Context(row)
+    context.set_source_surface(band, 0, 1 - band.get_height())
+    context.paint()
+    return row
+
+
+def write_png(file_obj, width, height, bands):
+    """Write a PNG image in ``file_obj``.
+
+    :param width: The width of the image, in pixels.
+    :param height: The height of the image, in pixels.
+    :param bands:
+        An iterable of ARGB32 :class:`cairocffi.ImageSurface` objects whose
+        width is :obj:`width` and whose heights sum to :obj:`height`, from the
+        top to the bottom of the image.
+
+    The image is written as non-interlaced 8-bit RGBA, with the rows filtered
+    by libpng as in the files written by cairo.
+
+    """
+    file_obj.write(PNG_SIGNATURE)
+    _write_chunk(file_obj, b'IHDR', struct.pack(
+        '>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+    compressor = zlib.compressobj()
+    data = bytearray()
+    previous_row = None
+    for band in bands:
+        assert band.get_width() == width
+        data += compressor.compress(_filtered_rows(band, previous_row))
+        previous_row = _last_row(band)
+        while len(data) >= IDAT_CHUNK_SIZE:
+            _write_chunk(file_obj, b'IDAT', bytes(data[:IDAT_CHUNK_SIZE]))
+            del data[:IDAT_CHUNK_SIZE]
+    data += compressor.flush()
+    for start in xrange(0, len(data), IDAT_CHUNK_SIZE):
+        _write_chunk(
+            file_obj, b'IDAT', bytes(data[start:start + IDAT_CHUNK_SIZE]))
+    _write_chunk(file_obj, b'IEND', b'')
@@ -15,6 +15,7 @@ from __future__ import division, unicode_literals
 import contextlib
 import gzip
 import io
+import logging
 import math
 import os
 import sys
@@ -26,10 +27,14 @@ import cairocffi as cairo
 import pytest
 from pdfrw import PdfReader
 
-from .. import CSS, HTML, __main__, default_url_fetcher, navigator
+from .. import (
+    CSS, HTML, ImageCache, Renderer, __main__, default_url_fetcher,
+    navigator, png)
 from ..compat import iteritems, urlencode, urljoin, urlparse_uses_relative
+from ..document import Document
+from ..logger import LOGGER
 from ..urls import path2url
-from .test_draw import image_to_pixels
+from .test_draw import image_to_pixels, requires
 from .testing_utils import (
     FakeHTML, assert_no_logs, capture_logs, http_server, resource_filename,
     temp_directory)
@@ -280,6 +285,19 @@ def test_python_render():
         assert read_file(png_filename) == png_bytes
         _assert_equivalent_pdf(read_file(pdf_filename), pdf_bytes)
 
+        # Seekable and readable files are directly updated
+        pdf_filename = os.path.join(temp, '3.pdf')
+        with open(pdf_filename, 'wb') as pdf_file:
+            pdf_file.write(b'_' * 2 * len(pdf_bytes))
+        with open(pdf_filename, 'r+b') as pdf_file:
+            html.write_pdf(pdf_file, stylesheets=[css])
+        _assert_equivalent_pdf(read_file(pdf_filename), pdf_bytes)
+        assert b'_' * 10 not in read_file(pdf_filename)
+
+    pdf_file = io.BytesIO()
+    html.write_pdf(pdf_file, stylesheets=[css])
+    _assert_equivalent_pdf(pdf_file.getvalue(), pdf_bytes)
+
     x2_png_bytes = html.write_png(stylesheets=[css], resolution=192)
     check_png_pattern(x2_png_bytes, x2=True)
 
@@ -536,6 +554,308 @@ def test_low_level_api():
     assert png_size(document.copy([page_2]).write_png()) == (6, 4)
 
 
+@assert_no_logs
+def test_streaming():
+    html = FakeHTML(string='''
+        <style>
+            @page { size: 100px; margin: 10px }
+            p { break-after: page }
+            @page :first { @top-center { content: counter(page) } }
+        </style>
+        <h1>Title</h1>
+        <p><a href="#end">link</a></p>
+        <p>2</p>
+        <p id="end">3</p>
+    ''')
+    pages = html.render_iter()
+    first_page = next(pages)
+    assert first_page.bookmarks[0][:2] == (1, 'Title')
+    html_box, top_center = first_page._page_box.children
+    assert 1 + len(list(pages)) == len(html.render().pages) == 3
+
+    pdf_bytes = html.write_pdf(streaming=True)
+    _assert_equivalent_pdf(pdf_bytes, html.write_pdf())
+    link, = PdfReader(fdata=pdf_bytes).Root.Pages.Kids[0].Annots
+    assert link.A.S == '/GoTo'
+
+
+@assert_no_logs
+def test_streaming_page_count():
+    html = FakeHTML(string='''
+        <style>
+            @page { size: 100px; margin: 10px }
+            p { break-after: page }
+            @page :first { @top-center { content: counter(page) } }
+            @page :left {
+                @bottom-center { content: counter(page) " / " counter(pages) }
+            }
+        </style>
+        <h1>Title</h1>
+        <p><a href="#end">link</a></p>
+        <p>2</p>
+        <p id="end">3</p>
+    ''')
+    pages = html.render_iter()
+    first_page = next(pages)
+    html_box, top_center = first_page._page_box.children
+    assert html_box.children
+    # The page needing "counter(pages)" is recorded and released, its margin
+    # boxes are drawn once the whole document is laid out. The following page
+    # is kept in order.
+    LOGGER.setLevel(logging.DEBUG)
+    try:
+        with capture_logs() as logs:
+            second_page, third_page = pages
+    finally:
+        LOGGER.setLevel(logging.WARNING)
+    assert (
+        'DEBUG: Streaming: page 2 needs the number of pages, '
+        'the next pages are held until the end') in logs
+    html_box, bottom_center = second_page._page_box.children
+    assert html_box.children == []
+    line_box, = bottom_center.children
+    text_box, = line_box.children
+    assert text_box.text == '2 / 3'
+    assert third_page._page_box is None
+
+    document = html.render()
+    streamed_document = Document(
+        [first_page, second_page, third_page], document.metadata,
+        document.url_fetcher)
+    assert streamed_document.write_png() == document.write_png()
+    pdf_bytes = html.write_pdf(streaming=True)
+    _assert_equivalent_pdf(pdf_bytes, html.write_pdf())
+
+
+@assert_no_logs
+def test_release_boxes():
+    html = FakeHTML(string='<body><a href="#top" id="top">')
+    css = CSS(string='''
+        @page { margin: 2px; size: 8px; background: #fff }
+        html { background: #00f; }
+        body { background: #f00; width: 1px; height: 1px }
+        a { display: block; width: 1px; height: 1px }
+    ''')
+    png_bytes = html.write_png(stylesheets=[css])
+
+    document = html.render([css], enable_hinting=True)
+    page, = document.pages
+    assert document.write_png(release_boxes=True) == (png_bytes, 8, 8)
+    assert page._page_box is None
+    # The boxes are drawn directly, no display list is recorded
+    assert page._display_list is None
+    assert page.links == [('internal', 'top', (2, 2, 1, 1))]
+    assert page.anchors == {'top': (2, 2)}
+
+    # Pages recorded before are painted again with their display list
+    document = html.render([css], enable_hinting=True)
+    page, = document.pages
+    document.record(release_boxes=False)
+    display_list = page._display_list
+    assert document.write_png(release_boxes=True) == (png_bytes, 8, 8)
+    assert page._page_box is None
+    assert page._display_list is display_list
+    assert document.write_png() == (png_bytes, 8, 8)
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 8, 8)
+    page.paint(cairo.Context(surface))
+    file_obj = io.BytesIO()
+    surface.write_to_png(file_obj)
+    check_png_pattern(file_obj.getvalue())
+
+    document = html.render([css])
+    pdf_bytes = document.write_pdf(release_boxes=True)
+    assert document.pages[0]._page_box is None
+    assert document.pages[0]._display_list is None
+    link, = PdfReader(fdata=pdf_bytes).Root.Pages.Kids[0].Annots
+    assert link.A.S == '/GoTo'
+
+
+@assert_no_logs
+def test_record():
+    html = FakeHTML(string='<body>')
+    css = CSS(string='''
+        @page { margin: 2px; size: 8px; background: #fff }
+        html { background: #00f; }
+        body { background: #f00; width: 1px; height: 1px }
+    ''')
+    png_bytes = html.write_png(stylesheets=[css])
+
+    document = html.render([css], enable_hinting=True)
+    document.record(release_boxes=False)
+    page, = document.pages
+    assert page._page_box is not None
+    display_list = page._display_list
+    # The same display list is replayed for all the outputs, at any scale
+    assert document.write_png() == (png_bytes, 8, 8)
+    check_png_pattern(document.write_png(resolution=192)[0], x2=True)
+    assert document.write_pdf().startswith(b'%PDF')
+    assert page._display_list is display_list
+
+    page.record()
+    assert page._page_box is None
+    assert page._display_list is display_list
+
+
+@assert_no_logs
+def test_write_png_pages():
+    document = FakeHTML(string='''
+        <style>
+            @page:first { size: 5px 10px } @page { size: 6px 4px }
+            p { page-break-before: always }
+        </style>
+        <p></p>
+        <p></p>
+    ''').render()
+    page_1, page_2 = document.pages
+    expected = [
+        document.copy([page_1]).write_png(),
+        document.copy([page_2]).write_png()]
+    assert list(document.write_png_pages()) == expected
+    assert [size for _, size, _ in expected] == [5, 6]
+
+    futures = pytest.importorskip('concurrent.futures')
+    with futures.ThreadPoolExecutor(2) as executor:
+        results = list(document.write_png_pages(executor=executor))
+    assert results == expected
+    with futures.ProcessPoolExecutor(1) as executor:
+        with pytest.raises(TypeError):
+            document.write_png_pages(executor=executor)
+    assert page_1._page_box is not None
+    assert page_1._display_list is page_2._display_list is None
+
+    class Future(object):
+        def __init__(self, result):
+            self._result = result
+
+        def result(self):
+            return self._result
+
+    class Executor(object):
+        def __init__(self):
+            self.submitted = []
+
+        def submit(self, function, *args):
+            self.submitted.append(args[0])
+            return Future(function(*args))
+
+    # Pages are submitted max_pending pages ahead, display lists recorded
+    # before the call are kept
+    page_2.record(release_boxes=False)
+    display_list = page_2._display_list
+    executor = Executor()
+    results = document.write_png_pages(executor=executor, max_pending=1)
+    assert next(results) == expected[0]
+    assert executor.submitted == [page_1]
+    assert page_1._display_list is None
+    assert next(results) == expected[1]
+    assert executor.submitted == [page_1, page_2]
+    assert page_2._display_list is display_list
+    assert list(results) == []
+
+
+def png_rows(png_bytes):
+    """Return the uncompressed, filtered rows of a PNG file."""
+    return zlib.decompress(b''.join(
+        data for chunk_type, data in png._read_chunks(png_bytes)
+        if chunk_type == b'IDAT'))
+
+
+@assert_no_logs
+def test_write_png_bands():
+    document = FakeHTML(string='''
+        <style>
+            @page:first { size: 5px 10px; background: rgba(0, 0, 255, 0.5) }
+            @page { size: 6px 4px; background: red }
+            p { page-break-before: always }
+        </style>
+        <p></p>
+        <p></p>
+    ''').render()
+    png_bytes, width, height = document.write_png()
+    surface = cairo.ImageSurface.create_from_png(io.BytesIO(png_bytes))
+    pixels = image_to_pixels(surface, 6, 14)
+
+    results = [
+        document.write_png(band_height=band_height)
+        for band_height in (1, 3, 10, 100)]
+    assert all(result == results[0] for result in results)
+    banded_bytes, width, height = results[0]
+    assert (width, height) == (6, 14)
+    surface = cairo.ImageSurface.create_from_png(io.BytesIO(banded_bytes))
+    assert image_to_pixels(surface, 6, 14) == pixels
+    # Rows are filtered as in the files written by cairo
+    assert png_rows(banded_bytes) == png_rows(png_bytes)
+
+    file_obj = io.BytesIO()
+    assert document.write_png(file_obj, band_height=5) == (None, 6, 14)
+    assert file_obj.getvalue() == banded_bytes
+
+
+@assert_no_logs
+def test_renderer():
+    pattern_png = read_file(resource_filename('pattern.png'))
+
+    def fetcher(url):
+        if url == 'weasyprint-custom:pattern':
+            return dict(string=pattern_png, mime_type='image/png')
+        return default_url_fetcher(url)
+
+    renderer = Renderer(stylesheets=[CSS(string='@page { size: 100px }')])
+    sources = [
+        FakeHTML(string='<img src="weasyprint-custom:pattern"><p>%i' % i,
+                 url_fetcher=fetcher)
+        for i in range(3)]
+    documents = list(renderer.render_many(sources, enable_hinting=True))
+    assert [len(document.pages) for document in documents] == [1, 1, 1]
+    assert [document.pages[0].width for document in documents] == [100] * 3
+    # Resources are shared by all the documents
+    assert (renderer.image_cache.hits, renderer.image_cache.misses) == (2, 1)
+    assert renderer.pango_context_pool.contexts_created == 1
+    assert renderer.pango_context_pool.layouts_created >= 3
+
+    assert renderer.write_pdf(sources[0]).startswith(b'%PDF')
+    assert renderer.pango_context_pool.contexts_created == 2
+
+
+@assert_no_logs
+@requires('pango', '1.38')
+def test_renderer_font_faces():
+    font_face = '@font-face { src: url(%s); font-family: %%s }' % (
+        path2url(resource_filename('weasyprint.otf')))
+    renderer = Renderer(stylesheets=[CSS(string=font_face % 'user')])
+    filenames = list(renderer.font_config._filenames)
+    html = (
+        '<style>%s</style><span style="font-family: user">abc</span>'
+        '<span style="font-family: weasyprint">abc</span>')
+    sources = [
+        FakeHTML(string=html % (font_face % 'weasyprint')),
+        FakeHTML(string=html % '')] * 10
+    widths = []
+    for document in renderer.render_many(sources):
+        html_box, = document.pages[0]._page_box.children
+        body, = html_box.children
+        line, = body.children
+        widths.append([span.width for span in line.children])
+    # The fonts of the user stylesheets are available in all the documents,
+    # the fonts of a document are only available in this document
+    assert widths[0::2] == [[3 * 16, 3 * 16]] * 10
+    assert widths[1::2] == [widths[1]] * 10
+    assert widths[1][0] == 3 * 16
+    assert widths[1][1] != 3 * 16
+    # The fonts of the user stylesheets are only added once
+    assert renderer.font_config._filenames == filenames
+
+
+@assert_no_logs
+def test_layouts_created():
+    document = FakeHTML(string='<p>a b c</p>').render()
+    layouts_created = document.layouts_created
+    assert layouts_created > 0
+    assert document.copy().layouts_created is None
+    document = FakeHTML(string='<p>a b c</p>' * 2).render()
+    assert document.layouts_created > layouts_created
+
+
 def round_meta(pages):
     """Eliminate errors of floating point arithmetic for metadata.
     (eg. 49.99999999999994 instead of 50)
@@ -947,6 +1267,65 @@ def test_url_fetcher():
                     'é_%e9.css"><body>', url_fetcher=fetcher_2).render()
 
 
+@assert_no_logs
+def test_image_cache():
+    pattern_png = read_file(resource_filename('pattern.png'))
+    fetched = []
+
+    def fetcher(url):
+        fetched.append(url)
+        if url == 'weasyprint-custom:pattern':
+            return dict(string=pattern_png, mime_type='image/png')
+        return default_url_fetcher(url)
+
+    css = CSS(string='''
+        @page { size: 8px; margin: 2px; background: #fff }
+        body { margin: 0; font-size: 0 }
+    ''')
+    html = FakeHTML(
+        string='<body><img src="weasyprint-custom:pattern">',
+        url_fetcher=fetcher)
+
+    image_cache = ImageCache()
+    for _ in range(2):
+        check_png_pattern(html.write_png(
+            stylesheets=[css], image_cache=image_cache))
+    assert fetched == ['weasyprint-custom:pattern']
+    assert len(image_cache) == 1
+    assert (image_cache.hits, image_cache.misses) == (1, 1)
+    assert image_cache.hit_rate == 0.5
+    assert image_cache.size == 4 * 4 * 4
+
+    # Images loaded with other URL fetchers are not shared
+    fetched_2 = []
+
+    def fetcher_2(url):
+        fetched_2.append(url)
+        return dict(string=pattern_png, mime_type='image/png')
+
+    check_png_pattern(FakeHTML(
+        string='<body><img src="weasyprint-custom:pattern">',
+        url_fetcher=fetcher_2).write_png(
+            stylesheets=[css], image_cache=image_cache))
+    assert fetched_2 == ['weasyprint-custom:pattern']
+    assert len(image_cache) == 2
+
+    # Images are fetched again but not decoded again when content is checked
+    image_cache = ImageCache(check_content=True)
+    for _ in range(2):
+        check_png_pattern(html.write_png(
+            stylesheets=[css], image_cache=image_cache))
+    assert len(fetched) == 3
+    assert (image_cache.hits, image_cache.misses) == (1, 1)
+
+    # Least recently used images are removed when the cache is too large
+    image_cache = ImageCache(max_size=4 * 4 * 4 - 1)
+    html.write_png(stylesheets=[css], image_cache=image_cache)
+    assert len(image_cache) == image_cache.size == 0
+    image_cache.clear()
+    assert image_cache.hit_rate is None
+
+
 @assert_no_logs
 def test_html_meta():
     def assert_meta(html, **meta):
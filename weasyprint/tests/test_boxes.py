@@ -13,6 +13,7 @@
 from __future__ import division, unicode_literals
 
 import functools
+import sys
 
 from .. import images
 from ..css import PageType, get_all_computed_styles
@@ -182,6 +183,54 @@ def test_html_entities():
                 ('p', 'Text', '"abc"')])])
 
 
+@assert_no_logs
+def test_deep_box_tree():
+    """Test the creation of trees deeper than the recursion limit."""
+    depth = sys.getrecursionlimit() + 100
+    box = parse('<div>' * depth + 'deep' + '</div>' * depth)
+    body, = unwrap_html_body(box)
+    for _ in range(depth - 1):
+        assert body.element_tag == 'div'
+        body, = body.children
+    text, = body.children
+    assert text.text == 'deep'
+
+    # The anonymous boxes and the lines are created without recursion too
+    box = build.build_formatting_structure(*_parse_base(
+        '<div>' * depth + 'deep<p></p>' + '</div>' * depth))
+    body, = unwrap_html_body(box)
+    for _ in range(depth - 1):
+        assert body.element_tag == 'div'
+        body, = body.children
+    anonymous, paragraph = body.children
+    line, = anonymous.children
+    text, = line.children
+    assert isinstance(line, boxes.LineBox)
+    assert text.text == 'deep'
+    assert paragraph.element_tag == 'p'
+
+    # Inline boxes are split around blocks without recursion
+    box = build.build_formatting_structure(*_parse_base(
+        '<div>' + '<span>' * depth + 'deep<p></p>' + '</span>' * depth))
+    body, = unwrap_html_body(box)
+    div, = body.children
+    before, paragraph, after = div.children
+    assert paragraph.element_tag == 'p'
+    assert len(list(div.descendants())) == 2 * depth + 7
+    for anonymous in (before, after):
+        line, = anonymous.children
+        assert isinstance(line, boxes.LineBox)
+        span, = line.children
+        for _ in range(depth - 1):
+            assert span.element_tag == 'span'
+            span, = span.children
+        if anonymous is before:
+            text, = span.children
+            assert text.text == 'deep'
+        else:
+            assert span.children == ()
+
+
 @assert_no_logs
 def test_inline_in_block():
     """Test the management of inline boxes in block boxes."""
@@ -1405,7 +1454,7 @@ def test_margin_box_string_set():
 @assert_no_logs
 def test_page_counters():
     """Test page-based counters."""
-    pages = render_pages('''
+    html_content = '''
         <style>
             @page {
                 /* Make the page content area only 10px high and wide,
@@ -1418,12 +1467,21 @@ def test_page_counters():
             }
         </style>
         <p>lorem ipsum dolor
-    ''')
-    for page_number, page in enumerate(pages, 1):
+    '''
+    pages = render_pages(html_content)
+    # The margin boxes of streamed pages are laid out at the end
+    streamed_pages = [page._page_box for page in FakeHTML(
+        string=html_content, base_url=BASE_URL).render_iter()]
+    for pages in (pages, streamed_pages):
+        for page_number, page in enumerate(pages, 1):
+            html, bottom_center = page.children
+            line_box, = bottom_center.children
+            text_box, = line_box.children
+            assert text_box.text == 'Page {0} of 3.'.format(page_number)
+    # Only the margin boxes are kept until the end, the content is released
+    for page in streamed_pages:
         html, bottom_center = page.children
-        line_box, = bottom_center.children
-        text_box, = line_box.children
-        assert text_box.text == 'Page {0} of 3.'.format(page_number)
+        assert html.children == []
 
 
 @assert_no_logs
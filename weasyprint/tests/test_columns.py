@@ -12,6 +12,9 @@
 
 from __future__ import division, unicode_literals
 
+from ..formatting_structure import boxes
+from ..layout import blocks
+from ..layout.blocks import balance_columns
 from .test_boxes import render_pages as parse
 from .testing_utils import assert_no_logs
 
@@ -221,3 +224,170 @@ def test_columns_relative():
     span, = absolute_line.children
     assert span.position_x == 5  # Default position of the 4th column
     assert span.position_y == 4  # div's 1px + span's 3px
+
+
+@assert_no_logs
+def test_balance_columns():
+    """Test the column heights found by bisection."""
+    units = [(i, i + 1, False) for i in range(10)]
+    height, column_starts, iterations = balance_columns(units, 3, 0, 10 / 3)
+    assert (height, column_starts) == (4, [0, 4, 8])
+    assert iterations < 15
+
+    # Forced column breaks
+    units[5] = (5, 6, True)
+    assert balance_columns(units, 3, 0, 10 / 3)[:2] == (5, [0, 5])
+    units[2] = (2, 3, True)
+    assert balance_columns(units, 2, 0, 5)[:2] == (10, None)
+
+    # The content already fits
+    assert balance_columns(units[:2], 3, 0, 5) == (5, [0], 1)
+
+
+@assert_no_logs
+def test_columns_forced_break():
+    """Test forced column breaks."""
+    page, = parse('''
+        <style>
+            div { columns: 2; column-gap: 0 }
+            body { margin: 0; font-family: "ahem"; line-height: 1px }
+            @page { margin: 0; size: 2px 50px; font-size: 1px }
+            p { margin: 0 }
+        </style>
+        <div><p>a</p><p style="break-before: column">b c d</p></div>
+    ''')
+    html, = page.children
+    body, = html.children
+    div, = body.children
+    column_1, column_2 = div.children
+    paragraph_1, = column_1.children
+    paragraph_2, = column_2.children
+    assert len(paragraph_1.children) == 1
+    assert len(paragraph_2.children) == 3
+    assert div.height == 3
+    # The first height tried is too small for the forced break, the height
+    # is then found by bisection between 2px and 4px
+    assert div.column_balancing_iterations == 2 + 8
+
+
+@assert_no_logs
+def test_columns_lines():
+    """Test columns made of the lines of the balancing layout."""
+    page, = parse('''
+        <style>
+            div { columns: 3; column-gap: 5px }
+            body { margin: 0; font-family: "ahem" }
+            @page { margin: 0; size: 70px 50px; font-size: 10px;
+                    line-height: 10px }
+        </style>
+        <div>aa bb cc dd ee ff</div>
+    ''')
+    html, = page.children
+    body, = html.children
+    div, = body.children
+    columns = div.children
+    assert len(columns) == 3
+    assert [column.position_x for column in columns] == [0, 25, 50]
+    assert [column.position_y for column in columns] == [0, 0, 0]
+    assert [column.height for column in columns] == [20, 20, 20]
+    assert div.height == 20
+    # The lines fit in the ideal height, no bisection is needed
+    assert div.column_balancing_iterations == 1
+    texts = []
+    for column in columns:
+        for line in column.children:
+            text, = line.children
+            assert line.position_x == text.position_x == column.position_x
+            texts.append((text.text, line.position_y, text.position_y))
+    assert texts == [
+        ('aa', 0, 0), ('bb', 10, 10), ('cc', 0, 0), ('dd', 10, 10),
+        ('ee', 0, 0), ('ff', 10, 10)]
+
+
+def _column_geometry(page):
+    """Return the positions and sizes of the boxes in the columns of page."""
+    def geometry(box):
+        values = [type(box).__name__, box.position_x, box.position_y]
+        if isinstance(box, boxes.TextBox):
+            values.append(box.text)
+        else:
+            values.extend([
+                box.height, box.margin_top, box.padding_top,
+                box.border_top_width, box.margin_bottom, box.padding_bottom,
+                box.border_bottom_width])
+            values.extend(geometry(child) for child in box.children)
+        return values
+
+    html, = page.children
+    body, = html.children
+    div, = body.children
+    return geometry(div)
+
+
+@assert_no_logs
+def test_columns_blocks():
+    """Test columns made of the blocks of the balancing layout."""
+    html = '''
+        <style>
+            div { columns: 3; column-gap: 5px }
+            body { margin: 0; font-family: "ahem" }
+            p { margin: 0 }
+            @page { margin: 0; size: 70px 200px; font-size: 10px;
+                    line-height: 10px }
+            %s
+        </style>
+        <div><p>aa bb cc dd ee ff</p><p>gg hh</p><p>ii jj kk ll</p></div>'''
+    sliced_columns = blocks._sliced_columns
+    results = []
+
+    def record_sliced_columns(*args):
+        columns = sliced_columns(*args)
+        results.append(columns is not None)
+        return columns
+
+    for css, sliced in (
+            ('', True),
+            ('p { orphans: 1; widows: 1 }', True),
+            ('p { border-bottom: 1px solid; padding-bottom: 2px }', None),
+            ('p { margin: 3px 0 7px }', None),
+            ('p { break-inside: avoid }', None),
+            ('p { widows: 3 }', False),
+            ('p:last-child { break-before: avoid }', False)):
+        del results[:]
+        blocks._sliced_columns = record_sliced_columns
+        try:
+            page, = parse(html % css)
+        finally:
+            blocks._sliced_columns = sliced_columns
+        if sliced is not None:
+            assert results == [sliced]
+        # Relative blocks are laid out column by column, giving the same
+        # columns as the sliced blocks
+        laid_out_page, = parse(html % (css + 'p { position: relative }'))
+        assert _column_geometry(page) == _column_geometry(laid_out_page)
+
+    page, = parse(html % '')
+    html, = page.children
+    body, = html.children
+    div, = body.children
+    columns = div.children
+    assert [column.position_x for column in columns] == [0, 25, 50]
+    assert [column.height for column in columns] == [40, 40, 40]
+    # The first paragraph is split between the first and second columns
+    assert [len(column.children) for column in columns] == [1, 2, 1]
+    paragraph_1, = columns[0].children
+    paragraph_2, paragraph_3 = columns[1].children
+    paragraph_4, = columns[2].children
+    texts = []
+    for paragraph in (paragraph_1, paragraph_2, paragraph_3, paragraph_4):
+        assert paragraph.position_x == paragraph.children[0].position_x
+        texts.append([
+            (line.children[0].text, line.position_y)
+            for line in paragraph.children])
+    assert texts == [
+        [('aa', 0), ('bb', 10), ('cc', 20), ('dd', 30)],
+        [('ee', 0), ('ff', 10)], [('gg', 20), ('hh', 30)],
+        [('ii', 0), ('jj', 10), ('kk', 20), ('ll', 30)]]
+    assert [paragraph.height for paragraph in (
+        paragraph_1, paragraph_2, paragraph_3, paragraph_4)] == [
+            40, 20, 20, 40]
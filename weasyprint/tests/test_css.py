@@ -12,12 +12,15 @@
 
 from __future__ import division, unicode_literals
 
+import threading
+
 from pytest import raises
 
 from .. import CSS, css, default_url_fetcher
 from ..css import PageType, get_all_computed_styles
 from ..css.computed_values import strut_layout
 from ..layout.pages import set_page_type_computed_styles
+from ..logger import LOGGER, count_logs
 from ..urls import open_data_url, path2url
 from .testing_utils import (
     FakeHTML, assert_no_logs, capture_logs, resource_filename)
@@ -76,7 +79,7 @@ def test_find_stylesheets():
 
     sheets = list(css.find_stylesheets(
         html.wrapper_element, 'print', default_url_fetcher, html.base_url,
-        font_config=None, page_rules=None))
+        font_config=None))
     assert len(sheets) == 2
     # Also test that stylesheets are in tree order
     assert [s.base_url.rsplit('/', 1)[-1].rsplit(',', 1)[-1] for s in sheets] \
@@ -94,6 +97,113 @@ def test_find_stylesheets():
     # TODO: test that the values are correct too
 
 
+@assert_no_logs
+def test_stylesheet_cache():
+    cache = css.STYLESHEET_CACHE
+    cache.clear()
+    string = 'p { color: red } @page { size: 10px }'
+    stylesheet_1 = CSS(string=string)
+    assert (len(cache), cache.hits, cache.misses) == (1, 0, 1)
+    stylesheet_2 = CSS(string=string)
+    assert (len(cache), cache.hits, cache.misses) == (1, 1, 1)
+    assert stylesheet_1.matcher is stylesheet_2.matcher
+    assert stylesheet_1.page_rules is stylesheet_2.page_rules
+
+    # Stylesheets are different for other media types and base URLs
+    assert CSS(string=string, media_type='screen').matcher is not (
+        stylesheet_1.matcher)
+    assert CSS(string=string, base_url='http://a/').matcher is not (
+        stylesheet_1.matcher)
+    assert (len(cache), cache.hits, cache.misses) == (3, 1, 3)
+
+    # Stylesheets with errors are not cached
+    with capture_logs() as logs:
+        CSS(string='p { color: wrong }')
+        CSS(string='p { color: wrong }')
+    assert len(logs) == 2
+    assert (len(cache), cache.hits, cache.misses) == (3, 1, 5)
+
+    cache.clear()
+    assert (len(cache), cache.hits, cache.misses) == (0, 0, 0)
+    assert CSS(string=string).matcher is not stylesheet_1.matcher
+
+
+@assert_no_logs
+def test_stylesheet_cache_imports():
+    cache = css.STYLESHEET_CACHE
+    cache.clear()
+    imported = {'color': 'red'}
+
+    def url_fetcher(url):
+        if url == 'http://a/imported.css':
+            return {'string': 'p { color: %s }' % imported['color']}
+        return default_url_fetcher(url)
+
+    string = '@import "imported.css"; a { color: blue }'
+    colors = []
+    for color in ('red', 'lime'):
+        imported['color'] = color
+        stylesheet = CSS(
+            string=string, base_url='http://a/', url_fetcher=url_fetcher)
+        rules = stylesheet.matcher.lower_local_name_selectors['p'][0][4]
+        colors.append(rules[0][1])
+    assert colors[0] != colors[1]
+    # Only the imported stylesheets are looked for in the cache
+    assert (len(cache), cache.hits, cache.misses) == (0, 0, 2)
+
+
+@assert_no_logs
+def test_stylesheet_cache_font_faces():
+    class FontConfig(object):
+        def __init__(self):
+            self.font_faces = []
+
+        def add_font_face(self, rule_descriptors, url_fetcher):
+            self.font_faces.append(rule_descriptors['font_family'])
+            return 'file-%i' % len(self.font_faces)
+
+    css.STYLESHEET_CACHE.clear()
+    string = '''
+        @font-face { font-family: a; src: url(a.woff) }
+        @font-face { font-family: b; src: url(b.woff) }
+    '''
+    config_1, config_2 = FontConfig(), FontConfig()
+    stylesheet = CSS(
+        string=string, base_url='http://a/', font_config=config_1)
+    assert stylesheet.fonts == ['file-1', 'file-2']
+    # Font faces are added once per font configuration
+    for _ in range(3):
+        for config in (config_1, config_2):
+            stylesheet = CSS(
+                string=string, base_url='http://a/', font_config=config)
+            assert stylesheet.fonts == ['file-1', 'file-2']
+    assert config_1.font_faces == config_2.font_faces == ['a', 'b']
+    assert css.STYLESHEET_CACHE.hits == 6
+
+
+@assert_no_logs
+def test_count_logs_threads():
+    started, logged = threading.Event(), threading.Event()
+
+    def log_in_thread():
+        started.wait()
+        LOGGER.warning('logged by another thread')
+        logged.set()
+
+    thread = threading.Thread(target=log_in_thread)
+    thread.start()
+    with capture_logs() as messages:
+        with count_logs() as counter:
+            started.set()
+            logged.wait()
+            LOGGER.warning('logged by this thread')
+            LOGGER.info('not counted')
+    thread.join()
+    # Messages logged by other threads are not counted
+    assert counter.count == 1
+    assert len(messages) == 2
+
+
 @assert_no_logs
 def test_expand_shorthands():
     """Test the expand shorthands."""
@@ -337,6 +447,60 @@ def test_error_recovery():
     assert len(logs) == 4
 
 
+@assert_no_logs
+def test_selector_index():
+    stylesheet = CSS(string='''
+        p { color: red }
+        .a { color: blue }
+        .b, .c, #d { color: lime }
+        * { margin: 0 }
+    ''')
+    document = FakeHTML(string='<p class="a">a</p><div class="c">b</div>')
+    document._ua_stylesheets = lambda: []
+    style_for, _, _ = get_all_computed_styles(
+        document, user_stylesheets=[stylesheet])
+    _head, body = document.etree_element
+    paragraph, div = body
+    assert style_for(paragraph).color == (0, 0, 1, 1)
+    assert style_for(div).color == (0, 1, 0, 1)
+
+    # Only relevant selectors are tested: "*" for all the elements, plus "p"
+    # and ".a" for <p>, ".c" for <div>
+    assert stylesheet.matcher.matched_elements == 5
+    assert stylesheet.matcher.tested_selectors == 5 + 3
+
+
+@assert_no_logs
+def test_style_sharing():
+    document = FakeHTML(string='''
+        <style>
+            li { color: red }
+            li::before { content: attr(title) }
+            .b { color: blue }
+        </style>
+        <ul><li>1</li><li>2</li><li class="b">3</li><li id="d">4</li></ul>
+        <ol><li>5</li></ol>
+    ''')
+    style_for, _, _ = get_all_computed_styles(document)
+    _head, body = document.etree_element
+    ul, ol = body
+    li_1, li_2, li_3, li_4 = ul
+    li_5, = ol
+
+    # Same cascaded values and same parent style
+    assert style_for(li_1) is style_for(li_2)
+    # Different cascaded values
+    assert style_for(li_1) is not style_for(li_3)
+    assert style_for(li_3).color == (0, 0, 1, 1)
+    # Anchor depending on the element
+    assert style_for(li_1) is not style_for(li_4)
+    assert style_for(li_4).anchor == 'd'
+    # Different parent styles
+    assert style_for(li_1) is not style_for(li_5)
+    # Content depending on the element
+    assert style_for(li_1, 'before') is not style_for(li_2, 'before')
+
+
 @assert_no_logs
 def test_line_height_inheritance():
     document = FakeHTML(string='''
@@ -15,7 +15,7 @@ from __future__ import division, unicode_literals
 
 from ..formatting_structure import boxes
 from .test_boxes import render_pages as parse
-from .testing_utils import assert_no_logs
+from .testing_utils import assert_no_logs, layout_context
 
 
 def outer_area(box):
@@ -454,3 +454,45 @@ def test_preferred_widths():
     body, = html.children
     paragraph, = body.children
     assert paragraph.width == 40
+
+
+@assert_no_logs
+def test_many_floats():
+    page, = parse('''
+        <style>
+            @page { size: 200px 1000px }
+            body { width: 100px }
+            div { float: left; width: 10px; height: 10px }
+            div:nth-child(3n) { float: right; height: 20px }
+            p { clear: both; height: 5px }
+        </style>
+        %s<p></p>''' % ('<div></div>' * 60))
+    html, = page.children
+    body, = html.children
+    paragraph = body.children[-1]
+    floats = body.children[:-1]
+    positions = [(div.position_x, div.position_y) for div in floats]
+    # The first row holds 7 left floats and 3 taller right floats
+    assert positions[:3] == [(0, 0), (10, 0), (90, 0)]
+    assert positions[9:12] == [(60, 0), (0, 10), (60, 10)]
+    assert paragraph.border_box_y() == max(
+        div.position_y + div.height for div in floats)
+
+    context = layout_context()
+    context.create_block_formatting_context()
+    shapes = context.excluded_shapes
+    for div in floats:
+        shapes.append(div)
+    candidates = shapes.between(15, 15)
+    assert len(candidates) < len(floats)
+    assert set(candidates) >= set(
+        div for div in floats
+        if div.position_y <= 15 <= div.position_y + div.height)
+    candidates = shapes.below(30)
+    assert len(candidates) < len(floats)
+    assert set(candidates) >= set(
+        div for div in floats if div.position_y + div.height > 30)
+    floats[0].translate(dy=100)
+    assert floats[0] in shapes.below(100)
+    assert shapes.truncate(1) == floats[1:]
+    assert list(shapes) == floats[:1]
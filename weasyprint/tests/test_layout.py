@@ -3076,6 +3076,28 @@ def test_fixed_positioning():
     assert [c.element_tag for c in html.children] == ['p', 'body']
 
 
+@assert_no_logs
+def test_fixed_positioning_shared():
+    # Fixed boxes are laid out once for all the pages with the same geometry
+    pages = parse('''
+        <style>@page { size: 100px; margin: 0 }</style>
+        <div style="page-break-after: always">
+            <p style="position: fixed; top: 10px">a</p>
+        </div>
+        <div style="page-break-after: always">b</div>
+        <div style="page-break-after: always">c</div>
+        <div>d</div>
+    ''')
+    fixed_boxes = []
+    for page in pages[1:]:
+        html, = page.children
+        fixed_box, body = html.children
+        assert fixed_box.element_tag == 'p'
+        assert fixed_box.position_y == 10
+        fixed_boxes.append(fixed_box)
+    assert fixed_boxes[0] is fixed_boxes[1] is fixed_boxes[2]
+
+
 @assert_no_logs
 def test_font_stretch():
     page, = parse('''
@@ -18,10 +18,11 @@ import os
 
 import cairocffi
 import pytest
-from pdfrw import PdfReader
+from pdfrw import PdfArray, PdfReader
 
 from .. import Attachment
 from ..images import CAIRO_HAS_MIME_DATA
+from ..pdf import PDFFile
 from ..urls import path2url
 from .testing_utils import (
     FakeHTML, assert_no_logs, capture_logs, resource_filename, temp_directory)
@@ -54,6 +55,41 @@ def test_pdf_parser():
     ]
 
 
+@assert_no_logs
+def test_incremental_update():
+    fileobj = io.BytesIO()
+    surface = cairocffi.PDFSurface(fileobj, 1, 1)
+    for width, height in [(100, 100), (200, 10)]:
+        surface.set_size(width, height)
+        surface.show_page()
+    surface.finish()
+    original = fileobj.getvalue()
+
+    pdf = PDFFile(fileobj)
+    assert [page.MediaBox for page in pdf.pages] == [
+        ['0', '0', '100', '100'], ['0', '0', '200', '10']]
+    pdf.info.Title = 'Tést'
+    pdf.pages[1].TrimBox = PdfArray((1.5, 0, 200, 10))
+    pdf.finish()
+
+    # The original file is kept, the update is appended
+    pdf_bytes = fileobj.getvalue()
+    assert pdf_bytes.startswith(original)
+    assert pdf_bytes.count(b'%%EOF') == 2
+    pdf = PdfReader(fdata=pdf_bytes)
+    assert pdf.Info.Title.decode() == 'Tést'
+    first_page, second_page = pdf.Root.Pages.Kids
+    assert first_page.TrimBox is None
+    assert second_page.TrimBox == ['1.5', '0', '200', '10']
+
+    # Metadata is added to the file generated by cairo
+    pdf_bytes = FakeHTML(string='<title>Test</title><h1>a</h1>').write_pdf()
+    assert pdf_bytes.count(b'%%EOF') == 2
+    pdf = PdfReader(fdata=pdf_bytes)
+    assert pdf.Info.Title == '(Test)'
+    assert pdf.Root.Outlines.First.Title == '(a)'
+
+
 @assert_no_logs
 def test_page_size():
     pdf_bytes = FakeHTML(string='<style>@page{size:3in 4in').write_pdf()
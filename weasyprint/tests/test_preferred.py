@@ -0,0 +1,85 @@
+# coding: utf-8
+"""
+    weasyprint.tests.preferred
+    --------------------------
+
+    Tests for the preferred widths of boxes, also called min- and
+    max-content widths.
+
+    :copyright: Copyright 2011-2017 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals
+
+from ..css.properties import Dimension
+from ..layout.preferred import (
+    inline_content_widths, inline_max_content_width, inline_min_content_width,
+    max_content_width, min_content_width, min_max_content_widths)
+from .test_boxes import render_pages as parse
+from .testing_utils import assert_no_logs, layout_context
+
+
+@assert_no_logs
+def test_preferred_widths_cache():
+    page, = parse('''<style>p { font: 20px Ahem }</style>
+                     <p style="float: left">XX XXX<br>XX</p>''')
+    html, = page.children
+    body, = html.children
+    paragraph, = body.children
+    context = layout_context()
+    cache = context.intrinsic_widths
+    assert min_max_content_widths(context, paragraph) == (60, 120)
+    # The paragraph and its two lines
+    assert (cache.hits, cache.misses) == (0, 3)
+    assert min_content_width(context, paragraph) == 60
+    assert max_content_width(context, paragraph) == 120
+    assert (cache.hits, cache.misses) == (2, 3)
+
+    # Widths are computed again when the children are replaced
+    paragraph.children = paragraph.children[-1:]
+    assert min_max_content_widths(context, paragraph) == (40, 40)
+    assert (cache.hits, cache.misses) == (3, 4)
+
+    # Widths are computed again when the style is replaced or changed
+    paragraph.style = paragraph.style.copy()
+    assert min_max_content_widths(context, paragraph) == (40, 40)
+    assert (cache.hits, cache.misses) == (4, 5)
+    paragraph.style['width'] = Dimension(30, 'px')
+    cache.clear()
+    assert min_max_content_widths(context, paragraph) == (30, 30)
+    assert (cache.hits, cache.misses) == (4, 6)
+
+
+@assert_no_logs
+def test_inline_content_widths():
+    page, = parse('''
+        <style>p { font: 20px Ahem; white-space: pre-line }</style>
+        <p style="float: left">XX <em>X XXX
+        X<img src=pattern.png> </em>X X </p>''')
+    html, = page.children
+    body, = html.children
+    paragraph, = body.children
+    context = layout_context()
+    for line in paragraph.children:
+        # Both widths are computed in one walk, as they were separately
+        assert inline_content_widths(context, line, is_line_start=True) == (
+            inline_min_content_width(context, line, is_line_start=True),
+            inline_max_content_width(context, line, is_line_start=True))
+
+
+@assert_no_logs
+def test_preferred_widths_long_text():
+    words = ' '.join('X' * (i % 5 + 1) for i in range(500))
+    page, = parse('''<style>p { font: 20px Ahem; width: 100000px }</style>
+                     <p style="float: left">%s</p>''' % words)
+    html, = page.children
+    body, = html.children
+    paragraph, = body.children
+    line, = paragraph.children
+    context = layout_context()
+    assert min_content_width(context, paragraph) == 100
+    # The text is shaped once, not once per word
+    assert context.pango_context_pool.layouts_created == 1
+    assert max_content_width(context, paragraph) == 20 * len(words)
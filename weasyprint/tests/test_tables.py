@@ -1274,6 +1274,37 @@ def test_auto_layout_table():
     assert div.width == 340  # 200 + 2 * 50 + 2 * 20
 
 
+@assert_no_logs
+def test_sampled_auto_layout_table():
+    """Test the auto layout computed from the first rows of a table."""
+    for sample_rows, widths in (('none', (8, 12)), (2, (8, 8))):
+        page, = parse('''
+            <style>
+                table { -weasy-table-sample-rows: %s; border-spacing: 0 }
+                img { width: 8px }
+                td { padding: 0 }
+            </style>
+            <table>
+                <thead><tr><td><img src=pattern.png></td><td></td></tr>
+                <tbody>
+                    <tr><td></td><td><img src=pattern.png></td></tr>
+                    <tr><td></td><td></td></tr>
+                    <tr>
+                        <td><img src=pattern.png style="width: 4px"></td>
+                        <td><img src=pattern.png style="width: 12px"></td>
+                    </tr>
+            </table>
+        ''' % sample_rows)
+        html, = page.children
+        body, = html.children
+        table_wrapper, = body.children
+        table, = table_wrapper.children
+        thead, tbody = table.children
+        assert len(tbody.children) == 3
+        assert tuple(table.column_widths) == widths
+        assert table.width == sum(widths)
+
+
 @assert_no_logs
 def test_table_column_width():
     source = '''
@@ -12,11 +12,15 @@
 
 from __future__ import division, unicode_literals
 
+import cairocffi as cairo
+
 from ..css import StyleDict
 from ..css.properties import INITIAL_VALUES
-from ..text import split_first_line
+from ..text import (
+    LazyLayout, PangoContextPool, create_layout, get_size, pango,
+    show_first_line, split_first_line)
 from .test_layout import body_children, parse
-from .testing_utils import FONTS, assert_no_logs
+from .testing_utils import FONTS, assert_no_logs, layout_context
 
 FONTS = FONTS.split(', ')
 
@@ -760,3 +764,101 @@ def test_text_transform():
     line5, = p5.children
     text5, = line5.children
     assert text5.text == 'hé lO1'
+
+
+@assert_no_logs
+def test_pango_context_pool():
+    """Test that Pango contexts are shared by layouts."""
+    pool = PangoContextPool()
+    language = pango.pango_language_from_string(b'fr')
+    for hinting in (False, True, False, True):
+        pool.create_layout(hinting, None, None)
+        pool.create_layout(hinting, None, language)
+    assert pool.layouts_created == 8
+    assert pool.contexts_created == 4
+
+
+@assert_no_logs
+def test_pango_context_pool_hinted_drawing():
+    """Test that drawing hinted text doesn't change the measured widths."""
+    context = layout_context(enable_hinting=True)
+    style = dict(INITIAL_VALUES)
+    style['font_family'] = FONTS
+    style = StyleDict(style)
+    text = 'This is a text for test'
+
+    def measure():
+        layout = create_layout(text, style, context, None, 0)
+        line, = layout.iter_lines()
+        return layout, get_size(line, style)
+
+    layout, size = measure()
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 200, 50)
+    cairo_context = cairo.Context(surface)
+    cairo_context.scale(1.37, 1.37)
+    show_first_line(cairo_context, layout, hinting=True)
+    assert measure()[1] == size
+    assert context.pango_context_pool.contexts_created == 1
+
+
+@assert_no_logs
+def test_first_line_cache():
+    """Test that the measurements of split_first_line are cached."""
+    context = layout_context()
+    style = dict(INITIAL_VALUES)
+    style['font_family'] = FONTS
+    style = StyleDict(style)
+    text = 'This is a text for test'
+    results_1 = split_first_line(
+        text, style, context, max_width=100, justification_spacing=0)
+    results_2 = split_first_line(
+        text, style, context, max_width=100, justification_spacing=0)
+    assert context.first_line_cache.misses == 1
+    assert context.first_line_cache.hits == 1
+    layout_1, layout_2 = results_1[0], results_2[0]
+    assert results_1[1:] == results_2[1:]
+    assert isinstance(layout_2, LazyLayout)
+    assert layout_2.text_bytes == layout_1.text_bytes
+    line_1, = layout_1.iter_lines()
+    line_2, = layout_2.iter_lines()
+    assert line_1.length == line_2.length
+
+
+@assert_no_logs
+def test_line_breaking_long_text():
+    """Test that the first line of a long text is found in a short draft."""
+    text = ' '.join(['word'] * 5000)
+    layout, length, resume_at, _, _, _ = make_text(
+        text, 0, font_family=FONTS)
+    assert layout.text_bytes == b'word'
+    assert (length, resume_at) == (4, 5)
+
+    text = 'i' * 500 + ' ' + 'i' * 500
+    _, _, resume_at, _, _, _ = make_text(text, 100, font_family=FONTS)
+    assert text[resume_at:] == 'i' * 500
+
+
+@assert_no_logs
+def test_shaped_lines():
+    """Test that the lines of a paragraph are shaped once."""
+    style = dict(INITIAL_VALUES)
+    style['font_family'] = FONTS
+    style = StyleDict(style)
+    text = ' '.join(['word'] * 500)
+
+    def split_lines(context):
+        lines = []
+        remaining = text
+        while remaining:
+            layout, length, resume_at, width, _, _ = split_first_line(
+                remaining, style, context, max_width=200,
+                justification_spacing=0)
+            lines.append((layout.text_bytes, length, resume_at, width))
+            remaining = '' if resume_at is None else remaining[resume_at:]
+        return lines
+
+    context = layout_context()
+    lines = split_lines(context)
+    assert lines == split_lines(None)
+    assert len(lines) > 20
+    assert context.shaped_lines.hits > 2 * context.shaped_lines.misses
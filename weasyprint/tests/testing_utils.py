@@ -25,6 +25,8 @@ import wsgiref.simple_server
 import pytest
 
 from .. import CSS, HTML, text
+from ..fonts import FontConfiguration
+from ..layout import LayoutContext
 from ..logger import LOGGER
 
 # TODO: find a way to not depend on a specific font
@@ -41,6 +43,13 @@ class FakeHTML(HTML):
         return [TEST_UA_STYLESHEET]
 
 
+def layout_context(enable_hinting=False):
+    """Return a layout context for the functions measuring boxes and text."""
+    return LayoutContext(
+        enable_hinting=enable_hinting, style_for=None,
+        get_image_from_uri=None, font_config=FontConfiguration())
+
+
 def resource_filename(basename):
     """Return the absolute path of the resource called ``basename``."""
     return os.path.join(os.path.dirname(__file__), 'resources', basename)
@@ -13,7 +13,9 @@
 from __future__ import division
 
 import re
+import threading
 import warnings
+from collections import OrderedDict
 
 import cairocffi as cairo
 import cffi
@@ -64,6 +66,12 @@ ffi.cdef('''
     typedef ... PangoAttrList;
     typedef ... PangoAttrClass;
 
+    typedef struct _GSList GSList;
+    struct _GSList {
+        gpointer data;
+        GSList *next;
+    };
+
     typedef enum {
         PANGO_STYLE_NORMAL,
         PANGO_STYLE_OBLIQUE,
@@ -212,8 +220,22 @@ ffi.cdef('''
     void pango_layout_line_get_extents (
         PangoLayoutLine *line,
         PangoRectangle *ink_rect, PangoRectangle *logical_rect);
+    void pango_layout_line_index_to_x (
+        PangoLayoutLine *line, int index_, gboolean trailing, int *x_pos);
 
+    PangoLayout * pango_layout_new (PangoContext *context);
     PangoContext * pango_layout_get_context (PangoLayout *layout);
+    const char * pango_layout_get_text (PangoLayout *layout);
+    PangoAttrList * pango_layout_get_attributes (PangoLayout *layout);
+    PangoTabArray * pango_layout_get_tabs (PangoLayout *layout);
+    const PangoFontDescription * pango_layout_get_font_description (
+        PangoLayout *layout);
+    PangoWrapMode pango_layout_get_wrap (PangoLayout *layout);
+    PangoLayoutLine * pango_layout_get_line_readonly (
+        PangoLayout *layout, int line);
+    GSList * pango_layout_get_lines_readonly (PangoLayout *layout);
+    PangoFontMap * pango_context_get_font_map (PangoContext *context);
+    PangoLanguage * pango_context_get_language (PangoContext *context);
 
     void pango_get_log_attrs (
         const char *text, int length, int level, PangoLanguage *language,
@@ -222,8 +244,7 @@ ffi.cdef('''
 
     // PangoCairo
 
-    PangoLayout * pango_cairo_create_layout (cairo_t *cr);
-    void pango_cairo_update_layout (cairo_t *cr, PangoLayout *layout);
+    PangoContext * pango_cairo_create_context (cairo_t *cr);
     void pango_cairo_show_layout_line (cairo_t *cr, PangoLayoutLine *line);
 ''')
 
@@ -625,25 +646,83 @@ def first_line_metrics(first_line, text, layout, resume_at, space_collapse,
     return layout, length, resume_at, width, height, baseline
 
 
+class PangoContextPool(object):
+    """Pango contexts shared by the layouts used to measure text.
+
+    Creating a Pango context needs a cairo context, and thus a cairo surface.
+    A context is created once for each hinting mode, font map and language,
+    and each new layout is then created from one of these contexts.
+
+    Only the contexts of the last font map are kept, as the font maps of
+    documents declaring fonts are not used by the next documents.
+
+    """
+    def __init__(self):
+        self._contexts = {}
+        self._font_map = None
+        #: Number of Pango contexts (and dummy cairo surfaces) created.
+        self.contexts_created = 0
+        #: Number of Pango layouts created.
+        self.layouts_created = 0
+
+    def create_layout(self, hinting, font_map, language):
+        """Return a new PangoLayout cdata pointer.
+
+        :param hinting: whether the layout is used for pixel-based output.
+        :param font_map: a PangoFontMap cdata pointer, or ``None`` for the
+            default font map.
+        :param language: a PangoLanguage cdata pointer, or ``None`` for the
+            default language.
+
+        """
+        if font_map != self._font_map:
+            self._contexts.clear()
+            self._font_map = font_map
+        key = hinting, language
+        pango_context = self._contexts.get(key)
+        if pango_context is None:
+            cairo_dummy_context = (
+                cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
+                if hinting else cairo.Context(cairo.PDFSurface(None, 1, 1)))
+            pango_context = ffi.gc(
+                pangocairo.pango_cairo_create_context(ffi.cast(
+                    'cairo_t *', cairo_dummy_context._pointer)),
+                gobject.g_object_unref)
+            if font_map:
+                pango.pango_context_set_font_map(pango_context, font_map)
+            if language:
+                pango.pango_context_set_language(pango_context, language)
+            self._contexts[key] = pango_context
+            self.contexts_created += 1
+        self.layouts_created += 1
+        return ffi.gc(
+            pango.pango_layout_new(pango_context), gobject.g_object_unref)
+
+
+_LOCAL = threading.local()
+
+
+def get_pango_context_pool(context):
+    """Return the pool of Pango contexts used for ``context``.
+
+    Each layout context has its own pool, layouts created without a layout
+    context use a pool shared by the current thread.
+
+    """
+    if context is not None:
+        return context.pango_context_pool
+    pool = getattr(_LOCAL, 'pango_context_pool', None)
+    if pool is None:
+        pool = _LOCAL.pango_context_pool = PangoContextPool()
+    return pool
+
+
 class Layout(object):
     """Object holding PangoLayout-related cdata pointers."""
     def __init__(self, context, font_size, style):
         self.context = context
         hinting = context.enable_hinting if context else False
-        cairo_dummy_context = (
-            cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
-            if hinting else cairo.Context(cairo.PDFSurface(None, 1, 1)))
-        self.layout = ffi.gc(
-            pangocairo.pango_cairo_create_layout(ffi.cast(
-                'cairo_t *', cairo_dummy_context._pointer)),
-            gobject.g_object_unref)
-        pango_context = pango.pango_layout_get_context(self.layout)
-        if context and context.font_config.font_map:
-            pango.pango_context_set_font_map(
-                pango_context, context.font_config.font_map)
-        self.font = ffi.gc(
-            pango.pango_font_description_new(),
-            pango.pango_font_description_free)
+        font_map = context.font_config.font_map if context else None
         if style['font_language_override'] != 'normal':
             lang_p, lang = unicode_to_char_p(LST_TO_ISO.get(
                 style['font_language_override'].lower(),
@@ -655,7 +734,11 @@ class Layout(object):
             self.language = pango.pango_language_get_default()
         if lang:
             self.language = pango.pango_language_from_string(lang_p)
-            pango.pango_context_set_language(pango_context, self.language)
+        self.layout = get_pango_context_pool(context).create_layout(
+            hinting, font_map, self.language if lang else None)
+        self.font = ffi.gc(
+            pango.pango_font_description_new(),
+            pango.pango_font_description_free)
 
         assert not isinstance(style['font_family'], basestring), (
             'font_family should be a list')
@@ -916,9 +999,203 @@ def create_layout(text, style, context, max_width, justification_spacing):
     return layout
 
 
+class LazyLayout(object):
+    """Layout whose PangoLayout is only created when it is needed.
+
+    Returned by :func:`split_first_line` for results taken from the cache,
+    where only the text of the first line is known. The PangoLayout is
+    created again when the text is drawn.
+
+    """
+    def __init__(self, text_bytes, style, context, justification_spacing):
+        self.text_bytes = text_bytes
+        self._style = style
+        self._context = context
+        self._justification_spacing = justification_spacing
+        self._layout = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._layout is None:
+            self._layout = create_layout(
+                self.text_bytes.decode('utf8'), self._style, self._context,
+                None, self._justification_spacing)
+        return getattr(self._layout, name)
+
+
+class FirstLineCache(object):
+    """Bounded LRU cache of the measurements given by
+    :func:`split_first_line`.
+
+    """
+    # Properties used by split_first_line and create_layout
+    style_keys = (
+        'font_size', 'font_family', 'font_style', 'font_stretch',
+        'font_weight', 'font_language_override', 'lang', 'letter_spacing',
+        'word_spacing', 'white_space', 'tab_size', 'hyphens',
+        'hyphenate_character', 'hyphenate_limit_zone',
+        'hyphenate_limit_chars', 'overflow_wrap', 'font_kerning',
+        'font_variant_ligatures', 'font_variant_position',
+        'font_variant_caps', 'font_variant_numeric',
+        'font_variant_alternates', 'font_variant_east_asian',
+        'font_feature_settings')
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+        #: Number of measurements found in the cache.
+        self.hits = 0
+        #: Number of measurements missing from the cache.
+        self.misses = 0
+
+    def key(self, text, style, max_width, justification_spacing, hinting):
+        return (text,) + self.style_key(
+            style, max_width, justification_spacing, hinting)
+
+    @classmethod
+    def style_key(cls, style, max_width, justification_spacing, hinting):
+        style_values = tuple(
+            tuple(style[key]) if key == 'font_family' else style[key]
+            for key in cls.style_keys)
+        return style_values, max_width, justification_spacing, hinting
+
+    def get(self, key):
+        result = self._results.pop(key, None)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._results[key] = result
+        return result
+
+    def set(self, key, result):
+        self._results[key] = result
+        if len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+
+class ShapedLines(object):
+    """Lines of the last text shaped by :func:`split_first_line`.
+
+    The text split for a line is generally the end of the text split for the
+    previous line. The lines of the last layout shaped and broken by Pango
+    are kept, the next lines of the same text are then taken from this
+    layout instead of shaping the rest of the text again.
+
+    """
+    def __init__(self):
+        self._key = None
+        self._text_bytes = b''
+        self._layout = None
+        self._lines = {}
+        self._last_index = -1
+        self._length = 0
+        #: Number of lines found in the last layout.
+        self.hits = 0
+        #: Number of lines missing from the last layout.
+        self.misses = 0
+
+    def get(self, key, text_bytes):
+        """Return ``(line, second_line_index)`` for the text ``text_bytes``.
+
+        ``line`` is the PangoLayoutLine starting the text, and
+        ``second_line_index`` the index in ``text_bytes`` of the next line,
+        or ``None`` if the line ends the text. Return ``None`` if the line
+        is not in the last layout.
+
+        """
+        if key == self._key and self._text_bytes.endswith(text_bytes):
+            offset = len(self._text_bytes) - len(text_bytes)
+            result = self._lines.get(offset)
+            if result is not None:
+                self.hits += 1
+                line, next_index = result
+                return line, (
+                    None if next_index is None else next_index - offset)
+        self.misses += 1
+        return None
+
+    def draft_length(self, key, text_bytes):
+        """Return the minimum number of characters to shape for a new layout.
+
+        When all the lines of the last layout have been used, the new layout
+        shapes twice more text, so that the text of a long paragraph is
+        shaped a limited number of times.
+
+        """
+        if key == self._key and self._text_bytes.endswith(text_bytes):
+            if len(self._text_bytes) - len(text_bytes) > self._last_index:
+                return 2 * self._length
+        return 0
+
+    def set(self, key, text_bytes, layout, length):
+        """Keep the lines of ``layout``.
+
+        ``layout`` must not be changed anymore. Its text is made of the
+        first ``length`` characters of the text ``text_bytes``.
+
+        """
+        lines = []
+        line_list = pango.pango_layout_get_lines_readonly(layout.layout)
+        while line_list != ffi.NULL:
+            lines.append(ffi.cast('PangoLayoutLine *', line_list.data))
+            line_list = line_list.next
+        if len(layout.text_bytes) < len(text_bytes):
+            # The end of the text is missing: the last line may be cut too
+            # early, the line before may be cut elsewhere
+            lines_number = len(lines) - 2
+        else:
+            lines_number = len(lines)
+        self._lines = {}
+        self._last_index = -1
+        for i, line in enumerate(lines[:max(0, lines_number)]):
+            next_index = (
+                lines[i + 1].start_index if i + 1 < len(lines) else None)
+            self._lines[line.start_index] = line, next_index
+            self._last_index = line.start_index
+        self._key = key
+        self._text_bytes = text_bytes
+        self._layout = layout
+        self._length = length
+
+
 def split_first_line(text, style, context, max_width, justification_spacing):
     """Fit as much as possible in the available width for one line of text.
 
+    Return ``(layout, length, resume_at, width, height, baseline)``, as
+    :func:`_split_first_line`.
+
+    The results are cached in the ``first_line_cache`` of ``context``. The
+    layouts returned for cached results are :class:`LazyLayout` objects.
+
+    The lines shaped for the rest of the text are kept in the
+    ``shaped_lines`` of ``context``, see :class:`ShapedLines`.
+
+    """
+    if context is None:
+        return _split_first_line(
+            text, style, context, max_width, justification_spacing)
+    cache = context.first_line_cache
+    key = cache.key(
+        text, style, max_width, justification_spacing, context.enable_hinting)
+    result = cache.get(key)
+    if result is None:
+        result = _split_first_line(
+            text, style, context, max_width, justification_spacing)
+        layout, length, resume_at, width, height, baseline = result
+        cache.set(
+            key, (layout.text_bytes, length, resume_at, width, height,
+                  baseline))
+        return result
+    text_bytes, length, resume_at, width, height, baseline = result
+    layout = LazyLayout(text_bytes, style, context, justification_spacing)
+    return layout, length, resume_at, width, height, baseline
+
+
+def _split_first_line(text, style, context, max_width, justification_spacing):
+    """Fit as much as possible in the available width for one line of text.
+
     Return ``(layout, length, resume_at, width, height, baseline)``.
 
     ``layout``: a pango Layout with the first line
@@ -940,28 +1217,63 @@ def split_first_line(text, style, context, max_width, justification_spacing):
         max_width = None
 
     # Step #1: Get a draft layout with the first line
-    layout = None
-    if max_width is not None and max_width != float('inf') and style.font_size:
-        expected_length = int(max_width / style.font_size * 2.5)
-        if expected_length < len(text):
-            # Try to use a small amount of text instead of the whole text
+    keep_lines = context is not None and max_width is not None
+    shaped_line = None
+    if keep_lines:
+        # Take the line from the layout shaped for the previous line
+        shaped_lines = context.shaped_lines
+        lines_key = FirstLineCache.style_key(
+            style, max_width, justification_spacing, context.enable_hinting)
+        text_bytes = text.encode('utf-8')
+        shaped_line = shaped_lines.get(lines_key, text_bytes)
+    if shaped_line is None:
+        layout = None
+        draft_length = len(text)
+        if (max_width is not None and max_width != float('inf') and
+                style.font_size):
+            expected_length = max(1, int(max_width / style.font_size * 2.5))
+            if keep_lines:
+                expected_length = max(
+                    expected_length,
+                    shaped_lines.draft_length(lines_key, text_bytes))
+            while expected_length < len(text):
+                # Try to use a small amount of text instead of the whole text
+                layout = create_layout(
+                    text[:expected_length], style, context, max_width,
+                    justification_spacing)
+                lines = layout.iter_lines()
+                first_line = next(lines, None)
+                second_line = next(lines, None)
+                if second_line is not None:
+                    draft_length = expected_length
+                    break
+                # The small amount of text fits in one line, try again with
+                # twice more text. Shaping the whole remaining text for each
+                # line of a long paragraph would be quadratic.
+                layout = None
+                expected_length *= 2
+        if layout is None:
             layout = create_layout(
-                text[:expected_length], style, context, max_width,
-                justification_spacing)
+                text, style, context, max_width, justification_spacing)
             lines = layout.iter_lines()
             first_line = next(lines, None)
             second_line = next(lines, None)
-            if second_line is None:
-                # The small amount of text fits in one line, give up and use
-                # the whole text
-                layout = None
-    if layout is None:
+        resume_at = None if second_line is None else second_line.start_index
+        if keep_lines and second_line is not None:
+            # Keep the next lines of the draft layout for the next calls
+            shaped_lines.set(lines_key, text_bytes, layout, draft_length)
+            shaped_line = first_line, resume_at
+    if shaped_line is not None:
+        # The layout keeping the lines must not be changed, the next steps
+        # set the text of a new layout, only shaped when it is measured
+        first_line, resume_at = shaped_line
+        end = len(text)
+        if resume_at is not None:
+            # Include the first word of the second line, used by step #3
+            end = text.find(
+                ' ', len(text_bytes[:resume_at].decode('utf-8'))) + 1 or end
         layout = create_layout(
-            text, style, context, max_width, justification_spacing)
-        lines = layout.iter_lines()
-        first_line = next(lines, None)
-        second_line = next(lines, None)
-    resume_at = None if second_line is None else second_line.start_index
+            text[:end], style, context, max_width, justification_spacing)
 
     # Step #2: Don't split lines when it's not needed
     if max_width is None:
@@ -969,7 +1281,7 @@ def split_first_line(text, style, context, max_width, justification_spacing):
         return first_line_metrics(
             first_line, text, layout, resume_at, space_collapse, style)
     first_line_width, _ = get_size(first_line, style)
-    if second_line is None and first_line_width <= max_width:
+    if resume_at is None and first_line_width <= max_width:
         # The first line fits in the available width
         return first_line_metrics(
             first_line, text, layout, resume_at, space_collapse, style)
@@ -979,7 +1291,7 @@ def split_first_line(text, style, context, max_width, justification_spacing):
     # is a good thread related to this problem.
     if first_line_width <= max_width:
         # The first line may have been cut too early by Pango
-        second_line_index = second_line.start_index
+        second_line_index = resume_at
         first_line_text = utf8_slice(text, slice(second_line_index))
         second_line_text = utf8_slice(text, slice(second_line_index, None))
     else:
@@ -1169,17 +1481,100 @@ def split_first_line(text, style, context, max_width, justification_spacing):
         style.hyphenate_character)
 
 
+def min_content_line_widths(text, style, context, justification_spacing):
+    """Return the widths of the lines of ``text`` broken at each break
+    opportunity, or :obj:`None` if the text needs :func:`split_first_line`.
+
+    The whole text is shaped once in a layout of null width, where Pango puts
+    each unbreakable segment on its own line. Calling
+    :func:`split_first_line` with a null width for each segment gives the
+    same widths, but shapes the rest of the text each time.
+
+    Hyphenation and broken words need the line breaking algorithm of
+    :func:`split_first_line`, widths are not measured for text using them.
+
+    """
+    if style.white_space not in ('normal', 'pre-line'):
+        return None
+    if style.overflow_wrap == 'break-word':
+        return None
+    if style.hyphens == 'auto' and style.lang:
+        return None
+    if u'\u00ad' in text:
+        return None
+
+    layout = create_layout(text, style, context, 0, justification_spacing)
+    text_bytes = layout.text_bytes
+    x_pos = ffi.new('int *')
+    widths = []
+    for line in layout.iter_lines():
+        start, end = line.start_index, line.start_index + line.length
+        # Collapsible spaces at the end of lines are removed
+        stripped_end = len(text_bytes[start:end].rstrip(b' ')) + start
+        if stripped_end == end:
+            width, _ = get_size(line, style)
+        else:
+            # Distance between the leading edges of the first character and
+            # of the first removed space, right-to-left text included
+            pango.pango_layout_line_index_to_x(line, start, 0, x_pos)
+            start_x = x_pos[0]
+            pango.pango_layout_line_index_to_x(line, stripped_end, 0, x_pos)
+            width = units_to_double(abs(x_pos[0] - start_x))
+            if style['letter_spacing'] != 'normal':
+                width += style['letter_spacing']
+        widths.append(width)
+    return widths
+
+
+def _copy_layout(context, layout):
+    """Return a copy of ``layout`` using a new Pango context for ``context``.
+
+    The new Pango context gets the font options and the transformation of
+    the cairo ``context``.
+
+    """
+    pango_context = pango.pango_layout_get_context(layout)
+    new_context = ffi.gc(
+        pangocairo.pango_cairo_create_context(context),
+        gobject.g_object_unref)
+    pango.pango_context_set_font_map(
+        new_context, pango.pango_context_get_font_map(pango_context))
+    pango.pango_context_set_language(
+        new_context, pango.pango_context_get_language(pango_context))
+    new_layout = ffi.gc(
+        pango.pango_layout_new(new_context), gobject.g_object_unref)
+    pango.pango_layout_set_text(
+        new_layout, pango.pango_layout_get_text(layout), -1)
+    font = pango.pango_layout_get_font_description(layout)
+    if font != ffi.NULL:
+        pango.pango_layout_set_font_description(new_layout, font)
+    attributes = pango.pango_layout_get_attributes(layout)
+    if attributes != ffi.NULL:
+        pango.pango_layout_set_attributes(new_layout, attributes)
+    tabs = pango.pango_layout_get_tabs(layout)
+    if tabs != ffi.NULL:
+        tabs = ffi.gc(tabs, pango.pango_tab_array_free)
+        pango.pango_layout_set_tabs(new_layout, tabs)
+    pango.pango_layout_set_wrap(
+        new_layout, pango.pango_layout_get_wrap(layout))
+    return new_layout
+
+
 def show_first_line(context, pango_layout, hinting):
     """Draw the given ``line`` to the Cairo ``context``."""
     context = ffi.cast('cairo_t *', context._pointer)
+    layout = pango_layout.layout
     if hinting:
-        pangocairo.pango_cairo_update_layout(context, pango_layout.layout)
+        # Hinted text is drawn with the font options and the transformation
+        # of the cairo context. They are not set on the Pango context of the
+        # layout, shared by the layouts measuring text, but on a copy.
+        layout = _copy_layout(context, layout)
     # Set an infinite width as we don't want to break lines when drawing, the
     # lines have already been split and the size may differ for example because
     # of hinting.
-    pango.pango_layout_set_width(pango_layout.layout, -1)
+    pango.pango_layout_set_width(layout, -1)
     pangocairo.pango_cairo_show_layout_line(
-        context, next(pango_layout.iter_lines()))
+        context, pango.pango_layout_get_line_readonly(layout, 0))
 
 
 def can_break_text(text, lang):